@@ -1,18 +1,30 @@
-from lxml import etree
-import json
-try:
-    import urllib.request as req
-except ImportError:
-    import urllib as req
+from itertools import islice
+
 from lxml import etree
 
+from intermine import registry
+from intermine.query_manager import QueryManager
 from intermine.webservice import Service
-from math import log
-import json
-import requests
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+"""
+Functions for plotting bar charts of query and enrichment results
+================================================
+
+The mine is looked up once, by save_mine_and_token (or given directly to
+set_service), and every later call reuses the same service.
+
+Charts are shown on screen by default. If an output file name is given
+instead, the chart is drawn off-screen and saved there, without going
+through pyplot, which is much faster when drawing many charts at once.
+"""
+
+mine = None
+token = None
+_service = None
 
 
 def save_mine_and_token(m, t):
@@ -21,27 +33,22 @@ def save_mine_and_token(m, t):
     ================================================
     example:
 
-        >>>from intermine import query_manager as qm
+        >>>from intermine import bar_chart as b
         >>>b.save_mine_and_token("humanmine","<enter token>")
         <now you can access account linked to the token>
     """
     global mine
     global token
+    global _service
     mine = m
     token = t
-    src = "http://registry.intermine.org/service/instances/" + mine
     try:
-        # tests if mine is valid by checking if object 'obj' exists
-        m = requests.get(src)
-        data = json.loads(m.text)
-        obj = data["instance"]["url"]
-        obj = data["instance"]["url"] + "/service/user/queries?token=" + \
-            token
+        # tests if mine is valid by looking it up in the registry
+        service = Service(registry.get_client().instance(mine)["url"],
+                          token=token)
         try:
-            # tests if token is valid by checking if object 'obj' exists
-            o = requests.get(obj)
-            data = json.loads(o.text)
-            obj = data['queries'].keys()
+            # tests if token is valid by fetching the saved queries
+            QueryManager(service).catalogue
             # checks the type fo exception
         except Exception as ex:
             template = "An exception of type {0} occurred."
@@ -51,134 +58,76 @@ def save_mine_and_token(m, t):
         template = "An exception of type {0} occurred."
         message = template.format(type(ex).__name__, ex.args)
         return message + " Check mine"
+    _service = service
 
 
-def plot_go_vs_p(list_name):
+def set_service(service):
     """
-    A function to plot GO Term vs P-value with label of gene count on each bar
+    A function to plot data from a service you have already connected to
     ================================================
     example:
 
-        >>>from intermine import query_manager as qm
-        >>>b.plot_go_vs_p("PL_obesityMonogen_ORahilly09")
+        >>>from intermine import bar_chart as b
+        >>>b.set_service(Service("https://www.humanmine.org/humanmine"))
 
     """
-    link = "http://registry.intermine.org/service/instances/" + mine
-    r = requests.get(link)
+    global _service
+    _service = service
 
-    dict = json.loads(r.text)
-    url = dict["instance"]["url"]
-    service = Service(url)
 
-    lm = service.list_manager()
-    store = lm.get_list(name=list_name)
-    r = store.calculate_enrichment(widget="go_enrichment_for_gene")
-
-    gene_count = []
-    identifier = []
-    p_value = []
-    object_count = 0
-    for i in r:
-        if object_count < 5:
-            gene_count.append(i.matches)
-            identifier.append(i.identifier)
-            p_value.append(i.p_value)
-            object_count = object_count + 1
-        else:
-            if object_count >= 5:
-                break
-    y = pd.Series(p_value)
-    x = identifier
-    # Plot the figure.
-
-    ax = y.plot(kind='bar')
-    ax.set_title('GO Term vs p-value (Label: Gene count)')
-    ax.set_xlabel('GO Term')
-    ax.set_ylabel('p_value')
-    ax.set_xticklabels(x, rotation='horizontal')
-
-    rects = ax.patches
-
-    def autolabel(rects, ax):
-        i = 0
-        for rect in rects:
-            x = rect.get_x() + rect.get_width()/2.
-            y = rect.get_height()
-            ax.annotate(gene_count[i], (x, y), xytext=(0, 5),
-                        textcoords="offset points",
-                        ha='center', va='bottom')
-            i = i+1
-
-    autolabel(ax.patches, ax)
+def get_service():
+    """
+    A function to return the service that charts are drawn from
+    ================================================
 
-    ax.margins(y=0.1)
-    plt.show()
+    """
+    if _service is None:
+        raise ValueError("No mine selected - call save_mine_and_token first")
+    return _service
+
+
+def plot_go_vs_p(list_name, output=None):
+    """
+    A function to plot GO Term vs P-value with label of gene count on each bar
+    ================================================
+    example:
+
+        >>>from intermine import bar_chart as b
+        >>>b.plot_go_vs_p("PL_obesityMonogen_ORahilly09")
+
+    """
+    rows = _top_go_terms(list_name)
+    return _bar_chart(
+        [r.identifier for r in rows], [r.p_value for r in rows],
+        [r.matches for r in rows],
+        title='GO Term vs p-value (Label: Gene count)',
+        xlabel='GO Term', ylabel='p_value', output=output)
 
 
-def plot_go_vs_count(list_name):
+def plot_go_vs_count(list_name, output=None):
     """
     A function to plot GO Term vs gene count with label of annotation
     on each bar
     ================================================
     example:
 
-        >>>from intermine import query_manager as qm
+        >>>from intermine import bar_chart as b
         >>>b.plot_go_vs_count("PL_obesityMonogen_ORahilly09")
 
     """
-    link = "http://registry.intermine.org/service/instances/" + mine
-    r = requests.get(link)
+    rows = _top_go_terms(list_name)
+    return _bar_chart(
+        [r.identifier for r in rows], [r.matches for r in rows],
+        [r.populationAnnotationCount for r in rows],
+        title='GO Term vs Count (Label: Annotation)',
+        xlabel='GO Term', ylabel='Number of Genes', output=output)
 
-    dict = json.loads(r.text)
-    url = dict["instance"]["url"]
-    service = Service(url)
 
-    lm = service.list_manager()
+def _top_go_terms(list_name, count=5):
+    lm = get_service().list_manager()
     store = lm.get_list(name=list_name)
-    r = store.calculate_enrichment(widget="go_enrichment_for_gene")
-
-    gene_count = []
-    identifier = []
-    p_value = []
-    annotation_count = []
-    object_count = 0
-    for i in r:
-        if object_count < 5:
-            gene_count.append(i.matches)
-            identifier.append(i.identifier)
-            p_value.append(i.p_value)
-            annotation_count.append(i.populationAnnotationCount)
-            object_count = object_count + 1
-        else:
-            if object_count >= 5:
-                break
-
-    y = pd.Series(gene_count)
-    x = identifier
-
-    # Plot the figure.
-
-    ax = y.plot(kind='bar')
-    ax.set_title('GO Term vs Count (Label: Annotation)')
-    ax.set_xlabel('GO Term')
-    ax.set_ylabel('Number of Genes')
-    ax.set_xticklabels(x, rotation='horizontal')
-
-    rects = ax.patches
-
-    def autolabel(rects, ax):
-        i = 0
-        for rect in rects:
-            x = rect.get_x() + rect.get_width()/2.
-            y = rect.get_height()
-            ax.annotate(annotation_count[i], (x, y), xytext=(0, 5),
-                        textcoords="offset points",
-                        ha='center', va='bottom')
-            i = i+1
-
-    autolabel(ax.patches, ax)
-    ax.margins(y=0.1)
-    plt.show()
+    r = store.calculate_enrichment(widget="go_enrichment_for_gene", row="row")
+    return list(islice(r, count))
 
 
 def get_query(xml):
@@ -187,19 +136,94 @@ def get_query(xml):
     ================================================
 
     """
-    link = "http://registry.intermine.org/service/instances/" + mine
-    r = requests.get(link)
-    dict = json.loads(r.text)
-    link = dict["instance"]["url"] + "/service/query/results?query=" + \
-        req.pathname2url(xml)
-    r = requests.get(link)
-    list = (r.text).split('\n')
-    for i in range(0, len(list)-1):
-        list[i] = list[i].split('\t')
-    return (list)
-
-
-def query_to_barchart_log(xml, resp):
+    query = get_service().load_query(xml)
+    return [line.split('\t') for line in query.results(row='tsv')]
+
+
+def load_columns(xml, label_column=1, value_column=2):
+    """
+    A function to load a label column and a numeric column of a query
+    ================================================
+
+    The results are streamed as TSV straight into NumPy arrays, without
+    building a list of every row first. Returns the labels, the values and
+    the first cell of the first row (used as the title of the charts).
+
+    example:
+
+        >>>from intermine import bar_chart as b
+        >>>labels, values, first = b.load_columns(<xml>)
+
+    """
+    query = get_service().load_query(xml)
+    labels = []
+    firsts = []
+
+    def values():
+        for line in query.results(row='tsv'):
+            cells = line.split('\t')
+            if not firsts:
+                firsts.append(cells[0])
+            labels.append(cells[label_column])
+            yield cells[value_column]
+
+    values = np.fromiter(values(), dtype=float)
+    return (np.array(labels, dtype=object), values,
+            firsts[0] if firsts else '')
+
+
+def log_values(values):
+    """
+    A function to take the natural log of an array, rounded to 2 places
+    ================================================
+
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.round(np.log(np.asarray(values, dtype=float)), 2)
+
+
+def query_to_barchart(xml, log=False, summarise=False, output=None):
+    """
+    A function to plot a query from its xml
+    ================================================
+
+    The second column of the query is the x-axis, and the third column the
+    y-axis, optionally as its log values.
+
+    If summarise is true, the query is instead summarised on the server,
+    and the chart shows how many results there are for each value of the
+    second column.
+
+    If output is a file name, the chart is saved there instead of being
+    shown, and the figure is returned.
+
+    example:
+
+        >>>from intermine import bar_chart as b
+        >>>b.query_to_barchart(<xml>, log=True, output="chart.png")
+
+    """
+    store = etree.fromstring(xml).attrib['view'].split(' ')
+    if summarise:
+        query = get_service().load_query(xml)
+        counts = query.summarise(store[1])
+        labels = np.array(list(counts.keys()), dtype=object)
+        values = np.fromiter(counts.values(), dtype=float, count=len(counts))
+        title, ylabel = store[1], 'count'
+    else:
+        labels, values, title = load_columns(xml)
+        ylabel = store[2]
+
+    if log:
+        values = log_values(values)
+        ylabel = 'log(' + ylabel + ')'
+
+    return _bar_chart(labels, values, values, title=title,
+                      xlabel=store[1], ylabel=ylabel,
+                      rotation='vertical', output=output)
+
+
+def query_to_barchart_log(xml, resp, output=None):
     """
     A function to plot a query from its xml
     NOTE: first argument:
@@ -212,50 +236,41 @@ def query_to_barchart_log(xml, resp):
     ================================================
     example:
 
-        >>>from intermine import query_manager as qm
+        >>>from intermine import bar_chart as b
         >>>b.query_to_barchart_log(<xml>, 'true')
         <plots the second column vs log(third column)>
 
     """
-    list = get_query(xml)
-    root = etree.fromstring(xml)
-    store = root.attrib['view']
-    store = store.split(' ')
-    x_val = []
-    y_val = []
-    for i in range(0, len(list)-1):
-        x_val.append(list[i][1])
-        y_val.append(float(list[i][2]))
-
-    if resp == 'true':
-        y_val = np.log(y_val)
-        y_val = np.round_(y_val, 2)
-
-    y = pd.Series(y_val)
-    x = pd.Series(x_val)
-
-    ax = y.plot(kind='bar')
-    ax.set_title(list[0][0])
-    ax.set_xlabel(store[1])
-    if resp == 'true':
-        ax.set_ylabel('log(' + store[2] + ')')
-    else:
-        ax.set_ylabel(store[2])
-    ax.set_xticklabels(x, rotation='vertical')
-
-    rects = ax.patches
+    return query_to_barchart(xml, log=(resp == 'true'), output=output)
 
-    def autolabel(rects, ax):
-        i = 0
-        for rect in rects:
-            x = rect.get_x() + rect.get_width()/2.
-            y = rect.get_height()
-            ax.annotate(y_val[i], (x, y), xytext=(0, 5),
-                        textcoords="offset points",
-                        ha='center', va='bottom')
-            i = i+1
 
-    autolabel(ax.patches, ax)
+def _bar_chart(labels, values, annotations, title, xlabel, ylabel,
+               rotation='horizontal', output=None):
+    if output is None:
+        fig = plt.figure()
+    else:
+        fig = Figure()
+        FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+
+    positions = np.arange(len(values))
+    rects = ax.bar(positions, values)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels, rotation=rotation)
+
+    for rect, annotation in zip(rects, annotations):
+        x = rect.get_x() + rect.get_width()/2.
+        y = rect.get_height()
+        ax.annotate(annotation, (x, y), xytext=(0, 5),
+                    textcoords="offset points",
+                    ha='center', va='bottom')
 
     ax.margins(y=0.1)
-    plt.show()
+    if output is None:
+        plt.show()
+    else:
+        fig.savefig(output)
+    return fig
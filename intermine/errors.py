@@ -13,3 +13,8 @@ class ServiceError(ReadableException):
 class WebserviceError(IOError):
     """Errors from interaction with the webservice"""
     pass
+
+
+class CircuitOpenError(WebserviceError):
+    """Requests to a service have been suspended after repeated failures"""
+    pass
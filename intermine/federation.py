@@ -0,0 +1,297 @@
+import heapq
+import threading
+from itertools import count
+from xml.dom import minidom
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+from intermine.query import Query, QueryError
+from intermine.util import map_concurrently
+
+"""
+Running queries against many mines at once
+==========================================
+
+Classes for running the same logical query against several services
+(usually mines from a L{intermine.webservice.Registry}) concurrently,
+and merging their results into a single stream.
+
+"""
+
+_DONE = object()
+
+
+class FederatedQuery(object):
+    """
+    A query run against many mines at once
+    ======================================
+
+    A federated query runs the same logical query against a number of
+    services, each in its own thread, and yields the rows from all of them
+    as (mine, row) pairs::
+
+        from intermine.webservice import Registry
+        from intermine.federation import FederatedQuery
+
+        registry = Registry()
+        mines = registry.connect_all(["FlyMine", "HumanMine", "MouseMine"])
+
+        query = mines["FlyMine"].select("Gene.symbol", "Gene.organism.name")
+        query.where("Gene.symbol", "CONTAINS", "zen")
+
+        federated = FederatedQuery(mines, query)
+        for mine, row in federated.rows():
+            print(mine, row["Gene.symbol"])
+
+        # Or merged into a single order, as with an ORDER BY:
+        for mine, row in federated.rows(order_by=["Gene.symbol"]):
+            print(mine, row["Gene.symbol"])
+
+    The query may be given as a L{intermine.query.Query}, as XML, or as a
+    function that builds the query for each service. Where mines name
+    things differently, the paths used for each mine can be translated
+    with a dictionary of replacements per mine::
+
+        translations = {"MouseMine": {"Gene.symbol": "Gene.primaryIdentifier"}}
+
+    A replacement applies to the path itself and to any longer path that
+    starts with it. Every query is checked against the model of the mine
+    it will run on before anything is run. Mines where the query is not
+    valid, or which fail while results are being read, are left out, and
+    their errors are stored in L{errors}.
+    """
+
+    MAX_WORKERS = 8
+    BUFFER_SIZE = 1000
+
+    PATH_ATTRIBUTES = ("view", "sortOrder", "path", "loopPath", "pathString")
+
+    ORDERABLE_FORMATS = ("rr", "list", "dict")
+
+    def __init__(self, services, query, translations=None,
+                 max_workers=MAX_WORKERS):
+        """
+        Constructor
+        ===========
+
+        @param services: A mapping of mine names to services, such as a
+                         L{intermine.webservice.Registry} or the result of
+                         L{intermine.webservice.Registry.connect_all}
+        @param query: A query, its XML, or a function from a service
+                      to a query
+        @param translations: A dictionary from mine names to dictionaries
+                             of path replacements (optional)
+        @param max_workers: The maximum number of mines to query at once
+        """
+        self.services = dict(services.items())
+        self.query = query
+        self.translations = translations or {}
+        self.max_workers = max_workers
+        self.errors = {}
+        self._queries = None
+
+    def translate(self, mine, path):
+        """
+        Translate a path for a particular mine
+        ======================================
+
+        @rtype: string
+        """
+        replacements = self.translations.get(mine, {})
+        for old in sorted(replacements, key=len, reverse=True):
+            if path == old or path.startswith(old + "."):
+                return replacements[old] + path[len(old):]
+        return path
+
+    def _translate_xml(self, mine, xml):
+        if not self.translations.get(mine):
+            return xml
+        doc = minidom.parseString(xml)
+        for element in doc.getElementsByTagName("*"):
+            for name in self.PATH_ATTRIBUTES:
+                if element.hasAttribute(name):
+                    paths = element.getAttribute(name).split()
+                    element.setAttribute(name, " ".join(
+                        self.translate(mine, p) for p in paths))
+        return doc.documentElement.toxml()
+
+    def _build(self, mine, service):
+        if callable(self.query):
+            query = self.query(service)
+            query.verify()
+            return query
+        if isinstance(self.query, Query):
+            xml = self.query.to_xml()
+        else:
+            xml = self.query
+        return service.load_query(self._translate_xml(mine, xml))
+
+    def queries(self):
+        """
+        Build and check the query for each mine
+        =======================================
+
+        The queries are built concurrently, since checking them may mean
+        fetching the model of each mine. Mines whose query cannot be
+        built are left out, and their errors are stored in L{errors}.
+
+        @rtype: dict(string, L{intermine.query.Query})
+        """
+        if self._queries is None:
+            self._queries = {}
+            for (mine, service), query, error in map_concurrently(
+                    lambda pair: self._build(*pair),
+                    self.services.items(), self.max_workers):
+                if error is None:
+                    self._queries[mine] = query
+                else:
+                    self.errors[mine] = error
+        return self._queries
+
+    def _ordered(self, mine, query, order_by):
+        query = query.clone()
+        query.clear_sort_order()
+        columns = []
+        for key in order_by:
+            path, direction = key if isinstance(key, tuple) else (key, "asc")
+            path = query.prefix_path(self.translate(mine, path))
+            if path not in query.views:
+                raise QueryError(
+                    "Cannot order the results of %s by %s, as it is not "
+                    "in the view" % (mine, path))
+            query.add_sort_order(path, direction)
+            columns.append((query.views.index(path),
+                            direction.lower() == "desc"))
+        return query, columns
+
+    def rows(self, row="rr", order_by=None, **kwargs):
+        """
+        Return an iterator over the rows from every mine
+        ================================================
+
+        Each item is a (mine, row) pair, where the row is in the format
+        requested (as for L{intermine.query.Query.results}). Without an
+        order, rows are yielded as soon as any mine returns them.
+
+        When order_by is given (as a list of paths, or of (path,
+        direction) pairs, which must be in the view), each mine is asked
+        for its results in that order, and these are merged as they
+        arrive so that the combined results are in order too. Ordered
+        merges need rows that can be read by column ("rr", "list" or
+        "dict"). As in the database, null values come last in ascending
+        orders. Mines whose query cannot be ordered that way are left
+        out, and their errors stored in L{errors}, unless none of them
+        can be, when the error is raised.
+
+        Any other keyword arguments are passed to
+        L{intermine.query.Query.results}.
+
+        @rtype: iterable of (string, row)
+        """
+        queries = self.queries()
+        stop = threading.Event()
+        if order_by is None:
+            out = Queue(self.BUFFER_SIZE)
+            for mine, query in queries.items():
+                self._start(mine, query, row, kwargs, out, stop)
+            return self._unordered(out, len(queries), stop)
+
+        if row not in self.ORDERABLE_FORMATS:
+            raise ValueError("Cannot merge rows in %r format in order - "
+                             "use one of %s" % (row, self.ORDERABLE_FORMATS))
+        # Check which queries can be ordered before starting any of them
+        ordered = []
+        errors = {}
+        for mine, query in queries.items():
+            try:
+                query, columns = self._ordered(mine, query, order_by)
+            except QueryError as e:
+                errors[mine] = e
+                continue
+            if row == "dict":
+                columns = [(query.views[i], desc) for i, desc in columns]
+            ordered.append((mine, query, columns))
+        if errors and not ordered:
+            raise errors[sorted(errors)[0]]
+        self.errors.update(errors)
+        streams = []
+        for mine, query, columns in ordered:
+            out = Queue(self.BUFFER_SIZE)
+            self._start(mine, query, row, kwargs, out, stop)
+            streams.append(self._keyed(out, columns))
+        return self._merged(streams, stop)
+
+    def _start(self, mine, query, row, kwargs, out, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return
+                except Full:
+                    pass
+
+        def produce():
+            try:
+                for result in query.results(row=row, **kwargs):
+                    if stop.is_set():
+                        break
+                    put((mine, result))
+            except Exception as e:
+                self.errors[mine] = e
+            finally:
+                put(_DONE)
+
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+
+    def _unordered(self, out, running, stop):
+        try:
+            while running:
+                item = out.get()
+                if item is _DONE:
+                    running -= 1
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+    def _keyed(self, out, columns):
+        seq = count()
+        while True:
+            item = out.get()
+            if item is _DONE:
+                return
+            values = [item[1][c] for c, _ in columns]
+            yield (_SortKey(values, [d for _, d in columns]), next(seq), item)
+
+    def _merged(self, streams, stop):
+        try:
+            for _, _, item in heapq.merge(*streams):
+                yield item
+        finally:
+            stop.set()
+
+
+class _SortKey(object):
+    """Compares rows by their sort values, with nulls last when ascending"""
+
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other):
+        for a, b, desc in zip(self.values, other.values, self.descending):
+            if a == b:
+                continue
+            less = a is not None and (b is None or a < b)
+            return less != desc
+        return False
+
+    def __eq__(self, other):
+        return self.values == other.values
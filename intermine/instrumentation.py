@@ -0,0 +1,502 @@
+import logging
+import threading
+import time
+
+from intermine.retry import service_root
+
+"""
+Instrumentation of requests
+===========================
+
+Observers that are told about each request made to a webservice, with
+where the time went: waiting for the server, reading from the network,
+and parsing rows on the client::
+
+    >>> from intermine.instrumentation import LoggingObserver
+    >>> service.add_observer(LoggingObserver())
+    >>> rows = list(query.rows())
+    INFO:intermine.requests:POST /query/results 200 - 0.412s to first byte,
+    1.903s in total, 18234567 bytes (1.311s reading), 50000 rows (0.577s
+    parsing)
+
+An observer is any callable that takes a L{RequestEvent}. Built in
+adapters send events to the logging module (L{LoggingObserver}), to
+Prometheus-style counters (L{MetricsObserver}), and to OpenTelemetry
+spans (L{OpenTelemetryObserver}).
+
+"""
+
+
+class RequestEvent(object):
+    """
+    What happened during a request
+    ==============================
+
+    Events are sent to the observers once the request is over - when an
+    error is returned, or when the response has been read and (for
+    results) parsed. The attributes are:
+
+        - method, url, root and path: what was requested, where the
+          path is relative to the service root
+        - attempt: which attempt this was (0 for the first, more if the
+          request was retried)
+        - payload_size: the size of the request body, in bytes
+        - status: the HTTP status (None if there was no response)
+        - error: the exception raised, if the request failed
+        - started: when the request was made (seconds since the epoch)
+        - time_to_first_byte: the seconds until the response started
+        - duration: the seconds until the request was over
+        - bytes: the number of bytes read from the network
+        - read_time: the seconds spent reading from the network
+        - rows: the number of rows parsed (None if not results)
+        - parse_time: the seconds spent parsing rows, besides reading
+    """
+
+    def __init__(self, method, url, payload_size=0, attempt=0):
+        self.method = method
+        self.url = url
+        self.root = service_root(url)
+        self.path = url[len(self.root):].split("?", 1)[0] or "/"
+        self.attempt = attempt
+        self.payload_size = payload_size
+        self.status = None
+        self.error = None
+        self.started = time.time()
+        self.time_to_first_byte = None
+        self.duration = None
+        self.bytes = 0
+        self.read_time = 0.0
+        self.rows = None
+        self.parse_time = None
+        self.parsing = False
+        self.transferred = False
+        self.observers = []
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<RequestEvent: %s %s %s>" % (self.method, self.path,
+                                             self.status)
+
+    def responded(self, status):
+        """Record the arrival of the response"""
+        self.status = status
+        self.time_to_first_byte = time.time() - self.started
+
+    def transfer_complete(self):
+        """Record the end of the response, finishing unless rows are parsed"""
+        self.transferred = True
+        if not self.parsing:
+            self.finish()
+
+    def finish(self, error=None):
+        """Record the end of the request, and tell the observers (once)"""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        if error is not None:
+            self.error = error
+        self.duration = time.time() - self.started
+        for observer in self.observers:
+            try:
+                observer(self)
+            except Exception:
+                logging.getLogger("intermine.requests").exception(
+                    "Observer %r failed", observer)
+
+    def as_dict(self):
+        """The event, as a dictionary of its attributes"""
+        return dict((k, getattr(self, k)) for k in (
+            "method", "url", "root", "path", "attempt", "payload_size",
+            "status", "error", "started", "time_to_first_byte", "duration",
+            "bytes", "read_time", "rows", "parse_time"))
+
+
+class InstrumentedResponse(object):
+    """
+    A response that counts the bytes and time spent reading it
+    ==========================================================
+    """
+
+    def __init__(self, response, event):
+        self.response = response
+        self.event = event
+
+    def _record(self, method, args, whole):
+        start = time.time()
+        data = method(*args)
+        self.event.read_time += time.time() - start
+        self.event.bytes += len(data)
+        if whole or not data:
+            self.event.transfer_complete()
+        return data
+
+    def read(self, *args):
+        whole = not args or args[0] is None or args[0] < 0
+        return self._record(self.response.read, args, whole)
+
+    def readline(self, *args):
+        return self._record(self.response.readline, args, False)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """2.x to 3.x bridge"""
+        return self.next()
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        try:
+            self.response.close()
+        finally:
+            self.event.transfer_complete()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class LoggingObserver(object):
+    """
+    An observer that logs each request
+    ==================================
+
+    Successful requests are logged at the given level, and failed ones as
+    warnings.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("intermine.requests")
+        self.level = level
+
+    def __call__(self, event):
+        message = "%s %s %s - " % (event.method, event.path,
+                                   event.status or "-")
+        if event.time_to_first_byte is not None:
+            message += "%.3fs to first byte, " % event.time_to_first_byte
+        message += "%.3fs in total, %d bytes (%.3fs reading)" % (
+            event.duration, event.bytes, event.read_time)
+        if event.rows is not None:
+            message += ", %d rows (%.3fs parsing)" % (event.rows,
+                                                       event.parse_time)
+        if event.error is not None:
+            self.logger.warning("%s: %s", message, event.error)
+        else:
+            self.logger.log(self.level, message)
+
+
+class MetricsObserver(object):
+    """
+    An observer that keeps Prometheus-style counters
+    ================================================
+
+    Counts requests, errors, bytes, rows and seconds spent, labelled by
+    service root, path and status, without needing a Prometheus client
+    library. Read them as a dictionary with L{samples}, or in the
+    Prometheus text format with L{exposition}, for example from the
+    handler of a /metrics endpoint.
+    """
+
+    COUNTERS = (
+        ("requests_total", "Requests made", lambda e: 1),
+        ("errors_total", "Requests that failed",
+         lambda e: 1 if e.error is not None else 0),
+        ("request_bytes_total", "Bytes sent", lambda e: e.payload_size),
+        ("response_bytes_total", "Bytes received", lambda e: e.bytes),
+        ("rows_total", "Rows parsed", lambda e: e.rows or 0),
+        ("request_seconds_total", "Seconds spent on requests",
+         lambda e: e.duration or 0),
+        ("first_byte_seconds_total", "Seconds spent waiting for responses",
+         lambda e: e.time_to_first_byte or 0),
+        ("read_seconds_total", "Seconds spent reading responses",
+         lambda e: e.read_time),
+        ("parse_seconds_total", "Seconds spent parsing rows",
+         lambda e: e.parse_time or 0),
+    )
+
+    def __init__(self, prefix="intermine_client"):
+        self.prefix = prefix
+        self.counters = dict((name, {}) for name, _, _ in self.COUNTERS)
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        labels = (("root", event.root), ("path", event.path),
+                  ("status", str(event.status or "")))
+        with self._lock:
+            for name, _, value in self.COUNTERS:
+                counter = self.counters[name]
+                counter[labels] = counter.get(labels, 0) + value(event)
+
+    def samples(self):
+        """
+        Return the counters as a dictionary
+        ===================================
+
+        @rtype: dict(string, dict(tuple, number))
+        """
+        with self._lock:
+            return dict((self.prefix + "_" + name, dict(values))
+                        for name, values in self.counters.items())
+
+    def exposition(self):
+        """
+        Return the counters in the Prometheus text format
+        =================================================
+
+        @rtype: string
+        """
+        lines = []
+        samples = self.samples()
+        for name, description, _ in self.COUNTERS:
+            full_name = self.prefix + "_" + name
+            lines.append("# HELP %s %s" % (full_name, description))
+            lines.append("# TYPE %s counter" % full_name)
+            for labels, value in sorted(samples[full_name].items()):
+                label_text = ",".join(
+                    '%s="%s"' % (k, v.replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in labels)
+                lines.append("%s{%s} %s" % (full_name, label_text, value))
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryObserver(object):
+    """
+    An observer that records each request as an OpenTelemetry span
+    ==============================================================
+
+    This needs the optional opentelemetry-api library. Spans are given
+    the times of the request, and attributes following the HTTP semantic
+    conventions, along with the InterMine timings.
+    """
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            from opentelemetry import trace
+            tracer = trace.get_tracer("intermine")
+        self.tracer = tracer
+
+    def __call__(self, event):
+        attributes = {
+            "http.method": event.method,
+            "http.url": event.url,
+            "http.request_content_length": event.payload_size,
+            "http.response_content_length": event.bytes,
+            "intermine.service": event.root,
+            "intermine.attempt": event.attempt,
+            "intermine.read_time": event.read_time,
+        }
+        if event.status is not None:
+            attributes["http.status_code"] = event.status
+        if event.time_to_first_byte is not None:
+            attributes["intermine.time_to_first_byte"] = \
+                event.time_to_first_byte
+        if event.rows is not None:
+            attributes["intermine.rows"] = event.rows
+            attributes["intermine.parse_time"] = event.parse_time
+        span = self.tracer.start_span(
+            "%s %s" % (event.method, event.path), attributes=attributes,
+            start_time=int(event.started * 1e9))
+        if event.error is not None:
+            span.record_exception(event.error)
+        span.end(end_time=int((event.started + event.duration) * 1e9))
+
+
+_profiles = threading.local()
+
+
+class ResultProfile(object):
+    """
+    Where the time went while reading results
+    =========================================
+
+    Splits the time spent iterating over results into:
+
+        - network: reading the response from the network
+        - decoding: parsing the response (JSON decoding, or splitting
+          flat files into cells)
+        - rows: building row objects from the decoded data (such as
+          L{intermine.results.ResultRow} and
+          L{intermine.results.ResultObject})
+        - user: the caller's own code, between one row and the next
+
+    Use it through L{intermine.query.Query.results}, or with
+    L{profiling} to profile all the results read in a block::
+
+        >>> results = query.results(row="rr", profile=True)
+        >>> for row in results:
+        ...     handle(row)
+        >>> print(results.profile.report())
+        Rows:           50000
+        Total:         2.103s
+        network        1.214s  57.7%
+        decoding       0.402s  19.1%
+        rows           0.331s  15.7%
+        user           0.156s   7.4%
+
+    Waiting for the server to respond counts as network time. When
+    reading ahead, or decoding in a pool of processes, the work happens
+    elsewhere, and the time waiting for it is counted as decoding.
+    """
+
+    PHASES = ("network", "decoding", "rows", "user")
+
+    def __init__(self):
+        self.rows = 0
+        self.network = 0.0
+        self.construction = 0.0
+        self.client = 0.0
+        self.user = 0.0
+
+    @property
+    def decoding(self):
+        return max(0.0, self.client - self.network - self.construction)
+
+    @property
+    def total(self):
+        return self.client + self.user
+
+    def as_dict(self):
+        """
+        Return the seconds spent in each phase, and the number of rows
+        ==============================================================
+
+        @rtype: dict
+        """
+        times = {"network": self.network, "decoding": self.decoding,
+                 "rows": self.construction, "user": self.user}
+        times["total"] = self.total
+        times["row_count"] = self.rows
+        return times
+
+    def report(self):
+        """
+        Return the profile as a table of phases
+        =======================================
+
+        @rtype: string
+        """
+        times = self.as_dict()
+        lines = ["Rows: %15d" % self.rows, "Total: %13.3fs" % self.total]
+        for phase in self.PHASES:
+            share = 100 * times[phase] / self.total if self.total else 0
+            lines.append("%-12s %7.3fs %5.1f%%" % (phase, times[phase], share))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "<ResultProfile: %d rows in %.3fs>" % (self.rows, self.total)
+
+    def timed_connection(self, connection):
+        """Wrap a connection, counting the time spent reading it"""
+        return _TimedConnection(connection, self)
+
+    def timed_parser(self, parser):
+        """Wrap a row parser, counting the time spent building rows"""
+        def timed(data):
+            start = time.time()
+            try:
+                return parser(data)
+            finally:
+                self.construction += time.time() - start
+        return timed
+
+    def timed_rows(self, rows, started=None):
+        """Yield rows, counting the time spent getting them, and between"""
+        rows = iter(rows)
+        last = started or time.time()
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.client += time.time() - last
+                return
+            now = time.time()
+            self.client += now - last
+            self.rows += 1
+            yield row
+            last = time.time()
+            self.user += last - now
+
+
+class _TimedConnection(object):
+
+    def __init__(self, connection, profile):
+        self.connection = connection
+        self.profile = profile
+
+    def _timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.profile.network += time.time() - start
+
+    def read(self, *args):
+        return self._timed(self.connection.read, *args)
+
+    def readline(self, *args):
+        return self._timed(self.connection.readline, *args)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """2.x to 3.x bridge"""
+        return self.next()
+
+    def next(self):
+        return self._timed(next, self.connection)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class profiling(object):
+    """
+    Profile all the results read in a block
+    =======================================
+
+    Usage::
+
+        >>> with profiling() as profile:
+        ...     for row in query.rows():
+        ...         handle(row)
+        >>> print(profile.report())
+
+    Results read in this thread while the block runs are added to the
+    same L{ResultProfile}.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile or ResultProfile()
+
+    def __enter__(self):
+        if not hasattr(_profiles, "stack"):
+            _profiles.stack = []
+        _profiles.stack.append(self.profile)
+        return self.profile
+
+    def __exit__(self, *args):
+        _profiles.stack.remove(self.profile)
+
+
+def current_profile():
+    """
+    Return the profile of the innermost L{profiling} block, if any
+    ==============================================================
+
+    @rtype: L{ResultProfile}, or None
+    """
+    stack = getattr(_profiles, "stack", None)
+    return stack[-1] if stack else None
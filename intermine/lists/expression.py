@@ -0,0 +1,156 @@
+"""
+Lazily evaluated list operations
+================================
+
+Set operations on lists normally run on the server as soon as they are
+written, so an expression such as "(a & b) | (c - d)" creates a new list
+at every step. The classes here record the whole expression first, so
+that it can be run in as few operations as possible.
+"""
+
+
+class ListExpression(object):
+    """
+    A lazily evaluated combination of lists
+    =======================================
+
+    List expressions are built from lists (or list names, or queries)
+    with the same operators as lists themselves, but nothing is sent to
+    the server until the expression is evaluated::
+
+        >>> expr = (list_a.lazy() & list_b) | (list_c.lazy() - list_d)
+        >>> combined = expr.evaluate(name="Combined lists")
+
+    Expressions are simplified as they are built, so that::
+        * "a & b & c" is a single intersection of three lists
+        * "a | b | c" is a single union of three lists
+        * "(a | b) - (c | d)" is a single subtraction
+        * "a - b - c" is a single subtraction of b and c from a
+
+    Any intermediate lists needed by the remaining steps are deleted
+    together once the result has been calculated.
+    """
+
+    INTERSECTION = 'intersection'
+    UNION = 'union'
+    DIFFERENCE = 'difference'
+    SUBTRACTION = 'subtraction'
+
+    def __init__(self, manager, operator=None, operands=[], rights=[]):
+        """
+        Constructor
+        ===========
+
+        Do not construct these objects yourself - use
+        L{intermine.lists.list.List.lazy} instead.
+
+        @param manager: The list manager that will evaluate this expression
+        @param operator: The operation, or None for a single operand
+        @param operands: The expressions to combine (for subtractions:
+                         those to subtract from)
+        @param rights: For subtractions, the expressions to subtract
+        """
+        self.manager = manager
+        self.operator = operator
+        self.operands = list(operands)
+        self.rights = list(rights)
+
+    @property
+    def is_leaf(self):
+        """Whether this expression is just a single list"""
+        return self.operator is None
+
+    @property
+    def intermediate_count(self):
+        """The number of intermediate lists needed to evaluate this"""
+        return sum(1 + o.intermediate_count
+                   for o in self.operands + self.rights if not o.is_leaf)
+
+    def _wrap(self, other):
+        if isinstance(other, ListExpression):
+            return other
+        return ListExpression(self.manager, None, [other])
+
+    def _combine(self, operator, other):
+        other = self._wrap(other)
+        operands = []
+        for expr in (self, other):
+            if expr.operator == operator:
+                operands.extend(expr.operands)
+            else:
+                operands.append(expr)
+        return ListExpression(self.manager, operator, operands)
+
+    def __and__(self, other):
+        """Intersect this expression with another"""
+        return self._combine(self.INTERSECTION, other)
+
+    def __or__(self, other):
+        """Union this expression with another"""
+        return self._combine(self.UNION, other)
+
+    __add__ = __or__
+
+    def __xor__(self, other):
+        """Calculate the symmetric difference of this expression and another"""
+        other = self._wrap(other)
+        return ListExpression(self.manager, self.DIFFERENCE, [self, other])
+
+    def __sub__(self, other):
+        """Subtract another expression from this one"""
+        other = self._wrap(other)
+        if self.operator == self.SUBTRACTION:
+            lefts, rights = self.operands, self.rights + [other]
+        elif self.operator == self.UNION:
+            lefts, rights = self.operands, [other]
+        else:
+            lefts, rights = [self], [other]
+        if other.operator == self.UNION:
+            rights = rights[:-1] + other.operands
+        return ListExpression(self.manager, self.SUBTRACTION, lefts, rights)
+
+    def __rand__(self, other):
+        return self._wrap(other) & self
+
+    def __ror__(self, other):
+        return self._wrap(other) | self
+
+    __radd__ = __ror__
+
+    def __rxor__(self, other):
+        return self._wrap(other) ^ self
+
+    def __rsub__(self, other):
+        return self._wrap(other) - self
+
+    def __str__(self):
+        if self.is_leaf:
+            operand = self.operands[0]
+            return getattr(operand, 'name', None) or str(operand)
+        symbols = {
+            self.INTERSECTION: ' & ',
+            self.UNION: ' | ',
+            self.DIFFERENCE: ' ^ ',
+            self.SUBTRACTION: ' | ',
+        }
+        joined = '(' + symbols[self.operator].join(map(str, self.operands)) + ')'
+        if self.operator == self.SUBTRACTION:
+            joined += ' - (' + ' | '.join(map(str, self.rights)) + ')'
+        return joined
+
+    def __repr__(self):
+        return '<ListExpression: %s>' % self
+
+    def evaluate(self, name=None, description=None, tags=[]):
+        """
+        Run this expression on the server, and return the resulting list
+        ================================================================
+
+        If no name is given, the resulting list will be considered
+        temporary, as with any other list created without a name.
+
+        @see: L{intermine.lists.listmanager.ListManager.evaluate}
+
+        @rtype: intermine.lists.List
+        """
+        return self.manager.evaluate(self, name, description, tags)
@@ -3,6 +3,8 @@ import logging
 
 import codecs
 
+from collections import OrderedDict
+
 try:
     # Python 2.x imports
     from urllib import urlencode
@@ -10,7 +12,11 @@ except ImportError:
     # Python 3.x imports
     from urllib.parse import urlencode
 
-from intermine.results import JSONIterator, EnrichmentLine
+from pandas import DataFrame
+
+from intermine.results import JSONIterator, EnrichmentLine, EnrichmentRow
+from intermine.results import enrichment_columns
+from intermine.lists.expression import ListExpression
 from intermine.model import ConstraintNode
 from intermine.errors import ServiceError
 
@@ -55,6 +61,12 @@ class List(object):
         * Asymmetric Difference (subtraction): this - that
         * Appending: this += that
 
+    Chains of these operations can be combined lazily, so that the
+    whole expression is run with as few operations as possible, and
+    without leaving intermediate lists on the server::
+
+        >>> combined = ((a.lazy() & b) | (c.lazy() - d)).evaluate()
+
     Lists can be created from a list of identifiers that could be::
         * stored in a file
         * held in a list or set
@@ -75,6 +87,9 @@ class List(object):
     """
 
     LOG = logging.getLogger('List')
+    PAGE_SIZE = 500
+    MAX_CACHED_PAGES = 20
+    ENRICHMENT_FORMATS = ("line", "row", "columns", "dataframe")
 
     def __init__(self, **args):
         """
@@ -109,6 +124,7 @@ class List(object):
         except KeyError:
             raise ValueError("Missing argument")
         self.unmatched_identifiers = set([])
+        self._pages = OrderedDict()
 
     @property
     def date_created(self):
@@ -260,11 +276,46 @@ class List(object):
             print()
 
     def __iter__(self):
-        """Return an iterator over the objects in this list, with all attributes selected for output"""
-        return iter(self.to_query())
+        """
+        Return an iterator over the objects in this list, with all attributes selected for output
+
+        The objects are cached as they are read, in pages of PAGE_SIZE
+        objects, so that indexed access to them afterwards does not need
+        to fetch them again.
+        """
+        pages = range(self._page_count())
+        if all(p in self._pages for p in pages):
+            for p in pages:
+                for obj in self._pages[p]:
+                    yield obj
+            return
+
+        page, number = [], 0
+        for obj in self.to_query():
+            page.append(obj)
+            if len(page) == self.PAGE_SIZE:
+                self._cache_page(number, page)
+                page, number = [], number + 1
+            yield obj
+        if page:
+            self._cache_page(number, page)
 
     def __getitem__(self, index):
-        """Get a member of this list by index"""
+        """
+        Get a member of this list by index, or a slice of its members
+        =============================================================
+
+        Members are fetched from the server a page (of PAGE_SIZE objects)
+        at a time, and the most recently used pages (up to MAX_CACHED_PAGES
+        of them) are kept, so that looking up nearby indices does
+        not need another request::
+
+            >>> first_thousand = big_list[0:1000]
+            >>> for i in range(len(big_list)):
+            ...     process(big_list[i])
+        """
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
         if not isinstance(index, int):
             raise IndexError("Expected an integer key - got %s" % (index))
         if index < 0: # handle negative indices.
@@ -275,12 +326,56 @@ class List(object):
         if i not in range(self.size):
             raise IndexError("%d is not a valid index for a list of size %d" % (index, self.size))
 
-        return self.to_query().first(start=i, row="jsonobjects")
+        page, offset = divmod(i, self.PAGE_SIZE)
+        try:
+            return self._get_page(page)[offset]
+        except IndexError:
+            raise IndexError("%d is not a valid index - the list has changed on the server" % index)
+
+    def _page_count(self):
+        return (self.size + self.PAGE_SIZE - 1) // self.PAGE_SIZE
+
+    def _get_page(self, page):
+        if page in self._pages:
+            objects = self._pages.pop(page) # Mark as most recently used.
+            self._pages[page] = objects
+            return objects
+        results = self.to_query().results(
+            row="jsonobjects", start=page * self.PAGE_SIZE, size=self.PAGE_SIZE)
+        objects = list(results)
+        self._cache_page(page, objects)
+        return objects
+
+    def _cache_page(self, page, objects):
+        self._pages[page] = objects
+        while len(self._pages) > self.MAX_CACHED_PAGES:
+            self._pages.popitem(last=False)
+
+    def clear_cache(self):
+        """Discard any cached members of this list"""
+        self._pages.clear()
+
+    def lazy(self):
+        """
+        Start a lazily evaluated list expression with this list
+        =======================================================
+
+        The returned expression supports the same operators as lists,
+        but nothing is calculated until it is evaluated, at which point
+        the whole expression is run with as few operations as possible::
+
+            >>> combined = ((a.lazy() & b) | (c.lazy() - d)).evaluate()
+
+        @rtype: L{intermine.lists.expression.ListExpression}
+        """
+        return ListExpression(self._manager, None, [self])
 
     def __and__(self, other):
         """
         Intersect this list and another
         """
+        if isinstance(other, ListExpression):
+            return self.lazy() & other
         return self._manager.intersect([self, other])
 
     def __iand__(self, other):
@@ -288,21 +383,22 @@ class List(object):
         Intersect this list and another, and replace this list with the result of the
         intersection
         """
-        intersection = self._manager.intersect([self, other], description=self.description, tags=self.tags)
-        self.delete()
-        intersection.name = self.name
-        return intersection
+        return self._manager.replace_list(self, self.lazy() & other)
 
     def __or__(self, other):
         """
         Return the union of this list and another
         """
+        if isinstance(other, ListExpression):
+            return self.lazy() | other
         return self._manager.union([self, other])
 
     def __add__(self, other):
         """
         Return the union of this list and another
         """
+        if isinstance(other, ListExpression):
+            return self.lazy() | other
         return self._manager.union([self, other])
 
     def __iadd__(self, other):
@@ -342,6 +438,7 @@ class List(object):
         new_list = self._manager.parse_list_upload_response(data)
         self.unmatched_identifiers.update(new_list.unmatched_identifiers)
         self._size = new_list.size
+        self.clear_cache()
         return self
 
     def append(self, appendix):
@@ -351,7 +448,26 @@ class List(object):
         except:
             return self._do_append(appendix)
 
-    def calculate_enrichment(self, widget, background = None, correction = "Holm-Bonferroni", maxp = 0.05, filter = ''):
+    def extend(self, content, batch_size=None, progress=None):
+        """
+        Append a very large set of identifiers to this list
+        ===================================================
+
+        Unlike L{append}, the content (a file name, file-handle, string
+        or iterable of identifiers) is never read into memory as a whole,
+        but is sent to the server in batches.
+
+        @see: L{intermine.lists.listmanager.ListManager.upload_list}
+        """
+        unmatched = self._manager.append_to_list(
+            self.name, content, batch_size, progress)
+        self.unmatched_identifiers.update(unmatched)
+        self._manager.refresh_lists()
+        self._size = self._manager.get_list(self.name).size
+        self.clear_cache()
+        return self
+
+    def calculate_enrichment(self, widget, background = None, correction = "Holm-Bonferroni", maxp = 0.05, filter = '', row = "line"):
         """
         Perform an enrichment calculation on this list
         ==============================================
@@ -373,7 +489,17 @@ class List(object):
 
             >>> p_value = row['p-value']
 
+        The format of the results is chosen with the row parameter:
+            * "line": L{intermine.results.EnrichmentLine} objects (the default)
+            * "row": compact L{intermine.results.EnrichmentRow} objects, which are
+              much cheaper to create and read when handling many results
+            * "columns": a dictionary from each key to a list of the values for it
+            * "dataframe": a pandas.DataFrame with one column per key
+
         """
+        if row not in self.ENRICHMENT_FORMATS:
+            raise ValueError("'%s' is not one of the enrichment formats (%s)"
+                             % (row, ", ".join(self.ENRICHMENT_FORMATS)))
         if self._service.version < 8:
             raise ServiceError("This service does not support enrichment requests")
         params = dict(list = self.name, widget = widget, correction = correction, maxp = maxp, filter = filter)
@@ -384,29 +510,35 @@ class List(object):
         form = urlencode(params)
         uri = self._service.root + self._service.LIST_ENRICHMENT_PATH
         resp = self._service.opener.open(uri, form)
-        return JSONIterator(resp, EnrichmentLine)
+        if row == "line":
+            return JSONIterator(resp, EnrichmentLine)
+        rows = JSONIterator(resp, EnrichmentRow)
+        if row == "row":
+            return rows
+        columns = enrichment_columns(rows)
+        if row == "columns":
+            return columns
+        return DataFrame(data=columns)
 
     def __xor__(self, other):
         """Calculate the symmetric difference of this list and another"""
+        if isinstance(other, ListExpression):
+            return self.lazy() ^ other
         return self._manager.xor([self, other])
 
     def __ixor__(self, other):
         """Calculate the symmetric difference of this list and another and replace this list with the result"""
-        diff = self._manager.xor([self, other], description=self.description, tags=self.tags)
-        self.delete()
-        diff.name = self.name
-        return diff
+        return self._manager.replace_list(self, self.lazy() ^ other)
 
     def __sub__(self, other):
         """Subtract the other from this list"""
+        if isinstance(other, ListExpression):
+            return self.lazy() - other
         return self._manager.subtract([self], [other])
 
     def __isub__(self, other):
         """Replace this list with the subtraction of the other from this list"""
-        subtr = self._manager.subtract([self], [other], description=self.description, tags=self.tags)
-        self.delete()
-        subtr.name = self.name
-        return subtr
+        return self._manager.replace_list(self, self.lazy() - other)
 
     def add_tags(self, *tags):
         """
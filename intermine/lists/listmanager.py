@@ -5,7 +5,10 @@ from __future__ import unicode_literals
 
 import weakref
 import sys
+import time
+import atexit
 import logging
+import threading
 
 from functools import partial
 from contextlib import closing
@@ -30,14 +33,22 @@ except ImportError:
 
 import urllib
 import codecs
+import io
+
+from itertools import islice
 
 from intermine.errors import WebserviceError
+from intermine.util import map_concurrently
 from intermine.lists.list import List
+from intermine.lists.expression import ListExpression
 
 P3K = sys.version_info >= (3, 0)
 
 logging.basicConfig()
 
+_MANAGERS_WITH_TEMP_LISTS = weakref.WeakSet()
+_CLEANUP_THREADS = []
+
 
 def safe_key(maybe_unicode):
     if P3K:
@@ -46,6 +57,23 @@ def safe_key(maybe_unicode):
     return maybe_unicode.decode('utf8')
 
 
+def safe_text(line):
+    """Decode lines read from binary sources"""
+
+    return line.decode('utf8') if isinstance(line, bytes) else line
+
+
+def batched(iterable, size):
+    """Yield successive lists of at most size items from iterable"""
+
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
 class ListManager(object):
 
     """
@@ -67,14 +95,23 @@ class ListManager(object):
     """
 
     LOG = logging.getLogger('listmanager')
+    MAX_CONCURRENT_REQUESTS = 4
+    SHUTDOWN_TIMEOUT = 10
     DEFAULT_LIST_NAME = 'my_list'
     DEFAULT_DESCRIPTION = 'List created with Python client library'
+    DEFAULT_UPLOAD_BATCH_SIZE = 10000
 
     INTERSECTION_PATH = '/lists/intersect/json'
     UNION_PATH = '/lists/union/json'
     DIFFERENCE_PATH = '/lists/diff/json'
     SUBTRACTION_PATH = '/lists/subtract/json'
 
+    OPERATIONS = {
+        ListExpression.INTERSECTION: (INTERSECTION_PATH, 'Intersection'),
+        ListExpression.UNION: (UNION_PATH, 'Union'),
+        ListExpression.DIFFERENCE: (DIFFERENCE_PATH, 'Difference'),
+    }
+
     def __init__(self, service):
         self.service = weakref.proxy(service)
         self.lists = None
@@ -155,17 +192,31 @@ class ListManager(object):
         of allocation.
         """
 
+        return self.get_unused_list_names(1)[0]
+
+    def get_unused_list_names(self, count):
+        """
+        Get several unused list names at once
+        =====================================
+
+        As L{get_unused_list_name}, but only fetching the current
+        list names from the server once.
+        """
+
         self.refresh_lists()
         list_names = self.get_all_list_names()
         self.LOG.debug('CURRENT LIST NAMES: {0}'.format(list_names))
         counter = 1
         get_name = partial('{0}_{1}'.format, self.DEFAULT_LIST_NAME)
-        name = get_name(counter)
-        while name in list_names:
-            counter += 1
+        names = []
+        while len(names) < count:
             name = get_name(counter)
-        self._temp_lists.add(name)
-        return name
+            if name not in list_names and name not in self._temp_lists:
+                names.append(name)
+            counter += 1
+        self._temp_lists.update(names)
+        _MANAGERS_WITH_TEMP_LISTS.add(self)
+        return names
 
     def _get_listable_query(self, queryable):
         q = queryable.to_query()
@@ -258,6 +309,10 @@ class ListManager(object):
                     the content is a list or a query.
         @param organism: organism name
 
+        The whole of the content is read into memory and sent in a single
+        request. For very large sets of identifiers use L{upload_list}
+        instead.
+
         @rtype: intermine.lists.List
         """
 
@@ -340,6 +395,157 @@ class ListManager(object):
         data = self.service.opener.post_plain_text(uri, ids)
         return self.parse_list_upload_response(data)
 
+    def upload_list(
+        self,
+        content,
+        list_type='',
+        name=None,
+        description=None,
+        tags=[],
+        add=[],
+        batch_size=None,
+        progress=None,
+    ):
+        """
+        Create a new list from a very large set of identifiers
+        ======================================================
+
+        This method accepts the same identifier sources as L{create_list}
+        (a file name, a file-handle, a string or an iterable of
+        identifiers) but never reads the whole of the content into
+        memory. Instead the identifiers are sent in batches: the first
+        batch creates the list, and each subsequent batch is appended
+        to it. Identifiers that could not be matched are gathered
+        from every batch into the returned list's
+        unmatched_identifiers::
+
+            with open("all-the-genes.txt") as f:
+                big_list = service.upload_list(f, "Gene", name="Everything")
+            print len(big_list.unmatched_identifiers), "not found"
+
+        Queries and lists are passed on to L{create_list}, as the server
+        builds lists from them without any upload.
+
+        If a named upload fails part of the way through, the list
+        will be left on the server holding the batches sent so far.
+
+        @param batch_size: The number of identifiers to send in each
+                           request (for files and strings: the number
+                           of lines). Defaults to DEFAULT_UPLOAD_BATCH_SIZE.
+        @param progress: A callable that will be called after each batch
+                         with the number of identifiers (or lines) sent so
+                         far and the current size of the list.
+
+        @see: L{create_list} for the meaning of the other parameters.
+
+        @rtype: intermine.lists.List
+        """
+
+        if hasattr(content, 'to_query') and not hasattr(content, 'read'):
+            return self.create_list(content, list_type, name,
+                                    description, tags, add=add)
+
+        if description is None:
+            description = self.DEFAULT_DESCRIPTION
+        if name is None:
+            name = self.get_unused_list_name()
+
+        query_form = {
+            'name': name,
+            'type': list_type,
+            'description': description,
+            'tags': ';'.join(tags),
+        }
+        if len(add):
+            query_form['add'] = [x.lower() for x in add if x]
+        uri = self.service.root + self.service.LIST_CREATION_PATH
+        uri += '?' + urlencode(query_form, doseq=True)
+
+        batches = self._identifier_batches(content, batch_size)
+        unmatched = set()
+        sent = self._upload_batches(uri, name, batches, unmatched, progress)
+        if sent == 0:
+            raise ValueError('Lists must have one or more elements')
+
+        self.refresh_lists()
+        new_list = self.get_list(name)
+        new_list._add_failed_matches(unmatched)
+        return new_list
+
+    def append_to_list(self, name, content, batch_size=None, progress=None):
+        """
+        Append a very large set of identifiers to an existing list
+        ==========================================================
+
+        The identifiers are read lazily and sent in batches,
+        as with L{upload_list}.
+
+        @return: the set of identifiers that could not be matched.
+        """
+
+        batches = self._identifier_batches(content, batch_size)
+        unmatched = set()
+        self._upload_batches(None, name, batches, unmatched, progress)
+        return unmatched
+
+    def _upload_batches(self, creation_uri, name, batches,
+                        unmatched, progress):
+        """
+        Send each batch in turn, creating the list with the first one if
+        a creation uri is given, and appending to it with the rest.
+        Returns the number of identifiers sent.
+        """
+
+        append_uri = self.service.root + self.service.LIST_APPENDING_PATH
+        append_uri += '?' + urlencode({'name': name})
+        sent = 0
+        for text, n in batches:
+            uri = creation_uri if creation_uri and sent == 0 else append_uri
+            data = self.service.opener.post_plain_text(uri, text)
+            response_data = self._body_to_json(data)
+            unmatched.update(response_data.get('unmatchedIdentifiers') or [])
+            sent += n
+            self.LOG.debug('Sent {0} identifiers to {1}'.format(sent, name))
+            if progress is not None:
+                progress(sent, response_data.get('listSize'))
+        return sent
+
+    def _identifier_batches(self, content, batch_size=None):
+        """
+        Lazily split the content into (text, count) pairs
+        suitable for uploading in a single request each.
+        """
+
+        if batch_size is None:
+            batch_size = self.DEFAULT_UPLOAD_BATCH_SIZE
+        if batch_size < 1:
+            raise ValueError('batch_size must be a positive number')
+
+        source = None
+        if hasattr(content, 'read'):  # File like thing
+            source = content
+        elif hasattr(content, 'strip') and hasattr(content, 'encode'):
+            try:  # File name
+                source = codecs.open(content, 'r', 'UTF-8')
+            except (TypeError, IOError):  # Stringy thing
+                source = io.StringIO(content)
+        else:  # Array of idents
+            try:
+                idents = iter(content)
+            except TypeError:
+                raise TypeError('Cannot create list from ' + repr(content))
+            for batch in batched(idents, batch_size):
+                yield ('\n'.join(map('"{0}"'.format, batch)), len(batch))
+            return
+
+        try:
+            lines = (l.strip() for l in map(safe_text, source))
+            for batch in batched((l for l in lines if l), batch_size):
+                yield ('\n'.join(batch), len(batch))
+        finally:
+            if source is not content:
+                source.close()
+
     def parse_list_upload_response(self, response):
         """
         Intepret the response from the webserver to a list request,
@@ -362,29 +568,186 @@ class ListManager(object):
         new_list._add_failed_matches(failed_matches)
         return new_list
 
-    def delete_lists(self, lists):
-        """Delete the given lists from the webserver"""
+    def delete_lists(self, lists, max_workers=None):
+        """
+        Delete the given lists from the webserver
+        =========================================
+
+        Up to max_workers lists (MAX_CONCURRENT_REQUESTS by default)
+        are deleted at the same time. Lists that do not exist are skipped.
+
+        @raise ListServiceError: if any of the lists could not be deleted.
+        """
+
+        outcomes = self.bulk_delete_lists(lists, max_workers)
+        raise_first_failure(outcomes)
+
+    def bulk_delete_lists(self, lists, max_workers=None):
+        """
+        Delete many lists at once, reporting on each one
+        ================================================
+
+        As L{delete_lists}, except that failures do not raise errors -
+        instead the outcome for each list is returned, keyed by list name.
+        The result of each successful outcome is True if the list was
+        deleted, and False if there was no such list.
+
+        @rtype: dict(str, L{ListOperationOutcome})
+        """
 
         self.refresh_lists()
         all_names = self.get_all_list_names()
-        for l in lists:
-            if isinstance(l, List):
-                name = l.name
+        outcomes = {}
+        to_delete = []
+        for name in self._names_of(lists):
+            if name in all_names:
+                to_delete.append(name)
             else:
-                name = str(l)
-            if name not in all_names:
                 self.LOG.debug(
                     '{0} does not exist - skipping'.format(name))
-                continue
-            self.LOG.debug('deleting {0}'.format(name))
-            uri = self.service.root + self.service.LIST_PATH
-            query_form = {'name': name}
-            uri += '?' + urlencode(query_form)
-            response = self.service.opener.delete(uri)
+                outcomes[name] = ListOperationOutcome(name, False)
+        outcomes.update(self._delete_names(to_delete, max_workers)())
+        self.refresh_lists()
+        return outcomes
+
+    def _delete_names(self, names, max_workers=None):
+        """
+        Return a function that deletes the named lists, without
+        needing the service to still exist when it is called.
+        """
+
+        uri = self.service.root + self.service.LIST_PATH
+        opener = self.service.opener
+        if max_workers is None:
+            max_workers = self.MAX_CONCURRENT_REQUESTS
+        log = self.LOG
+
+        def delete(name):
+            log.debug('deleting {0}'.format(name))
+            response = opener.delete(uri + '?' + urlencode({'name': name}))
             response_data = json.loads(response.decode('utf8'))
             if not response_data.get('wasSuccessful'):
                 raise ListServiceError(response_data.get('error'))
-        self.refresh_lists()
+            return True
+
+        def run():
+            return dict(
+                (name, ListOperationOutcome(name, result, error))
+                for name, result, error
+                in map_concurrently(delete, names, max_workers))
+
+        return run
+
+    def bulk_add_tags(self, lists, tags, max_workers=None):
+        """
+        Add the tags to each of the given lists
+        =======================================
+
+        The lists are tagged concurrently. The result of each successful
+        outcome is the new set of tags for that list, and any List objects
+        passed in are updated to match.
+
+        @rtype: dict(str, L{ListOperationOutcome})
+        """
+
+        return self._bulk_tag(self.add_tags, lists, tags, max_workers)
+
+    def bulk_remove_tags(self, lists, tags, max_workers=None):
+        """
+        Remove the tags from each of the given lists
+        ============================================
+
+        As L{bulk_add_tags}, but removing the tags.
+
+        @rtype: dict(str, L{ListOperationOutcome})
+        """
+
+        return self._bulk_tag(self.remove_tags, lists, tags, max_workers)
+
+    def _bulk_tag(self, operation, lists, tags, max_workers):
+        if max_workers is None:
+            max_workers = self.MAX_CONCURRENT_REQUESTS
+        lists = list(lists)
+        by_name = dict(zip(self._names_of(lists), lists))
+
+        def tag(name):
+            return frozenset(operation(name, tags))
+
+        outcomes = {}
+        for name, result, error in map_concurrently(tag, by_name, max_workers):
+            outcomes[name] = ListOperationOutcome(name, result, error)
+            if error is None and isinstance(by_name[name], List):
+                by_name[name]._tags = result
+        return outcomes
+
+    def calculate_enrichments(
+        self,
+        calculations,
+        max_workers=None,
+        row='row',
+        **options
+    ):
+        """
+        Run many enrichment calculations at once
+        ========================================
+
+        Each calculation is a (list, widget) or (list, widget, background)
+        tuple, where lists may be given as List objects or by name. The
+        calculations are run concurrently (up to max_workers at a time,
+        MAX_CONCURRENT_REQUESTS by default), and an L{EnrichmentOutcome}
+        is yielded for each as soon as it completes::
+
+            from itertools import product
+
+            lists = ["list-a", "list-b"]
+            widgets = ["go_enrichment_for_gene", "pathway_enrichment"]
+            for outcome in manager.calculate_enrichments(product(lists, widgets)):
+                if outcome.succeeded:
+                    print(outcome.name, outcome.widget, len(outcome.result))
+
+        The widgets are checked against L{Service.widgets}, which is only
+        fetched once. Any other keyword arguments (correction, maxp,
+        filter) are passed to each calculation.
+
+        @param row: The format of each result, as for
+                    L{intermine.lists.list.List.calculate_enrichment}.
+                    Iterable formats are read in full before they are
+                    returned.
+
+        @rtype: iterable of L{EnrichmentOutcome}
+        """
+
+        if max_workers is None:
+            max_workers = self.MAX_CONCURRENT_REQUESTS
+        widgets = self.service.widgets
+        calculations = [tuple(c) + (None,) * (3 - len(c))
+                        for c in calculations]
+        # Resolve names here, so the workers never refresh the lists.
+        lists = dict((name, self.get_list(name)) for name in
+                     set(str(c[0]) for c in calculations
+                         if not isinstance(c[0], List)))
+
+        def calculate(calculation):
+            l, widget, background = calculation
+            if widget not in widgets:
+                raise ListServiceError('There is no widget called ' + widget)
+            im_list = l if isinstance(l, List) else lists[str(l)]
+            if im_list is None:
+                raise ListServiceError('There is no list called ' + str(l))
+            result = im_list.calculate_enrichment(
+                widget, background=background, row=row, **options)
+            if row in ('line', 'row'):
+                result = list(result)
+            return result
+
+        for calculation, result, error in map_concurrently(
+                calculate, calculations, max_workers):
+            l, widget, background = calculation
+            yield EnrichmentOutcome(self._names_of([l])[0], widget,
+                                    background, result, error)
+
+    def _names_of(self, lists):
+        return [l.name if isinstance(l, List) else str(l) for l in lists]
 
     def remove_tags(self, to_remove_from, tags):
         """
@@ -395,7 +758,8 @@ class ListManager(object):
         """
 
         uri = self.service.root + self.service.LIST_TAG_PATH
-        form = {'name': to_remove_from.name, 'tags': ';'.join(tags)}
+        form = {'name': self._names_of([to_remove_from])[0],
+                'tags': ';'.join(tags)}
         uri += '?' + urlencode(form)
         body = self.service.opener.delete(uri)
         return self._body_to_json(body)['tags']
@@ -409,7 +773,7 @@ class ListManager(object):
         """
 
         uri = self.service.root + self.service.LIST_TAG_PATH
-        form = {'name': to_tag.name, 'tags': ';'.join(tags)}
+        form = {'name': self._names_of([to_tag])[0], 'tags': ';'.join(tags)}
         resp = self.service.opener.open(uri, urlencode(form))
         body = resp.read()
         resp.close()
@@ -454,14 +818,45 @@ class ListManager(object):
             self._temp_lists))
         self.delete_temporary_lists()
 
-    def delete_temporary_lists(self):
+    def delete_temporary_lists(self, wait=True):
         """
         Delete all the lists considered temporary (those created without names)
+        ========================================================================
+
+        The lists are deleted concurrently. If wait is False, they are
+        deleted in a background thread, which is returned, and any
+        failures are only logged.
+
+        @raise ListServiceError: if waiting, and any list could not be deleted.
         """
 
-        if self._temp_lists:
-            self.delete_lists(self._temp_lists)
-            self._temp_lists = set()
+        if not self._temp_lists:
+            return None
+        if wait:
+            names, self._temp_lists = self._temp_lists, set()
+            outcomes = self.bulk_delete_lists(names)
+            failed = [n for n, o in outcomes.items() if not o.succeeded]
+            self._temp_lists.update(failed)
+            raise_first_failure(outcomes)
+            return None
+
+        delete = self._delete_names(list(self._temp_lists))
+        self._temp_lists = set()
+        log = self.LOG
+
+        def run():
+            for name, outcome in delete().items():
+                if not outcome.succeeded:
+                    log.debug('Could not delete {0}: {1}'.format(
+                        name, outcome.error))
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        # Forget the threads that have finished, so they do not pile up
+        _CLEANUP_THREADS[:] = [t for t in _CLEANUP_THREADS if t.is_alive()]
+        _CLEANUP_THREADS.append(thread)
+        return thread
 
     def intersect(
         self,
@@ -539,6 +934,32 @@ class ListManager(object):
         and return the list representing the result
         """
 
+        uri = self._subtraction_uri(lefts, rights, name, description, tags)
+        return self.parse_list_upload_response(self._read_response(uri))
+
+    def _do_operation(
+        self,
+        path,
+        operation,
+        lists,
+        name,
+        description,
+        tags,
+    ):
+
+        uri = self._operation_uri(path, operation, lists, name,
+                                  description, tags)
+        return self.parse_list_upload_response(self._read_response(uri))
+
+    def _subtraction_uri(
+        self,
+        lefts,
+        rights,
+        name,
+        description,
+        tags,
+    ):
+
         left_names = self.make_list_names(lefts)
         right_names = self.make_list_names(rights)
         if description is None:
@@ -554,12 +975,9 @@ class ListManager(object):
             'subtract': ';'.join(right_names),
             'tags': ';'.join(tags),
         })
-        resp = self.service.opener.open(uri)
-        data = resp.read()
-        resp.close()
-        return self.parse_list_upload_response(data)
+        return uri
 
-    def _do_operation(
+    def _operation_uri(
         self,
         path,
         operation,
@@ -582,10 +1000,124 @@ class ListManager(object):
             'description': description,
             'tags': ';'.join(tags),
         })
+        return uri
+
+    def _read_response(self, uri):
         resp = self.service.opener.open(uri)
         data = resp.read()
         resp.close()
-        return self.parse_list_upload_response(data)
+        return data
+
+    def evaluate(
+        self,
+        expression,
+        name=None,
+        description=None,
+        tags=[],
+    ):
+        """
+        Evaluate a lazy list expression, and return the resulting list
+        ==============================================================
+
+        The whole expression is run with as few operations as possible
+        (for example "a & b & c" is a single intersection of three lists),
+        without fetching the list details from the server between steps.
+        Any intermediate lists are deleted with one call to
+        L{delete_lists} once the result has been calculated.
+
+        @see: L{intermine.lists.expression.ListExpression}
+
+        @rtype: intermine.lists.List
+        """
+
+        if expression.is_leaf:
+            return self.get_list(self.make_list_names(expression.operands)[0])
+
+        names = self.get_unused_list_names(
+            expression.intermediate_count + (1 if name is None else 0))
+        if name is None:
+            name = names.pop()
+        if description is None:
+            description = 'Result of ' + str(expression)
+        self._run_expression(expression, name, description, tags, names)
+        return self.get_list(name)
+
+    def replace_list(self, to_replace, expression):
+        """
+        Replace a list with the result of evaluating an expression
+        ==========================================================
+
+        The new list keeps the name, description and tags of the list
+        it replaces. This is used to implement the in-place list
+        operators (&=, |=, ^=, -=).
+
+        @rtype: intermine.lists.List
+        """
+
+        name = to_replace.name
+        names = self.get_unused_list_names(expression.intermediate_count + 1)
+        temp_name = names.pop()
+        self._run_expression(expression, temp_name, to_replace.description,
+                             to_replace.tags, names, [name])
+        uri = self.service.root + self.service.LIST_RENAME_PATH
+        uri += '?' + urlencode({'oldname': temp_name, 'newname': name})
+        new_list = self.parse_list_upload_response(self._read_response(uri))
+        self._temp_lists.discard(temp_name)
+        return new_list
+
+    def _run_expression(
+        self,
+        expression,
+        name,
+        description,
+        tags,
+        names,
+        to_delete=(),
+    ):
+        """
+        Create the list called name from the expression, using (and
+        consuming) the given names for the intermediate results, and then
+        delete the intermediate results along with any lists in to_delete.
+        """
+
+        created = []
+
+        def operand_names(operands):
+            list_names = []
+            for operand in operands:
+                if operand.is_leaf:
+                    list_names.extend(self.make_list_names(operand.operands))
+                else:
+                    step_name = names.pop()
+                    run(operand, step_name, None, [])
+                    created.append(step_name)
+                    list_names.append(step_name)
+            return list_names
+
+        def run(node, node_name, node_description, node_tags):
+            if node.operator == node.SUBTRACTION:
+                uri = self._subtraction_uri(
+                    operand_names(node.operands), operand_names(node.rights),
+                    node_name, node_description, node_tags)
+            else:
+                path, operation = self.OPERATIONS[node.operator]
+                uri = self._operation_uri(
+                    path, operation, operand_names(node.operands),
+                    node_name, node_description, node_tags)
+            self._body_to_json(self._read_response(uri))
+
+        succeeded = False
+        try:
+            run(expression, name, description, tags)
+            succeeded = True
+        finally:
+            self._temp_lists.difference_update(names)
+            to_clean = created + list(to_delete) if succeeded else created
+            if to_clean:
+                self.delete_lists(to_clean)
+            else:
+                self.refresh_lists()
+            self._temp_lists.difference_update(created)
 
     def make_list_names(self, lists):
         """Turn a list of things into a list of list names"""
@@ -610,3 +1142,80 @@ class ListServiceError(WebserviceError):
     """Errors thrown when something goes wrong with list requests"""
 
     pass
+
+
+class ListOperationOutcome(object):
+
+    """
+    The outcome of a bulk operation for a single list
+    =================================================
+
+    Bulk list operations report on each list they were given, rather
+    than stopping at the first failure.
+    """
+
+    def __init__(self, name, result=None, error=None):
+        self.name = name
+        self.result = result
+        self.error = error
+
+    @property
+    def succeeded(self):
+        """Whether the operation succeeded for this list"""
+
+        return self.error is None
+
+    def __repr__(self):
+        if self.succeeded:
+            return 'ListOperationOutcome(%s: %r)' % (self.name, self.result)
+        return 'ListOperationOutcome(%s failed: %r)' % (self.name, self.error)
+
+
+class EnrichmentOutcome(ListOperationOutcome):
+
+    """
+    The outcome of one of a set of enrichment calculations
+    ======================================================
+
+    As well as the name of the list, these record the widget and
+    background population that were used.
+    """
+
+    def __init__(self, name, widget, background, result=None, error=None):
+        super(EnrichmentOutcome, self).__init__(name, result, error)
+        self.widget = widget
+        self.background = background
+
+    def __repr__(self):
+        if self.succeeded:
+            return 'EnrichmentOutcome(%s, %s: %d results)' % (
+                self.name, self.widget, len(self.result))
+        return 'EnrichmentOutcome(%s, %s failed: %r)' % (
+            self.name, self.widget, self.error)
+
+
+def raise_first_failure(outcomes):
+    """Raise the error from the first failed outcome, if there is one"""
+
+    for outcome in outcomes.values():
+        if not outcome.succeeded:
+            raise outcome.error
+
+
+def _delete_temporary_lists_at_exit():
+    """
+    Clean up any remaining temporary lists in the background when the
+    interpreter exits, waiting no longer than ListManager.SHUTDOWN_TIMEOUT.
+    """
+
+    for manager in list(_MANAGERS_WITH_TEMP_LISTS):
+        try:
+            manager.delete_temporary_lists(wait=False)
+        except ReferenceError:
+            pass
+    deadline = time.time() + ListManager.SHUTDOWN_TIMEOUT
+    for thread in _CLEANUP_THREADS:
+        thread.join(max(0, deadline - time.time()))
+
+
+atexit.register(_delete_temporary_lists_at_exit)
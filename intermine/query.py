@@ -2,11 +2,15 @@ import intermine.constraints as constraints
 from intermine.model import Column, Class, Model, Reference, ConstraintNode
 import re
 from copy import deepcopy
+from itertools import islice
 from pandas import DataFrame
 from xml.dom import minidom, getDOMImplementation
 from pandas import DataFrame
 
 from intermine.util import openAnything, ReadableException
+from intermine.util import map_concurrently
+from intermine.summary import ItemSummary, NumericSummary, iter_buckets
+from intermine.instrumentation import ResultProfile
 from intermine.pathfeatures import PathDescription, Join, SortOrder
 from intermine.pathfeatures import SortOrderList
 
@@ -1247,6 +1251,17 @@ class Query(object):
         self._sort_order_list.append(so)
         return self
 
+    def clear_sort_order(self):
+        """
+        Clear the sort order
+        ====================
+
+        Removes any sort orders that have been added, so that the
+        default sort order is used.
+        """
+        self._sort_order_list = SortOrderList()
+        return self
+
     def validate_sort_order(self, *so_elems):
         """
         Check the validity of the sort order
@@ -1306,7 +1321,9 @@ class Query(object):
                 subclass_dict[c.path] = c.subclass
         return subclass_dict
 
-    def results(self, row="object", start=0, size=None, summary_path=None):
+    def results(self, row="object", start=0, size=None, summary_path=None,
+                progress=None, read_ahead=None, processes=None,
+                retries=None, checkpoint=None, profile=None):
         """
         Return an iterator over result rows
         ===================================
@@ -1340,13 +1357,21 @@ class Query(object):
           >>> for row in tsv_reader:
           ...    print row[0]                # handle strings
           ...    length_sum += int(row[1])   # handle numbers
+          >>> for row in q.results(row="tsvrows"):
+          ...    print row[0]                # handle strings
+          ...    length_sum += row[1]        # handle numbers
 
         This is the general method that allows access to any of the available
         result formats. The example above shows the ways these differ in terms
         of accessing fields of the rows, as well as dealing with different
         data types. Results can either be retrieved as typed values
         (jsonobjects, rr ['ResultRows'], dict, list), or as lists of strings
-        (csv, tsv) which then require further parsing. The default format for
+        (csv, tsv) which then require further parsing. The "tsvrows" and
+        "csvrows" formats do this parsing for you, returning tuples of
+        values typed according to the model - the flat-file formats are the
+        cheapest to transfer, and these are the cheapest typed formats to
+        read, especially in batches (see
+        L{intermine.results.ResultIterator.batches}). The default format for
         this method is "objects", where information is grouped by its
         relationships. The other main format is "rr", which stands for
         'ResultRows', and can be accessed directly through the L{rows} method.
@@ -1361,7 +1386,8 @@ class Query(object):
         are selected for output.
 
         @param row: The format for each result. One of "object", "rr",
-                    "dict", "list", "tsv", "csv", "jsonrows", "jsonobjects"
+                    "dict", "list", "tsv", "csv", "tsvrows", "csvrows",
+                    "jsonrows", "jsonobjects"
         @type row: string
         @param start: the index of the first result to return (default = 0)
         @type start: int
@@ -1373,6 +1399,35 @@ class Query(object):
                              when you are interested in processing a summary
                              in order of greatest count to smallest.
         @type summary_path: str or L{intermine.model.Path}
+        @param progress: A callable to be called with the number of rows
+                         read so far, and the total number of rows (if
+                         the webservice reports it, otherwise None), every
+                         ResultIterator.PROGRESS_INTERVAL rows and at the end.
+        @type progress: callable
+        @param read_ahead: If given, read up to this many rows ahead in a
+                           background thread, while earlier rows are being
+                           handled (see L{intermine.results.ReadAheadIterator})
+        @type read_ahead: int
+        @param processes: If given, decode rows in JSON based formats in a
+                          pool of this many processes (see
+                          L{intermine.results.ParallelJSONIterator})
+        @type processes: int
+        @param retries: If given, when reading the results fails in a way
+                        that may be transient, issue the query again (up to
+                        this many times) and carry on from the next row
+                        (see L{intermine.results.ResumableIterator})
+        @type retries: int
+        @param checkpoint: A file to save the number of rows read in, so
+                           that a restarted process can resume reading
+        @type checkpoint: string
+        @param profile: If true, record where the time goes while the
+                        results are read (the network, decoding, building
+                        rows, and the caller's code). The breakdown is
+                        available as the profile attribute of the
+                        returned iterator (see
+                        L{intermine.instrumentation.ResultProfile}). A
+                        profile may be passed in to add to it.
+        @type profile: boolean or L{intermine.instrumentation.ResultProfile}
 
         @rtype: L{intermine.webservice.ResultIterator}
 
@@ -1408,7 +1463,56 @@ class Query(object):
         if (row == "dataframe"):
             row = "dict"
 
-        return to_run.service.get_results(path, params, row, view, cld)
+        results = to_run.service.get_results(path, params, row, view, cld)
+        if row in ("tsv", "csv", "json", "tsvrows", "csvrows", "list"):
+            # The columns are typed (only when needed) with the subclasses
+            # known here
+            results.subclasses = to_run.get_subclass_dict()
+        if progress is not None:
+            results.progress = progress
+        if read_ahead:
+            results.buffer_size = read_ahead
+        if processes:
+            results.processes = processes
+        if retries:
+            results.retries = retries
+        if checkpoint:
+            results.checkpoint = checkpoint
+        if profile:
+            results.profile = profile if isinstance(profile, ResultProfile) \
+                else ResultProfile()
+        return results
+
+    def spool(self, filename, format="tsv", start=0, size=None):
+        """
+        Save the results to a local file, to be read later
+        ==================================================
+
+        Usage::
+
+          >>> spooled = query.spool("genes.tsv")
+          >>> for row in spooled:
+          ...     print row[0]
+          >>> frame = spooled.dataframe()
+
+        The results are streamed to disk in large blocks as they arrive,
+        without parsing any rows, and can then be read as often as needed
+        without downloading them again. See
+        L{intermine.results.SpooledResults}.
+
+        @param filename: Where to save the results
+        @type filename: string
+        @param format: The format to save, one of "tsv", "csv" or "json"
+        @type format: string
+        @param start: the index of the first result to return (default = 0)
+        @type start: int
+        @param size: The maximum number of results to return (default = all)
+        @type size: int
+
+        @rtype: L{intermine.results.SpooledResults}
+        """
+        results = self.results(row=format, start=start, size=size)
+        return results.spool(filename)
 
     def dataframe(self, start=0, size=None):
         dict = {}
@@ -1507,29 +1611,106 @@ class Query(object):
         else:
             return dict((r["item"], r["count"]) for r in results)
 
+    MAX_CONCURRENT_SUMMARIES = 4
+
+    def _is_numeric(self, path):
+        p = self.model.make_path(
+            self.prefix_path(path), self.get_subclass_dict())
+        return p.end.type_name in Model.NUMERIC_TYPES
+
+    def summarise_columns(self, *paths, **kwargs):
+        """
+        Return summaries of several columns at once
+        ===========================================
+
+        Usage::
+            >>> summaries = query.summarise_columns("length", "organism.name", top=10)
+            >>> summaries["Gene.length"].average
+            ... 12345.67890
+            >>> summaries["Gene.length"].to_dataframe()   # the histogram
+            >>> summaries["Gene.organism.name"].items     # the ten most common
+
+        The columns (all of the view, if none are given) are summarised by
+        concurrent requests, up to max_workers at a time. Numeric columns
+        give a L{intermine.summary.NumericSummary}, with the statistics
+        returned by L{summarise} and a histogram as arrays, and other
+        columns give a L{intermine.summary.ItemSummary} of items and their
+        counts.
+
+        @param top: Only fetch the most common items of non-numeric columns
+        @type top: int
+        @param max_workers: The maximum number of requests to make at once
+        @type max_workers: int
+        @param frame: If true, return each summary as a DataFrame instead
+        @type frame: bool
+
+        @rtype: dict
+        """
+        top = kwargs.pop("top", None)
+        max_workers = kwargs.pop("max_workers", self.MAX_CONCURRENT_SUMMARIES)
+        frame = kwargs.pop("frame", False)
+        if kwargs:
+            raise TypeError("Unexpected arguments: " + ", ".join(kwargs))
+        paths = [self.prefix_path(p) for p in (paths or self.views)]
+
+        def summarise(path):
+            if self._is_numeric(path):
+                return NumericSummary(path, self.results(summary_path=path))
+            return ItemSummary(path, self.results(summary_path=path, size=top))
+
+        summaries = {}
+        for path, summary, error in map_concurrently(
+                summarise, paths, max_workers):
+            if error is not None:
+                raise error
+            summaries[path] = summary.to_dataframe() if frame else summary
+        return summaries
+
+    def histogram(self, summary_path, **kwargs):
+        """
+        Return an iterator over the histogram of a numeric column
+        =========================================================
+
+        Usage::
+            >>> for lower, upper, count in query.histogram("length"):
+            ...     print(lower, upper, count)
+
+        The buckets are (lower, upper, count) tuples, read as the
+        webservice returns them.
+
+        @raise QueryError: if the column is not numeric
+
+        @rtype: iterable of tuple
+        """
+        if not self._is_numeric(summary_path):
+            raise QueryError("Cannot make a histogram of %s, as it is not "
+                             "numeric" % summary_path)
+        return iter_buckets(self.results(summary_path=summary_path, **kwargs))
+
     def one(self, row="jsonobjects"):
-        """Return one result, and raise an error if the result size is not 1"""
-        if row == "jsonobjects":
-            if self.count() == 1:
-                return self.first(row)
-            else:
-                ret = None
-                for obj in self.results():
-                    if ret is not None:
-                        raise QueryError("More than one result received")
-                    else:
-                        ret = obj
-                if ret is None:
-                    raise QueryError("No results received")
+        """
+        Return one result, and raise an error if the result size is not 1
+        =================================================================
 
-                return ret
-        else:
-            c = self.count()
-            if (c != 1):
-                raise QueryError("Result size is not one: got %d results" %
-                                 (c))
-            else:
-                return self.first(row)
+        This makes a single request, reading at most two results (or, for
+        objects, which may span several rows, until a second object is
+        seen), rather than asking for the count first.
+        """
+        size = None if row == "jsonobjects" else 2
+        results = self.results(row, size=size)
+        try:
+            found = list(islice(results, 2))
+            total = results.total
+        finally:
+            results.close()
+        if len(found) == 1:
+            return found[0]
+        if not found:
+            raise QueryError("No results received")
+        if row == "jsonobjects":
+            raise QueryError("More than one result received")
+        got = total if total is not None else "more than 1"
+        raise QueryError("Result size is not one: got %s results" % got)
 
     def first(self, row="jsonobjects", start=0, **kw):
         """Return the first result, or None if the results are empty"""
@@ -1537,10 +1718,13 @@ class Query(object):
             size = None
         else:
             size = 1
+        results = self.results(row, start=start, size=size, **kw)
         try:
-            return next(self.results(row, start=start, size=size, **kw))
+            return next(results)
         except StopIteration:
             return None
+        finally:
+            results.close()
 
     def get_results_list(self, *args, **kwargs):
         """
@@ -1563,7 +1747,8 @@ class Query(object):
         @see: L{intermine.query.Query.results}
 
         """
-        return list(self.results(*args, **kwargs))
+        # Iterate rather than call list(), which would ask for the length.
+        return [r for r in self.results(*args, **kwargs)]
 
     def get_row_list(self, start=0, size=None):
         return self.get_results_list("rr", start, size)
@@ -1581,17 +1766,18 @@ class Query(object):
 
         Also available as Query.size
 
+        Counts are cached by the service (see
+        L{intermine.webservice.Service.count_results}), so counting the
+        same query again does not make another request.
+
         @rtype: int
         @raise WebserviceError: if the request is unsuccessful.
         """
-        count_str = ""
-        for row in self.results(row="count"):
-            count_str += row
-        try:
-            return int(count_str)
-        except ValueError:
-            raise ResultError("Server returned a non-integer count: " +
-                              count_str)
+        to_run = self.clone()
+        if len(to_run.views) == 0:
+            to_run.add_view(to_run.root)
+        return to_run.service.count_results(
+            to_run.get_results_path(), to_run.to_query_params())
 
     def get_list_upload_uri(self):
         """
@@ -1,10 +1,10 @@
 import requests
 from lxml import etree
 import json
-try:
-    import urllib.request as req
-except ImportError:
-    import urllib as req
+
+from intermine import registry
+from intermine.util import map_concurrently
+from intermine.webservice import Service
 """
 Functions for better usage of queries
 ================================================
@@ -12,9 +12,206 @@ Prompts the user to enter the API token and mine corresponding to the account
 example:
 
     >>>from intermine import query_manager as qm
+
+The same operations are available on L{QueryManager} objects, which are
+bound to a single service and reuse one HTTP session for all their
+requests.
 """
 
 
+class QueryManager(object):
+    """
+    A manager for the queries saved in a user account
+    ================================================
+
+    A query manager is bound to an authenticated service, and keeps a
+    cached copy of the catalogue of saved queries::
+
+        >>> from intermine.webservice import Service
+        >>> from intermine.query_manager import QueryManager
+        >>> manager = QueryManager(Service("flymine.org/query", token="..."))
+        >>> manager.get_all_query_names()
+        ['query1', 'query2']
+
+    The catalogue is fetched once, and kept up to date when queries are
+    posted or deleted through this manager. Call L{invalidate} if queries
+    may have been changed in some other way.
+
+    Many queries may be fetched, posted or deleted at once with
+    L{get_queries}, L{post_queries} and L{delete_queries}, which make up
+    to max_workers requests at a time.
+    """
+
+    QUERIES_PATH = "/user/queries"
+    MAX_CONCURRENT_REQUESTS = 8
+
+    def __init__(self, service, session=None):
+        """
+        Constructor
+        ===========
+
+        @param service: The service whose saved queries are managed
+        @param session: The requests session to use (a new one by default)
+        """
+        self.service = service
+        self.root = service.root
+        self.session = session if session is not None else requests.Session()
+        self.session.headers.update(service.opener.headers())
+        self._catalogue = None
+
+    @property
+    def catalogue(self):
+        """
+        The saved queries in the account, by name
+        ================================================
+
+        @rtype: dict
+        """
+        if self._catalogue is None:
+            r = self.session.get(self.root + self.QUERIES_PATH)
+            r.raise_for_status()
+            self._catalogue = json.loads(r.text)['queries']
+        return self._catalogue
+
+    def invalidate(self):
+        """Forget the cached catalogue, so that it is fetched again"""
+
+        self._catalogue = None
+
+    def get_all_query_names(self):
+        """Return the names of all the saved queries"""
+
+        return list(self.catalogue.keys())
+
+    def get_query(self, name):
+        """
+        Return the xml of a saved query, or None if there is no such query
+        ================================================
+
+        @rtype: string
+        """
+        if name not in self.catalogue:
+            return None
+        r = self.session.get(self.root + self.QUERIES_PATH,
+                             params={"filter": name, "format": "xml"})
+        r.raise_for_status()
+        return r.text
+
+    def delete_query(self, name):
+        """
+        Delete a saved query
+        ================================================
+
+        @return: whether there was such a query to delete
+        """
+        if name not in self.catalogue:
+            return False
+        self._delete(name)
+        self.catalogue.pop(name, None)
+        return True
+
+    def post_query(self, xml, replace=False):
+        """
+        Save a query (as xml) to the account
+        ================================================
+
+        The query must have a name. Unless replace is true, an existing
+        query with the same name will not be overwritten.
+
+        @raise ValueError: if there already is a query with this name
+
+        @return: whether the query was saved
+        """
+        return self.post_queries([xml], replace=replace)[_query_name(xml)]
+
+    def get_queries(self, names, max_workers=None):
+        """
+        Fetch the xml of many saved queries at once
+        ================================================
+
+        @rtype: dict(string, string)
+        """
+        wanted = [n for n in names if n in self.catalogue]
+        fetched = self._map(self.get_query, wanted, max_workers)
+        return dict((n, fetched.get(n)) for n in names)
+
+    def delete_queries(self, names, max_workers=None):
+        """
+        Delete many saved queries at once
+        ================================================
+
+        @return: whether there was a query to delete, by name
+        @rtype: dict(string, bool)
+        """
+        present = [n for n in names if n in self.catalogue]
+        try:
+            self._map(self._delete, present, max_workers)
+        except Exception:
+            self.invalidate()
+            raise
+        for name in present:
+            self.catalogue.pop(name, None)
+        return dict((n, n in present) for n in names)
+
+    def post_queries(self, queries, replace=False, max_workers=None):
+        """
+        Save many queries (as xml) at once
+        ================================================
+
+        The catalogue is fetched again once all the queries have been
+        sent, and is used to check that each of them was saved.
+
+        @raise ValueError: if any query would replace an existing query,
+                           and replace is false
+
+        @return: whether each query was saved, by name
+        @rtype: dict(string, bool)
+        """
+        by_name = dict((_query_name(xml), xml) for xml in queries)
+        if not replace:
+            existing = [n for n in by_name if n in self.catalogue]
+            if existing:
+                raise ValueError(
+                    "There are already queries called: " + ", ".join(existing))
+        param = "query" if self.service.version >= 27 else "xml"
+
+        def put(name):
+            r = self.session.put(self.root + self.QUERIES_PATH,
+                                 params={param: by_name[name]})
+            r.raise_for_status()
+
+        try:
+            self._map(put, list(by_name), max_workers)
+        finally:
+            self.invalidate()
+        return dict((n, n in self.catalogue) for n in by_name)
+
+    def _delete(self, name):
+        r = self.session.delete(self.root + self.QUERIES_PATH + "/" + name)
+        r.raise_for_status()
+
+    def _map(self, function, names, max_workers):
+        if max_workers is None:
+            max_workers = self.MAX_CONCURRENT_REQUESTS
+        results = {}
+        errors = []
+        for name, result, error in map_concurrently(
+                function, names, max_workers):
+            results[name] = result
+            if error is not None:
+                errors.append(error)
+        if errors:
+            raise errors[0]
+        return results
+
+
+def _query_name(xml):
+    return etree.fromstring(xml).attrib['name']
+
+
+manager = None
+
+
 def save_mine_and_token(m, t):
     """
     A function to access an account from a particular mine
@@ -28,24 +225,19 @@ def save_mine_and_token(m, t):
     """
     global mine
     global token
+    global manager
     mine = m
     token = t
     # if no tests are taking place
     if mine != 'mock':
-        # source of the request
-        src = "http://registry.intermine.org/service/instances/" + mine
         try:
-            # tests if mine is valid by checking if object 'obj' exists
-            m = requests.get(src)
-            data = json.loads(m.text)
-            obj = data["instance"]["url"]
-            obj = data["instance"]["url"] + "/service/user/queries?token=" + \
-                token
+            # tests if mine is valid by looking it up in the registry
+            service = Service(registry.get_client().instance(mine)["url"],
+                              token=token)
             try:
-                # tests if token is valid by checking if object 'obj' exists
-                o = requests.get(obj)
-                data = json.loads(o.text)
-                obj = data['queries'].keys()
+                # tests if token is valid by fetching the saved queries
+                manager = QueryManager(service)
+                manager.catalogue
                 # checks the type fo exception
             except Exception as ex:
                 template = "An exception of type {0} occurred."
@@ -73,16 +265,7 @@ def get_all_query_names():
     if mine == 'mock':
         dict = {'queries': {'query1': 1}}
     else:
-        # source of the initial request
-        x = "http://registry.intermine.org/service/instances/" + mine
-        # data retreived as an object
-        r = requests.get(x)
-        # data converted to dict
-        dict = json.loads(r.text)
-        # source of next requests
-        link = dict["instance"]["url"] + "/service/user/queries?token=" + token
-        r = requests.get(link)
-        dict = json.loads(r.text)
+        dict = {'queries': manager.catalogue}
     # count used to check existence of the query
     count = 0
     # list where output is stored
@@ -118,14 +301,7 @@ def get_query(name):
         else:
             ans = '<saved-queries></saved-queries>'
     else:
-        # source of the initial request
-        x = "http://registry.intermine.org/service/instances/" + mine
-        r = requests.get(x)
-        dict = json.loads(r.text)
-        link = dict["instance"]["url"] + "/service/user/queries?filter=" + \
-            name + "&format=xml&token=" + token
-        r = requests.get(link)
-        ans = r.text
+        ans = manager.get_query(name) or '<saved-queries></saved-queries>'
     if ans == '<saved-queries></saved-queries>':
         return "No such query available"
     else:
@@ -148,15 +324,7 @@ def delete_query(name):
     if mine == 'mock':
         z = {'queries': {'query1': 1, 'query2': 2}}
     else:
-        # source of the initial request
-        x = "http://registry.intermine.org/service/instances/" + mine
-        r = requests.get(x)
-        dict = json.loads(r.text)
-        # source of the next request
-        y = dict["instance"]["url"] + "/service/user/queries?token=" + token
-        r = requests.get(y)
-        # dictionary form of data
-        z = json.loads(r.text)
+        z = {'queries': manager.catalogue}
     # checks if query name exists
     count = 0
     for key in z['queries'].keys():
@@ -170,9 +338,7 @@ def delete_query(name):
         if mine == 'mock':
             return name + " is deleted"
         else:
-            link = dict["instance"]["url"] + "/service/user/queries/" + name +\
-             "?token=" + token
-            requests.delete(link)
+            manager.delete_query(name)
             return name + " is deleted"
 
 
@@ -189,29 +355,13 @@ def post_query(value):
             </query>')
     Note that the name should be defined first
     """
-    # default parameter name to xml
-    paramName = "xml"
     # parsing
     root = etree.fromstring(value)
     # mock raw for testing
     if mine == 'mock':
         raw = {'queries': {'query1': 1, 'query2': 2}}
     else:
-        # source of the initial request
-        x = "http://registry.intermine.org/service/instances/" + mine
-        r = requests.get(x)
-        dict = json.loads(r.text)
-        # finding the version
-        v_link = dict["instance"]["url"] + "/service/version?token=" + token
-        r = requests.get(v_link)
-        VERSION = json.loads(r.text)
-        # change parameter name to query if newer version is used
-        if VERSION >= 27:
-            paramName = "query"
-
-        link = dict["instance"]["url"] + "/service/user/queries?token=" + token
-        r = requests.get(link)
-        raw = json.loads(r.text)
+        raw = {'queries': manager.catalogue}
     count = 0
     for key in raw['queries'].keys():
         if key == root.attrib['name']:
@@ -229,12 +379,8 @@ def post_query(value):
         if mine == 'mock':
             raw = {'queries': {'query1': 1, 'query2': 2, 'query3': 3}}
         else:
-            link = dict["instance"]["url"] + "/service/user/queries?" + \
-                paramName + "=" + \
-                req.pathname2url(value) + "&token=" + token
-            requests.put(link)
-            r = requests.get(link)
-            raw = json.loads(r.text)
+            manager.post_query(value, replace=True)
+            raw = {'queries': manager.catalogue}
         flag = 0
         for key in raw['queries'].keys():
             if key == root.attrib['name']:
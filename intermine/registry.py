@@ -1,12 +1,216 @@
-import requests
+import errno
+import hashlib
 import json
+import os
+import threading
+import time
+
+import requests
 from intermine.webservice import Service
 """
 Functions for making use of registry data
 ================================================
 
+All registry requests go through a shared L{RegistryClient}, which keeps
+one HTTP session open, fetches the list of all instances in a single
+request and caches it in memory (and, if asked to, on disk) so that
+looking up many mines does not mean asking the registry about each of
+them in turn.
+
 """
 
+DEFAULT_REGISTRY_URL = "http://registry.intermine.org"
+
+# Responses are only written to disk if a directory is given, here or
+# when making a client
+DEFAULT_CACHE_DIR = os.environ.get("INTERMINE_CACHE_DIR")
+
+
+class RegistryClient(object):
+    """
+    A caching client for the InterMine registry
+    ===========================================
+
+    The client fetches the details of every registered instance with one
+    request, and serves lookups for individual mines from that::
+
+        >>> from intermine.registry import RegistryClient
+        >>> client = RegistryClient(ttl=600)
+        >>> client.instance('flymine')['url']
+        'https://www.flymine.org/flymine'
+
+    Responses are kept for C{ttl} seconds. After that they are revalidated
+    with the server using their ETag, so an unchanged registry costs only
+    an empty "304 Not Modified" response. If the registry cannot be
+    reached, any response fetched earlier is used instead.
+
+    If C{cache_dir} is given (or the INTERMINE_CACHE_DIR environment
+    variable is set), responses are also written to that directory so
+    that they survive between processes::
+
+        >>> client = RegistryClient(cache_dir="~/.cache/intermine")
+    """
+
+    INSTANCES_PATH = "/service/instances"
+    TTL = 3600
+    TIMEOUT = 30
+
+    def __init__(self, registry_url=DEFAULT_REGISTRY_URL,
+                 cache_dir=DEFAULT_CACHE_DIR, ttl=TTL, timeout=TIMEOUT,
+                 session=None):
+        """
+        Constructor
+        ===========
+
+        @param registry_url: The base url of the registry
+        @param cache_dir: Where to store responses (by default they are
+                          only kept in memory)
+        @param ttl: How many seconds a response is used for without asking
+                    the registry whether it has changed
+        @param timeout: The timeout (in seconds) for each request
+        @param session: The requests session to use (a new one by default)
+        """
+        self.registry_url = registry_url.rstrip("/")
+        self.cache_dir = cache_dir and os.path.expanduser(cache_dir)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def instances(self):
+        """
+        Return the details of all the instances in the registry
+        =======================================================
+
+        @rtype: list of dict
+        """
+        return self.get_json(self.INSTANCES_PATH)["instances"]
+
+    def instance(self, mine):
+        """
+        Return the details of a single instance, or None
+        ================================================
+
+        Instances can be found by name, namespace or id, ignoring case.
+
+        @rtype: dict
+        """
+        wanted = mine.lower()
+        for instance in self.instances():
+            keys = (instance.get(k) for k in ("name", "namespace", "id"))
+            if wanted in (str(k).lower() for k in keys if k is not None):
+                return instance
+        return None
+
+    def get_json(self, path):
+        """
+        Fetch and parse a resource from the registry, using the cache
+        =============================================================
+        """
+        url = self.registry_url + path
+        with self._lock:
+            entry = self._responses.get(url) or self._read_cache(url)
+        if entry is not None and time.time() - entry["fetched"] < self.ttl:
+            return entry["body"]
+        headers = {"Accept": "application/json"}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        # The lock is not held while waiting for the registry, so that
+        # lookups of fresh responses are not held up by it.
+        try:
+            response = self.session.get(
+                url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            if entry is None:
+                raise
+            return entry["body"]
+        if response.status_code == 304 and entry is not None:
+            entry = dict(entry, fetched=time.time())
+        else:
+            response.raise_for_status()
+            entry = {
+                "etag": response.headers.get("ETag"),
+                "fetched": time.time(),
+                "body": json.loads(response.text),
+            }
+        with self._lock:
+            self._responses[url] = entry
+            self._write_cache(url, entry)
+        return entry["body"]
+
+    def clear_cache(self):
+        """Forget all stored responses, in memory and on disk"""
+
+        with self._lock:
+            for url in list(self._responses):
+                path = self._cache_file(url)
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+            self._responses = {}
+
+    def _cache_file(self, url):
+        if not self.cache_dir:
+            return None
+        digest = hashlib.sha1(url.encode("utf8")).hexdigest()
+        return os.path.join(self.cache_dir, "registry-" + digest + ".json")
+
+    def _read_cache(self, url):
+        path = self._cache_file(url)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        self._responses[url] = entry
+        return entry
+
+    def _write_cache(self, url, entry):
+        path = self._cache_file(url)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return
+        # Write then rename, so readers never see half a file.
+        partial = path + ".%d.tmp" % os.getpid()
+        try:
+            with open(partial, "w") as f:
+                json.dump(entry, f)
+            os.rename(partial, path)
+        except (IOError, OSError):
+            pass
+
+
+_client = None
+
+
+def get_client():
+    """Return the registry client used by the functions in this module"""
+
+    global _client
+    if _client is None:
+        _client = RegistryClient()
+    return _client
+
+
+def set_client(client):
+    """Use a differently configured client for the functions in this module"""
+
+    global _client
+    _client = client
+
+
+def _get_instance(mine):
+    instance = get_client().instance(mine)
+    if instance is None:
+        raise KeyError(mine)
+    return instance
+
 
 def getVersion(mine):
     """
@@ -21,14 +225,12 @@ def getVersion(mine):
         'InterMine Version:': '4.1.0'}
 
     """
-    link = "http://registry.intermine.org/service/instances/" + mine
     try:
-        r = requests.get(link)
-        dict = json.loads(r.text)
+        instance = _get_instance(mine)
         return {
-            "API Version:": dict["instance"]["api_version"],
-            "Release Version:": dict["instance"]["release_version"],
-            "InterMine Version:": dict["instance"]["intermine_version"]
+            "API Version:": instance["api_version"],
+            "Release Version:": instance["release_version"],
+            "InterMine Version:": instance["intermine_version"]
         }
     except KeyError:
         return "No such mine available"
@@ -53,21 +255,18 @@ def getInfo(mine):
         MODs
 
     """
-    link = "http://registry.intermine.org/service/instances/" + mine
     try:
-        r = requests.get(link)
-
-        dict = json.loads(r.text)
-        print("Description: " + dict["instance"]["description"])
-        print("URL: " + dict["instance"]["url"])
-        print("API Version: " + dict["instance"]["api_version"])
-        print("Release Version: " + dict["instance"]["release_version"])
-        print("InterMine Version: " + dict["instance"]["intermine_version"])
+        instance = _get_instance(mine)
+        print("Description: " + instance["description"])
+        print("URL: " + instance["url"])
+        print("API Version: " + instance["api_version"])
+        print("Release Version: " + instance["release_version"])
+        print("InterMine Version: " + instance["intermine_version"])
         print("Organisms: "),
-        for organism in dict["instance"]["organisms"]:
+        for organism in instance["organisms"]:
             print(organism),
         print("Neighbours: "),
-        for neighbour in dict["instance"]["neighbours"]:
+        for neighbour in instance["neighbours"]:
             print(neighbour),
         return None
     except KeyError:
@@ -91,11 +290,8 @@ def getData(mine):
 
 
     """
-    x = "http://registry.intermine.org/service/instances/" + mine
     try:
-        r = requests.get(x)
-        dict = json.loads(r.text)
-        link = dict["instance"]["url"]
+        link = _get_instance(mine)["url"]
         service = Service(link)
         query = service.new_query("DataSet")
         query.add_view("name", "url")
@@ -128,22 +324,19 @@ def getMines(organism=None):
         XenMine
 
     """
-    link = "http://registry.intermine.org/service/instances"
-
-    r = requests.get(link)
     count = 0
-    dict = json.loads(r.text)
-    for i in range(len(dict["instances"])):
+    instances = get_client().instances()
+    for i in range(len(instances)):
         if organism is None:
-            print(dict["instances"][i]["name"])
+            print(instances[i]["name"])
             count = count+1
         else:
-            for j in range(len(dict["instances"][i]["organisms"])):
-                if dict["instances"][i]["organisms"][j] == organism:
-                    print(dict["instances"][i]["name"])
+            for j in range(len(instances[i]["organisms"])):
+                if instances[i]["organisms"][j] == organism:
+                    print(instances[i]["name"])
                     count = count+1
-                elif dict["instances"][i]["organisms"][j] == " " + organism:
-                    print(dict["instances"][i]["name"])
+                elif instances[i]["organisms"][j] == " " + organism:
+                    print(instances[i]["name"])
                     count = count+1
     if(count == 0):
         return "No such mine available"
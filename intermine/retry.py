@@ -0,0 +1,219 @@
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+from intermine.errors import CircuitOpenError
+
+"""
+Retrying failed requests
+========================
+
+Policies for retrying requests to the webservice that fail in ways that
+may be transient (server errors and dropped connections), with timeouts
+for each request, and circuit breakers that stop a client from sending
+requests to a service that is down.
+
+"""
+
+
+def service_root(url):
+    """
+    Return the root of the service a url belongs to
+    ===============================================
+
+    This is the url up to and including "/service", or else just the
+    scheme and host.
+
+    @rtype: string
+    """
+    o = urlparse(url)
+    path = o.path
+    if "/service" in path:
+        path = path[:path.index("/service") + len("/service")]
+    else:
+        path = ""
+    return "{0}://{1}{2}".format(o.scheme, o.netloc, path)
+
+
+def retry_after(headers, now=None):
+    """
+    Read the number of seconds to wait from a Retry-After header
+    ============================================================
+
+    The header may be a number of seconds, or an HTTP date.
+
+    @rtype: float, or None if there is no (readable) header
+    """
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, mktime_tz(parsed) - (now or time.time()))
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for a service root
+    ====================================
+
+    After failure_threshold failures in a row, the circuit opens, and
+    requests fail at once with a L{intermine.errors.CircuitOpenError}
+    rather than adding load to a service that is struggling. After
+    reset_timeout seconds, one request is let through to try the service
+    again: if it succeeds the circuit closes, and if not it opens again.
+    """
+
+    def __init__(self, root, failure_threshold=5, reset_timeout=30.0):
+        self.root = root
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trying = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self):
+        """
+        Check that a request may be made
+        ================================
+
+        @raise CircuitOpenError: if the circuit is open
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.time() - self.opened_at
+            if waited >= self.reset_timeout and not self._trying:
+                self._trying = True
+                return
+        raise CircuitOpenError(
+            "Requests to {0} are suspended after {1} failures - trying again "
+            "in {2:.0f}s".format(self.root, self.failures,
+                                 max(0, self.reset_timeout - waited)))
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trying = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trying or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self._trying = False
+
+    def abandon(self):
+        """
+        Forget a request that neither succeeded nor failed
+        ==================================================
+
+        Called when a request stops for a reason that says nothing about
+        the service (such as a bad url, or an interrupt), so that another
+        request may try the service if this one was the trial.
+        """
+        with self._lock:
+            self._trying = False
+
+
+class RetryPolicy(object):
+    """
+    How to retry requests that fail
+    ===============================
+
+    Requests which may safely be made again (GET, HEAD, PUT, DELETE and
+    OPTIONS requests, and queries for results) are retried up to retries
+    times, if they fail with one of the given HTTP statuses (server
+    errors, by default) or with a network error. Between attempts, the
+    client waits for a random time of up to backoff * 2 ** attempt
+    seconds (but no more than max_backoff), or as long as the server
+    asks in a Retry-After header.
+
+    Each request times out if it cannot connect within connect_timeout
+    seconds, or if, once connected, no data arrives for read_timeout
+    seconds. Waiting for the response to start counts as reading, so the
+    default read_timeout of None (wait forever) suits queries that take
+    a long time to start sending results.
+
+    Failures are counted per service root by a L{CircuitBreaker}, shared
+    by every client in the process that uses the same root with the same
+    failure_threshold and reset_timeout (policies with other settings
+    have breakers of their own). Use circuit_breaker=False to turn this
+    off::
+
+        >>> policy = RetryPolicy(retries=5, backoff=1, read_timeout=600)
+        >>> service = Service("https://www.flymine.org/query/service",
+        ...                   retry_policy=policy)
+
+    """
+
+    STATUSES = frozenset(range(500, 600)) | frozenset([429])
+    METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0,
+                 statuses=STATUSES, methods=METHODS,
+                 connect_timeout=30.0, read_timeout=None,
+                 circuit_breaker=True, failure_threshold=5,
+                 reset_timeout=30.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(methods)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.circuit_breaker = circuit_breaker
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = time.sleep
+
+    def is_idempotent(self, method):
+        return method.upper() in self.methods
+
+    def breaker(self, url):
+        """
+        Return the circuit breaker for the root of a url
+        ================================================
+
+        @rtype: L{CircuitBreaker}, or None if circuit breaking is off
+        """
+        if not self.circuit_breaker:
+            return None
+        root = service_root(url)
+        key = (root, self.failure_threshold, self.reset_timeout)
+        with RetryPolicy._breakers_lock:
+            if key not in RetryPolicy._breakers:
+                RetryPolicy._breakers[key] = CircuitBreaker(
+                    root, self.failure_threshold, self.reset_timeout)
+            return RetryPolicy._breakers[key]
+
+    def delay(self, attempt, requested=None):
+        """
+        Return how long to wait before the given retry (counting from 0)
+        ================================================================
+
+        @rtype: float
+        """
+        if requested is not None:
+            return min(requested, self.max_backoff)
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
@@ -0,0 +1,111 @@
+import numpy as np
+from pandas import DataFrame
+
+"""
+Summaries of query columns
+==========================
+
+Classes holding the column summaries calculated by the webservice, as
+NumPy arrays rather than dictionaries of every item.
+
+"""
+
+
+class ItemSummary(object):
+    """
+    A summary of a non-numeric column
+    =================================
+
+    The distinct values in the column (items) and the number of times
+    each one occurs (counts), most frequent first::
+
+        >>> summary = query.summarise_columns("organism.name")["Gene.organism.name"]
+        >>> summary.items[0], summary.counts[0]
+        ('Drosophila melanogaster', 13894)
+
+    If the summary was limited to the top k items, only those are present.
+    """
+
+    def __init__(self, path, rows):
+        self.path = path
+        items = []
+
+        def counts():
+            for row in rows:
+                items.append(row["item"])
+                yield row["count"]
+
+        self.counts = np.fromiter(counts(), dtype=np.int64)
+        self.items = np.array(items, dtype=object)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return "<ItemSummary: %s (%d items)>" % (self.path, len(self))
+
+    def to_dict(self):
+        """Return the summary as a dictionary of counts by item"""
+        return dict(zip(self.items, self.counts.tolist()))
+
+    def to_dataframe(self):
+        """Return the summary as a DataFrame with item and count columns"""
+        return DataFrame({"item": self.items, "count": self.counts})
+
+
+class NumericSummary(object):
+    """
+    A summary of a numeric column
+    =============================
+
+    The statistics of the column (min, max, average and stdev), and, if
+    the webservice provides one, a histogram of its values as arrays of
+    bucket bounds (lowers, uppers) and counts.
+    """
+
+    STATISTICS = ("min", "max", "average", "stdev")
+
+    def __init__(self, path, rows):
+        self.path = path
+        self.statistics = {}
+        buckets = list(iter_buckets(rows, self.statistics))
+        self.lowers = np.array([b[0] for b in buckets], dtype=float)
+        self.uppers = np.array([b[1] for b in buckets], dtype=float)
+        self.counts = np.array([b[2] for b in buckets], dtype=np.int64)
+
+    def __getattr__(self, name):
+        if name in NumericSummary.STATISTICS:
+            return self.__dict__["statistics"].get(name)
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return "<NumericSummary: %s %r>" % (self.path, self.statistics)
+
+    def to_dict(self):
+        """Return the statistics, as Query.summarise does"""
+        return dict(self.statistics)
+
+    def to_dataframe(self):
+        """Return the histogram as a DataFrame with lower, upper and count"""
+        return DataFrame({"lower": self.lowers, "upper": self.uppers,
+                          "count": self.counts})
+
+
+def iter_buckets(rows, statistics=None):
+    """
+    Yield the buckets of a numeric summary as (lower, upper, count)
+    ===============================================================
+
+    The rows are read as they arrive. If a dictionary of statistics is
+    given, the min, max, average and stdev are stored in it.
+    """
+    for row in rows:
+        if statistics is not None and not statistics:
+            statistics.update((k, float(row[k]))
+                              for k in NumericSummary.STATISTICS if k in row)
+        if "bucket" not in row or "buckets" not in row:
+            continue
+        low, high = float(row["min"]), float(row["max"])
+        width = (high - low) / int(row["buckets"])
+        lower = low + (int(row["bucket"]) - 1) * width
+        yield (lower, lower + width, int(row["count"]))
@@ -0,0 +1,346 @@
+import threading
+import time
+
+from intermine.retry import service_root
+
+"""
+Limiting the load on a service
+==============================
+
+Client-side rate limits (a token bucket) and limits on the number of
+requests in flight at once, kept per service root and shared by every
+request made through L{intermine.results.InterMineURLOpener} - queries,
+lists, templates, identifier resolution and enrichment alike::
+
+    >>> from intermine import throttle
+    >>> throttle.configure("https://www.flymine.org/query/service",
+    ...                    rate=10, max_in_flight=4)
+
+or, equivalently, when connecting::
+
+    >>> service = Service("https://www.flymine.org/query/service",
+    ...                   rate_limit=10, max_in_flight=4)
+
+The limits work for requests made from many threads at once. Code running
+in an asyncio event loop can wait for its turn without blocking the loop,
+with C{await throttle.acquire_async()}, or C{async with throttle}.
+
+"""
+
+_throttles = {}
+_lock = threading.Lock()
+
+
+def configure(root, rate=None, burst=None, max_in_flight=None):
+    """
+    Set the limits for requests to a service
+    ========================================
+
+    The limits apply to every client in this process that uses the same
+    service root. Calling this again replaces the limits.
+
+    @param root: The root url of the service (or any url under it)
+    @param rate: The maximum number of requests per second (optional)
+    @param burst: The number of requests that may be made at once before
+                  the rate applies (defaults to the rate, or at least 1)
+    @param max_in_flight: The maximum number of requests at once (optional)
+
+    @rtype: L{Throttle}
+    """
+    root = service_root(root)
+    throttle = Throttle(rate, burst, max_in_flight)
+    with _lock:
+        _throttles[root] = throttle
+    return throttle
+
+
+def get_throttle(url):
+    """
+    Return the throttle for the service a url belongs to
+    ====================================================
+
+    @rtype: L{Throttle}, or None if the service is not limited
+    """
+    if not _throttles:
+        return None
+    return _throttles.get(service_root(url))
+
+
+def reset():
+    """Remove all limits"""
+    with _lock:
+        _throttles.clear()
+
+
+class TokenBucket(object):
+    """
+    A token bucket
+    ==============
+
+    Tokens are added at rate per second, up to burst tokens. Each request
+    takes a token, and waits until there is one to take. Waits are
+    reserved in order, so the rate holds however many threads are
+    waiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, returning how many seconds to wait before using it
+        ================================================================
+
+        @rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            if now > self.updated:
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class Throttle(object):
+    """
+    The limits on requests to a service
+    ===================================
+
+    Combines a L{TokenBucket} (if a rate is given) with a semaphore
+    limiting the requests in flight (if max_in_flight is given). A
+    request is in flight until its response has been read or closed.
+
+    The in-flight limit is per thread: a thread that already has a
+    request in flight (for instance one whose results it is still
+    reading) may make more without waiting for another slot, as a
+    request made in the middle of reading results (such as fetching a
+    reference, or counting the rows) would otherwise wait for ever.
+    """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_in_flight = max_in_flight
+        if max_in_flight:
+            self._slots = threading.BoundedSemaphore(max_in_flight)
+        else:
+            self._slots = None
+        self.paused_until = 0
+        self.sleep = time.sleep
+        self._lock = threading.Lock()
+        self._held = {}
+        self._handed = 0
+        self._local = threading.local()
+
+    def _wait(self, slot):
+        if slot:
+            self._slots.acquire()
+        delay = self.paused_until - time.time()
+        if self.bucket is not None:
+            delay = max(delay, self.bucket.reserve())
+        if delay > 0:
+            self.sleep(delay)
+
+    def take(self):
+        """
+        Wait until a request may be made, returning its ticket
+        ======================================================
+
+        The ticket is passed to L{give_back} when the request has
+        finished, from whichever thread finishes it. If a slot has been
+        handed over by L{acquire_async}, the request takes that slot
+        without waiting.
+
+        @rtype: tuple
+        """
+        me = threading.current_thread().ident
+        with self._lock:
+            handed = self._handed > 0
+            if handed:
+                self._handed -= 1
+            nested = self._held.get(me, 0) > 0
+        if handed:
+            slot = self._slots is not None
+        else:
+            slot = self._slots is not None and not nested
+            self._wait(slot)
+        with self._lock:
+            self._held[me] = self._held.get(me, 0) + 1
+        return (me, slot)
+
+    def give_back(self, ticket):
+        """Mark the request a ticket was taken for as finished"""
+        thread, slot = ticket
+        with self._lock:
+            count = self._held.get(thread, 0) - 1
+            if count > 0:
+                self._held[thread] = count
+            else:
+                self._held.pop(thread, None)
+        if slot:
+            self._slots.release()
+
+    def _reclaim(self):
+        # Take back a slot handed over by acquire_async that no request
+        # has used
+        with self._lock:
+            if not self._handed:
+                return False
+            self._handed -= 1
+        if self._slots is not None:
+            self._slots.release()
+        return True
+
+    def acquire(self):
+        """Wait until a request may be made"""
+        tickets = self._local.__dict__.setdefault("tickets", [])
+        tickets.append(self.take())
+
+    def release(self):
+        """Mark a request as finished"""
+        tickets = self._local.__dict__.get("tickets")
+        if tickets:
+            self.give_back(tickets.pop())
+        elif not self._reclaim() and self._slots is not None:
+            self._slots.release()
+
+    def pause(self, seconds):
+        """
+        Hold back all requests for a while
+        ==================================
+
+        Called when the service asks the client to slow down (with a 429
+        or 503 response and a Retry-After header).
+        """
+        self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire_async(self, loop=None):
+        """
+        Wait until a request may be made, in an asyncio event loop
+        ==========================================================
+
+        Returns a future to await. The waiting is done in the loop's
+        default executor, so the loop is not blocked. The slot is then
+        handed over to the next request made to the service (which may
+        be made from any thread, such as an executor's), so it is not
+        counted twice; if no request takes it, it is given back by
+        L{release} or at the end of an C{async with} block. If the
+        future is cancelled, the request is not counted as in flight.
+
+        @rtype: asyncio.Future
+        """
+        import asyncio
+        loop = loop or asyncio.get_event_loop()
+        lock = threading.Lock()
+        state = {"acquired": False, "cancelled": False}
+
+        def acquire():
+            self._wait(self._slots is not None)
+            with lock:
+                if state["cancelled"]:
+                    if self._slots is not None:
+                        self._slots.release()
+                else:
+                    state["acquired"] = True
+                    with self._lock:
+                        self._handed += 1
+
+        def release_if_cancelled(future):
+            if future.cancelled():
+                with lock:
+                    state["cancelled"] = True
+                    if state["acquired"]:
+                        self._reclaim()
+
+        acquired = loop.run_in_executor(None, acquire)
+        acquired.add_done_callback(release_if_cancelled)
+        return acquired
+
+    def __aenter__(self):
+        return self.acquire_async()
+
+    def __aexit__(self, *args):
+        import asyncio
+        self._reclaim()
+        done = asyncio.get_event_loop().create_future()
+        done.set_result(False)
+        return done
+
+
+class ThrottledResponse(object):
+    """
+    A response that releases its throttle when it has been read
+    ===========================================================
+
+    The request stays in flight while the response is streamed, and is
+    released at the end of the data, when the response is closed, or
+    when it is garbage collected, whichever happens first.
+    """
+
+    def __init__(self, response, throttle, ticket):
+        self.response = response
+        self.throttle = throttle
+        self.ticket = ticket
+        self._released = False
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self.throttle.give_back(self.ticket)
+
+    def read(self, *args):
+        data = self.response.read(*args)
+        if not data or not args or args[0] is None or args[0] < 0:
+            self._release()
+        return data
+
+    def readline(self, *args):
+        line = self.response.readline(*args)
+        if not line:
+            self._release()
+        return line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """2.x to 3.x bridge"""
+        return self.next()
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        try:
+            self.response.close()
+        finally:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self._release()
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
@@ -5,6 +5,11 @@ except ImportError:
     from urllib.request import urlopen
     from io import StringIO
 
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:  # pragma: no cover - python 2 without "futures"
+    ThreadPoolExecutor = None
+
 
 def openAnything(source):
     # Try to open with urllib (http, ftp, file url)
@@ -21,6 +26,33 @@ def openAnything(source):
     return StringIO(str(source))
 
 
+def map_concurrently(function, items, max_workers):
+    """
+    Call a function on each item, using a bounded pool of threads
+    =============================================================
+
+    Yields (item, result, error) triples in the order that the calls
+    complete, where error is the exception raised by the call (or None).
+    The calls are made one after another if max_workers is less than two,
+    or if threads are not available.
+    """
+    items = list(items)
+    if max_workers < 2 or len(items) < 2 or ThreadPoolExecutor is None:
+        for item in items:
+            try:
+                yield (item, function(item), None)
+            except Exception as e:
+                yield (item, None, e)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        futures = dict((pool.submit(function, item), item) for item in items)
+        for future in as_completed(futures):
+            error = future.exception()
+            result = None if error is not None else future.result()
+            yield (futures[future], result, error)
+
+
 class ReadableException(Exception):
     def __init__(self, message, cause=None):
         self.message = message
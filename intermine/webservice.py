@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import re
 from xml.dom import minidom
 from contextlib import closing
 
@@ -26,13 +27,15 @@ except ImportError:  # pragma: no cover
                           + "please install simplejson or jsonlib to continue")
 
 # Local intermine imports
-from intermine.query import Query, Template
+from intermine.query import Query, Template, ResultError
 from intermine.model import Model, Attribute, Reference, Collection, Column
 from intermine.lists.listmanager import ListManager
 from intermine.errors import ServiceError, WebserviceError
 from intermine.results import InterMineURLOpener, ResultIterator
 from intermine import idresolution
+from intermine import throttle
 from intermine.decorators import requires_version
+from intermine.util import map_concurrently
 
 """
 Webservice Interaction Routines for InterMine Webservices
@@ -65,7 +68,7 @@ class Registry(DictMixin):
         from intermine.webservice import Registry
 
         # Connect to the default registry service
-        # at www.intermine.org/registry
+        # at registry.intermine.org
         registry = Registry()
 
         # Find all the available mines:
@@ -79,6 +82,9 @@ class Registry(DictMixin):
         for gene in flymine.select("Gene.*").results():
             process(gene)
 
+        # Connect to many mines at once, before querying them
+        services = registry.connect_all(parallel=16)
+
     This class is meant to aid with interoperation between
     mines by allowing them to discover one-another, and
     allow users to always have correct connection information.
@@ -86,31 +92,97 @@ class Registry(DictMixin):
 
     MINES_PATH = "/mines.json"
 
-    def __init__(
-            self, registry_url="http://www.intermine.org/registry"):
+    def __init__(self, registry_url=None, client=None):
+        """
+        Constructor
+        ===========
+
+        By default the mines are read from the shared, cached
+        L{intermine.registry.RegistryClient}. Passing the url of an
+        old-style registry (one that serves "mines.json") reads the
+        mines from there instead.
+
+        @param registry_url: The url of an old-style registry (optional)
+        @param client: The registry client to use (optional)
+        """
         self.registry_url = registry_url
-        opener = InterMineURLOpener()
-        data = opener.open(registry_url + Registry.MINES_PATH).read()
-        mine_data = json.loads(data)
-        self.__mine_dict = dict(((mine["name"], mine)
-                                 for mine in mine_data["mines"]))
+        if registry_url is None:
+            from intermine import registry
+            client = client or registry.get_client()
+            self.registry_url = client.registry_url
+            mines = [dict(mine, webServiceRoot=mine["url"])
+                     for mine in client.instances()]
+        else:
+            opener = InterMineURLOpener()
+            data = opener.open(registry_url + Registry.MINES_PATH).read()
+            mines = json.loads(data)["mines"]
+        self.__mine_dict = dict(((mine["name"], mine) for mine in mines))
         self.__synonyms = dict(((name.lower(), name)
                                 for name in list(self.__mine_dict.keys())))
         self.__mine_cache = {}
+        self.connection_errors = {}
 
     def __contains__(self, name):
         return name.lower() in self.__synonyms
 
     def __getitem__(self, name):
+        """
+        Return the service for a mine
+        =============================
+
+        Services are constructed lazily, so no requests are made to
+        the mine until it is used.
+        """
         lc = name.lower()
         if lc in self.__synonyms:
             if lc not in self.__mine_cache:
                 self.__mine_cache[lc] = Service(
-                    self.__mine_dict[self.__synonyms[lc]]["webServiceRoot"])
+                    self.__mine_dict[self.__synonyms[lc]]["webServiceRoot"],
+                    lazy=True)
             return self.__mine_cache[lc]
         else:
             raise KeyError("Unknown mine: " + name)
 
+    def connect_all(self, names=None, parallel=16, fetch_model=True):
+        """
+        Connect to many mines concurrently
+        ==================================
+
+        Fetches the version, release and (unless fetch_model is false)
+        the data model of each mine, up to C{parallel} mines at a time,
+        so that later uses of these services do not have to wait for
+        them.
+
+        Mines that cannot be reached are left out of the result, and the
+        errors they raised are stored in L{connection_errors}.
+
+        @param names: The mines to connect to (default: all of them)
+        @param parallel: The maximum number of mines to contact at once
+        @param fetch_model: Whether to fetch the data models as well
+
+        @rtype: dict(string, L{Service})
+        """
+        if names is None:
+            names = self.keys()
+        pending = [(name, self[name]) for name in names]
+
+        def connect(pair):
+            service = pair[1].connect()
+            service.release
+            if fetch_model:
+                service.model
+            return service
+
+        self.connection_errors = {}
+        services = {}
+        for (name, _), service, error in map_concurrently(
+                connect, pending, parallel):
+            if error is None:
+                services[name] = service
+            else:
+                self.connection_errors[name] = error
+        return services
+
     def __setitem__(self, name, item):
         raise NotImplementedError(
             "You cannot add items to a registry")
@@ -227,7 +299,9 @@ class Service(object):
 
     def __init__(self, root,
                  username=None, password=None, token=None,
-                 prefetch_depth=1, prefetch_id_only=False):
+                 prefetch_depth=1, prefetch_id_only=False, lazy=False,
+                 compress_requests=False, retry_policy=None,
+                 rate_limit=None, max_in_flight=None):
         """
         Constructor
         ===========
@@ -247,6 +321,22 @@ class Service(object):
         @param username: your login name (optional)
         @param password: your password (required if a username is given)
         @param token: your API access token(optional - used in preference to username and password)
+        @param lazy: if true, do not contact the webservice until it is
+                     first needed (see L{connect})
+        @param compress_requests: if true, send large request bodies (such
+                                  as query XML and list uploads) gzipped.
+                                  Only use this with servers that accept
+                                  compressed requests. Responses are always
+                                  requested compressed.
+        @param retry_policy: how to retry failed requests, and how long to
+                             wait for responses (optional - see
+                             L{intermine.retry.RetryPolicy})
+        @param rate_limit: the most requests to make to this service per
+                           second, from all clients in this process
+                           (optional - see L{intermine.throttle})
+        @param max_in_flight: the most requests to have open to this
+                              service at once, from all clients in this
+                              process (optional)
 
         @raise ServiceError: if the version cannot be fetched and parsed
         @raise ValueError:   if a username is supplied, but no password
@@ -267,6 +357,9 @@ class Service(object):
             root = root + "/service"
 
         self.root = root
+        if rate_limit or max_in_flight:
+            throttle.configure(root, rate=rate_limit,
+                               max_in_flight=max_in_flight)
         self.prefetch_depth = prefetch_depth
         self.prefetch_id_only = prefetch_id_only
         # Initialize empty cached data.
@@ -277,6 +370,7 @@ class Service(object):
         self._version = None
         self._release = None
         self._widgets = None
+        self._counts = {}
         self._list_manager = ListManager(self)
         self.__missing_method_name = None
         if token:
@@ -296,17 +390,12 @@ class Service(object):
         else:
             self.opener = InterMineURLOpener()
 
-        try:
-            self.version
-        except WebserviceError as e:
-            raise ServiceError(
-                "Could not validate service - is the root url (%s) correct? %s"
-                % (root, e))
-
-        if token and self.version < 6:
-            raise ServiceError(
-                "This service does not support API access token authentication"
-            )
+        self.opener.compress_requests = compress_requests
+        if retry_policy is not None:
+            self.opener.policy = retry_policy
+        self._uses_token = bool(token)
+        if not lazy:
+            self.connect()
 
         # Set up sugary aliases
         self.query = self.new_query
@@ -315,8 +404,11 @@ class Service(object):
 
     LIST_MANAGER_METHODS = frozenset(["get_list", "get_all_lists",
                                       "get_all_list_names",
-                                      "create_list", "get_list_count",
-                                      "delete_lists", "l"])
+                                      "create_list", "upload_list",
+                                      "get_list_count",
+                                      "delete_lists", "bulk_delete_lists",
+                                      "bulk_add_tags", "bulk_remove_tags",
+                                      "calculate_enrichments", "l"])
 
     def get_anonymous_token(self, url):
         """
@@ -356,9 +448,39 @@ class Service(object):
             return method
         raise AttributeError("Could not find " + name)
 
+    def connect(self):
+        """
+        Check that the webservice can be reached
+        ========================================
+
+        This fetches the version of the webservice, and checks that it
+        supports the kind of authentication in use. It is called when a
+        service is constructed, unless it was constructed with
+        C{lazy=True}, in which case the version is fetched the first time
+        it is needed, and this method may be called to check the
+        connection explicitly.
+
+        @raise ServiceError: if the version cannot be fetched, or the
+                             service does not support token authentication
+
+        @rtype: L{Service}
+        """
+        try:
+            self.version
+        except WebserviceError as e:
+            raise ServiceError(
+                "Could not validate service - is the root url (%s) correct? %s"
+                % (self.root, e))
+
+        if self._uses_token and self.version < 6:
+            raise ServiceError(
+                "This service does not support API access token authentication"
+            )
+        return self
+
     def __del__(self):  # On going out of scope, try and clean up.
         try:
-            self._list_manager.delete_temporary_lists()
+            self._list_manager.delete_temporary_lists(wait=False)
         except ReferenceError:
             pass
 
@@ -428,7 +550,7 @@ class Service(object):
 
         @return: L{intermine.query.Query}
         """
-        return Query.from_xml(xml, self.model, root=root)
+        return Query.from_xml(xml, self.model, self, root=root)
 
     def select(self, *columns, **kwargs):
         """
@@ -639,6 +761,30 @@ class Service(object):
 
         return idresolution.Job(self, ret['uid'])
 
+    def add_observer(self, observer):
+        """
+        Add an observer to be told about each request to this service
+        =============================================================
+
+        Usage::
+
+            >>> from intermine.instrumentation import MetricsObserver
+            >>> metrics = MetricsObserver()
+            >>> service.add_observer(metrics)
+            >>> rows = list(query.rows())
+            >>> print(metrics.exposition())
+
+        The observer is called with a
+        L{intermine.instrumentation.RequestEvent} once each request is
+        over, with the time spent waiting for the server, reading the
+        response and parsing rows.
+        """
+        self.opener.add_observer(observer)
+
+    def remove_observer(self, observer):
+        """Stop telling an observer about requests to this service"""
+        self.opener.remove_observer(observer)
+
     def flush(self):
         """
         Flushes any cached data.
@@ -652,6 +798,7 @@ class Service(object):
         self._version = None
         self._release = None
         self._widgets = None
+        self._counts = {}
 
     @property
     def templates(self):
@@ -797,7 +944,7 @@ class Service(object):
         @type path: string
         @param params: The query parameters for this request as a dictionary
         @type params: dict
-        @param rowformat: One of "rr", "object", "count", "dict", "list", "tsv", "csv", "jsonrows", "jsonobjects"
+        @param rowformat: One of "rr", "object", "count", "dict", "list", "tsv", "csv", "tsvrows", "csvrows", "jsonrows", "jsonobjects"
         @type rowformat: string
         @param view: The output columns
         @type view: list
@@ -809,6 +956,59 @@ class Service(object):
         return ResultIterator(
             self, path, params, rowformat, view, cld)
 
+    # Parameters that do not change the number of rows a query has.
+    PAGING_PARAMS = frozenset(["start", "size", "format"])
+
+    # Counts of queries that use lists are not cached, as lists can change.
+    LIST_CONSTRAINT_PATTERN = re.compile(r'op="(NOT )?IN"')
+
+    def count_results(self, path, params):
+        """
+        Return the total number of rows for a query or template
+        =======================================================
+
+        This method is called internally by queries and result iterators
+        to count their results. Counts are cached for each query and
+        release of the webservice, so counting the same query again is
+        free. Queries that refer to lists are always counted afresh.
+        Call L{flush} to clear the cache.
+
+        @param path: The resource path (eg: "/query/results")
+        @type path: string
+        @param params: The query parameters for the results
+        @type params: dict
+
+        @raise WebserviceError: for failed requests
+        @raise ResultError: if the count is not a number
+
+        @rtype: int
+        """
+        params = dict((k, v) for k, v in params.items()
+                      if k not in self.PAGING_PARAMS)
+        cacheable = not self._uses_lists(params)
+        if cacheable:
+            key = (path, tuple(sorted(params.items())), self.release)
+            if key in self._counts:
+                return self._counts[key]
+
+        count_str = "".join(self.get_results(path, params, "count", None))
+        try:
+            count = int(count_str)
+        except ValueError:
+            raise ResultError("Server returned a non-integer count: " +
+                              count_str)
+        if cacheable:
+            self._counts[key] = count
+        return count
+
+    def _uses_lists(self, params):
+        for key, value in params.items():
+            if key == "query" and self.LIST_CONSTRAINT_PATTERN.search(value):
+                return True
+            if key.startswith("op") and value in ("IN", "NOT IN"):
+                return True
+        return False
+
     @requires_version(9)
     def register(self, username, password):
         """
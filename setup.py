@@ -134,6 +134,56 @@ class LiveTestCommand(TestCommand):
         self.test_prefix = 'live'
 
 
+class BenchmarkCommand(Command):
+    description = "Run benchmarks against a mock mine"
+    user_options = [
+        ('benchmark=', 'b', 'benchmark module name'),
+        ('repeat=', 'r', 'number of times to time each benchmark'),
+        ('baseline=', None, 'timings to compare with, from --save'),
+        ('save=', None, 'file to save the timings in'),
+        ('tolerance=', None, 'how much slower than the baseline is a '
+                             'regression, as a fraction (default 0.25)'),
+    ]
+
+    def initialize_options(self):
+        self._dir = os.getcwd()
+        self.benchmark = None
+        self.repeat = 5
+        self.baseline = None
+        self.save = None
+        self.tolerance = 0.25
+
+    def finalize_options(self):
+        self.repeat = int(self.repeat)
+        self.tolerance = float(self.tolerance)
+
+    def run(self):
+        '''
+        Finds all the benchmark modules in tests/, and runs them,
+         exiting with the number of regressions from the baseline
+        '''
+        from tests import benchmark
+
+        if self.benchmark is None:
+            modules = ['.'.join(['tests', splitext(basename(b))[0]])
+                       for b in sorted(glob(pjoin(self._dir, 'tests',
+                                                  'bench_*.py')))]
+        else:
+            modules = [self.benchmark]
+
+        timings = benchmark.run(modules, self.repeat)
+        if self.save:
+            benchmark.save(timings, self.save)
+        slower = []
+        if self.baseline:
+            slower = benchmark.regressions(
+                timings, benchmark.load(self.baseline), self.tolerance)
+            for name, before, after in slower:
+                log.warn("%s has regressed: %.3fms -> %.3fms"
+                         % (name, before * 1000, after * 1000))
+        exit(len(slower))
+
+
 class CleanCommand(Command):
     """
     Remove all build files and all compiled files
@@ -197,6 +247,7 @@ extra = {
         'clean': CleanCommand,
         'test': TestCommand,
         'livetest': LiveTestCommand,
+        'benchmark': BenchmarkCommand,
         'version': PrintVersion
     }
 }
@@ -0,0 +1,54 @@
+from intermine.webservice import Service
+from intermine.model import Model
+
+from tests.benchmark import Benchmark
+from tests.mockmine import synthetic_model
+
+
+class ModelBenchmark(Benchmark):  # pragma: no cover
+    """Parsing models of the size of a large mine's"""
+
+    CLASSES = 200
+    ATTRIBUTES = 20
+
+    def setUp(self):
+        super(ModelBenchmark, self).setUp()
+        self.xml = synthetic_model(self.CLASSES, self.ATTRIBUTES)
+        self.model = Model(self.xml)
+
+    def bench_parse_model(self):
+        Model(self.xml)
+
+    def bench_make_path(self):
+        self.model.make_path("Class0.ref.items.ref.items.ref.attr3")
+
+
+class QueryBenchmark(Benchmark):  # pragma: no cover
+    """Building queries, and serialising them to XML"""
+
+    MINE = {}
+    COLUMNS = 40
+    CONSTRAINTS = 20
+
+    def setUp(self):
+        super(QueryBenchmark, self).setUp()
+        self.service = Service(self.mine.root)
+        self.query = self.build()
+
+    def build(self):
+        q = self.service.new_query("Class0")
+        prefixes = ["", "ref.", "items.", "ref.items.", "items.ref."]
+        for i in range(self.COLUMNS):
+            q.add_view(prefixes[i % len(prefixes)] + "attr%d" % (i % 8))
+        for i in range(self.CONSTRAINTS):
+            q.add_constraint(prefixes[i % len(prefixes)] + "attr0", "!=",
+                             "value-%d" % i)
+        q.outerjoin("items")
+        q.add_sort_order("attr1", "DESC")
+        return q
+
+    def bench_build_query(self):
+        self.build()
+
+    def bench_to_xml(self):
+        self.query.to_xml()
@@ -0,0 +1,27 @@
+from intermine.webservice import Service
+
+from tests.benchmark import Benchmark
+
+
+class ListUploadBenchmark(Benchmark):  # pragma: no cover
+    """Creating lists from identifiers"""
+
+    MINE = {}
+    IDENTIFIERS = 50000
+
+    def setUp(self):
+        super(ListUploadBenchmark, self).setUp()
+        self.service = Service(self.mine.root)
+        self.identifiers = ["ID%d" % i for i in range(self.IDENTIFIERS)]
+
+    def bench_create_list(self):
+        self.mine.uploaded.clear()
+        self.service.create_list(self.identifiers, "Class0")
+
+    def bench_create_list_compressed(self):
+        self.mine.uploaded.clear()
+        self.service.opener.compress_requests = True
+        try:
+            self.service.create_list(self.identifiers, "Class0")
+        finally:
+            self.service.opener.compress_requests = False
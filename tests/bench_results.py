@@ -0,0 +1,88 @@
+import json
+from io import BytesIO
+
+from intermine.webservice import Service
+from intermine.model import Model
+from intermine.results import JSONIterator, ResultRow, ResultObject
+
+from tests.benchmark import Benchmark
+from tests.mockmine import SyntheticResults, synthetic_model
+
+VIEW = ["Class0.attr%d" % i for i in range(8)]
+NESTED_VIEW = ["Class0.attr0", "Class0.attr1", "Class0.ref.attr2",
+               "Class0.ref.attr3", "Class0.items.attr0",
+               "Class0.items.ref.attr1", "Class0.items.items.attr2"]
+
+
+class ParsingBenchmark(Benchmark):  # pragma: no cover
+    """Turning responses into rows, without the network"""
+
+    ROWS = 10000
+
+    def setUp(self):
+        super(ParsingBenchmark, self).setUp()
+        model = Model(synthetic_model())
+        self.cld = model.get_class("Class0")
+        results = SyntheticResults(model, VIEW, self.ROWS)
+        self.body = results.body("json")
+        self.rows = [results.row(i) for i in range(self.ROWS)]
+        nested = SyntheticResults(model, NESTED_VIEW, self.ROWS)
+        self.objects = [json.loads(json.dumps(nested.object(i)))
+                        for i in range(self.ROWS)]
+
+    def bench_json_iterator(self):
+        for row in JSONIterator(BytesIO(self.body), lambda x: x):
+            pass
+
+    def bench_result_row(self):
+        for data in self.rows:
+            row = ResultRow(data, VIEW)
+            row[0], row["attr3"], row["Class0.attr7"]
+
+    def bench_result_row_to_d(self):
+        for data in self.rows:
+            ResultRow(data, VIEW).to_d()
+
+    def bench_result_object(self):
+        for data in self.objects:
+            obj = ResultObject(data, self.cld, NESTED_VIEW)
+            obj.attr0, obj.ref.attr3
+            for item in obj.items:
+                item.ref.attr1
+
+
+class ResultsBenchmark(Benchmark):  # pragma: no cover
+    """Fetching results from a mine, streamed in chunks"""
+
+    MINE = {"rows": 20000}
+
+    def setUp(self):
+        super(ResultsBenchmark, self).setUp()
+        self.service = Service(self.mine.root)
+        self.query = self.service.select(*VIEW)
+        self.nested = self.service.select(*NESTED_VIEW)
+
+    def bench_rows(self):
+        for row in self.query.rows():
+            pass
+
+    def bench_tsvrows(self):
+        for row in self.query.results(row="tsvrows"):
+            pass
+
+    def bench_objects(self):
+        for obj in self.nested.results(row="jsonobjects", size=5000):
+            pass
+
+    def bench_dataframe(self):
+        self.query.dataframe()
+
+    def bench_batches(self):
+        for batch in self.query.results(row="tsvrows").batches(frame=True):
+            pass
+
+
+class CompressedResultsBenchmark(ResultsBenchmark):  # pragma: no cover
+    """Fetching gzipped results from a mine"""
+
+    MINE = {"rows": 20000, "gzip": True}
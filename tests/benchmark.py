@@ -0,0 +1,164 @@
+from __future__ import print_function
+
+import importlib
+import json
+import sys
+import time
+
+from tests.mockmine import MockMine
+
+"""
+Benchmarks of the client
+========================
+
+Benchmarks are classes extending L{Benchmark}, in modules named
+tests/bench_*.py, with a method for each thing to time, named bench_*.
+They are run with::
+
+    python setup.py benchmark
+
+Each benchmark is called until it has run for at least MIN_TIME, and
+this is repeated a number of times, keeping the best and median time
+per call. The timings can be saved, and later runs compared with them,
+so that anything which has got slower than the saved time (by more than
+a tolerance) is reported as a regression::
+
+    python setup.py benchmark --save=baseline.json
+    # ... change things ...
+    python setup.py benchmark --baseline=baseline.json
+
+"""
+
+MIN_TIME = 0.2
+
+
+class Benchmark(object):  # pragma: no cover
+    """
+    A set of benchmarks
+    ===================
+
+    If MINE is set (to a dictionary of options for
+    L{tests.mockmine.MockMine}), a mock mine is started before the
+    benchmarks are run and stopped afterwards, and is available as
+    self.mine.
+    """
+
+    MINE = None
+
+    def setUp(self):
+        self.mine = None
+        if self.MINE is not None:
+            self.mine = MockMine(**self.MINE).start()
+
+    def tearDown(self):
+        if self.mine is not None:
+            self.mine.stop()
+
+
+def collect(module_names):
+    """
+    Find the benchmarks in the given modules
+    ========================================
+
+    @rtype: list of (Benchmark class, list of method names)
+    """
+    found = []
+    for module_name in module_names:
+        module = importlib.import_module(module_name)
+        for name in sorted(dir(module)):
+            cls = getattr(module, name)
+            if isinstance(cls, type) and issubclass(cls, Benchmark) \
+                    and cls is not Benchmark \
+                    and cls.__module__ == module.__name__:
+                methods = sorted(m for m in dir(cls) if m.startswith("bench_"))
+                if methods:
+                    found.append((cls, methods))
+    return found
+
+
+def measure(function, repeat=5, min_time=MIN_TIME):
+    """
+    Time a function
+    ===============
+
+    The function is called once to warm up, then as many times as it
+    takes to run for min_time (the same number of calls for each of the
+    repeat samples).
+
+    @return: the time per call of each sample
+    @rtype: list of float
+    """
+    function()
+    number = 1
+    while True:
+        start = time.time()
+        for _ in range(number):
+            function()
+        elapsed = time.time() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.time()
+        for _ in range(number):
+            function()
+        samples.append((time.time() - start) / number)
+    return samples
+
+
+def run(module_names, repeat=5, min_time=MIN_TIME, out=sys.stdout):
+    """
+    Run the benchmarks in the given modules
+    =======================================
+
+    @return: the best and median time per call of each benchmark, by name
+    @rtype: dict(string, dict)
+    """
+    timings = {}
+    for cls, methods in collect(module_names):
+        benchmark = cls()
+        benchmark.setUp()
+        try:
+            for method in methods:
+                name = "%s.%s.%s" % (cls.__module__, cls.__name__, method)
+                samples = sorted(measure(getattr(benchmark, method), repeat,
+                                         min_time))
+                timings[name] = {"best": samples[0],
+                                 "median": samples[len(samples) // 2]}
+                print("%-72s %10.3fms %10.3fms" % (
+                    name, samples[0] * 1000,
+                    samples[len(samples) // 2] * 1000), file=out)
+        finally:
+            benchmark.tearDown()
+    return timings
+
+
+def regressions(timings, baseline, tolerance=0.25):
+    """
+    Find the benchmarks that have got slower
+    ========================================
+
+    A benchmark has regressed if its best time is more than tolerance
+    (as a fraction) slower than its best time in the baseline.
+    Benchmarks missing from either are ignored.
+
+    @rtype: list of (name, baseline time, time)
+    """
+    slower = []
+    for name in sorted(timings):
+        if name in baseline:
+            before, after = baseline[name]["best"], timings[name]["best"]
+            if after > before * (1 + tolerance):
+                slower.append((name, before, after))
+    return slower
+
+
+def load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save(timings, filename):
+    with open(filename, "w") as f:
+        json.dump(timings, f, indent=2, sort_keys=True)
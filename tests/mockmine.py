@@ -0,0 +1,380 @@
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from itertools import groupby
+from socket import socket
+from xml.dom import minidom
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+from intermine.model import Model, Attribute, Collection
+
+"""
+A stand-in InterMine server for benchmarks
+==========================================
+
+Unlike the static fixtures served by L{tests.server.TestServer}, the
+mock mine generates its results from the query it is sent: one column
+per output path, as many rows as asked for (up to the configured number),
+and nested objects for references and collections in "jsonobjects"
+format. Responses can be streamed with chunked transfer encoding, and
+gzipped for clients that accept it. It speaks HTTP/1.1 and answers
+requests in threads, so it keeps up with the client being measured::
+
+    >>> mine = MockMine(rows=100000, gzip=True)
+    >>> mine.start()
+    >>> service = Service(mine.root)
+
+Each distinct response is generated once and then served from memory,
+so repeated timings measure the client, not the server.
+
+"""
+
+ATTRIBUTE_TYPES = ("java.lang.String", "java.lang.Integer",
+                   "java.lang.Double", "java.lang.Boolean")
+
+
+def synthetic_model(classes=10, attributes=8, name="mockmodel"):
+    """
+    Return the XML of a generated model
+    ===================================
+
+    The model has classes Class0, Class1, ..., each with attributes
+    attr0, attr1, ... (cycling through string, integer, floating point
+    and boolean types), a reference "ref" and a collection "items" to the
+    next class (the last class refers back to the first), so paths can
+    be nested as deeply as needed::
+
+        Class0.ref.items.ref.attr3
+
+    @rtype: string
+    """
+    lines = ['<model name="%s" package="org.intermine.model.%s">'
+             % (name, name)]
+    for i in range(classes):
+        lines.append('  <class name="Class%d" is-interface="true">' % i)
+        for j in range(attributes):
+            lines.append('    <attribute name="attr%d" type="%s"/>'
+                         % (j, ATTRIBUTE_TYPES[j % len(ATTRIBUTE_TYPES)]))
+        target = "Class%d" % ((i + 1) % classes)
+        lines.append('    <reference name="ref" referenced-type="%s"/>'
+                     % target)
+        lines.append('    <collection name="items" referenced-type="%s"/>'
+                     % target)
+        lines.append('  </class>')
+    lines.append('</model>')
+    return "\n".join(lines)
+
+
+def cell(type_name, row, column):
+    """Return a made up value of the given type for a cell"""
+    if type_name in ("int", "Integer", "long", "Long", "short", "Short"):
+        return row * 31 + column
+    if type_name in ("double", "Double", "float", "Float"):
+        return row / 7.0 + column
+    if type_name in ("boolean", "Boolean"):
+        return (row + column) % 2 == 0
+    return "value-%d-%d" % (row, column)
+
+
+class SyntheticResults(object):
+    """
+    Results for a query, made up from its view
+    ==========================================
+
+    Rows are generated in blocks, in the formats the webservice sends:
+    JSON rows ("json"), nested objects ("jsonobjects"), tab and comma
+    separated values ("tab" and "csv") and counts ("count").
+    """
+
+    BLOCK = 1000
+
+    def __init__(self, model, view, rows, collection_size=2):
+        self.model = model
+        self.view = view
+        self.rows = rows
+        self.collection_size = collection_size
+        self.root = view[0].split(".")[0] if view else None
+        self.types = []
+        for path in view:
+            try:
+                self.types.append(model.make_path(path).end.type_name)
+            except Exception:
+                self.types.append("String")
+
+    def row(self, index):
+        return [cell(t, index, i) for i, t in enumerate(self.types)]
+
+    def body(self, format):
+        """Return the whole response body, as bytes"""
+        return b"".join(self.blocks(format))
+
+    def blocks(self, format):
+        """Yield the response body in blocks of rows"""
+        if format == "count":
+            yield str(self.rows).encode("ascii")
+            return
+        if format in ("tab", "csv"):
+            sep = "\t" if format == "tab" else ","
+            for start in range(0, self.rows, self.BLOCK):
+                yield "".join(
+                    sep.join(self.flat(v) for v in self.row(i)) + "\n"
+                    for i in self.range(start)).encode("utf8")
+            return
+        make = self.object if format == "jsonobjects" else self.row
+        header = {"rootClass": self.root, "modelName": self.model.name,
+                  "start": 0, "views": self.view}
+        yield (json.dumps(header)[:-1] + ',"results":[\n').encode("utf8")
+        for start in range(0, self.rows, self.BLOCK):
+            yield "".join(
+                json.dumps(make(i)) + (",\n" if i < self.rows - 1 else "\n")
+                for i in self.range(start)).encode("utf8")
+        yield (b'],"executionTime":"2011.04.02 14:41::10",'
+               b'"wasSuccessful":true,"error":null,"statusCode":200}\n')
+
+    def range(self, start):
+        return range(start, min(self.rows, start + self.BLOCK))
+
+    def flat(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return str(value)
+
+    def object(self, index):
+        paths = [v.split(".")[1:] for v in self.view]
+        return self.build(self.model.get_class(self.root), paths, index, 0)
+
+    def build(self, cld, paths, index, depth):
+        """Make an object of the given class with the fields on the paths"""
+        data = {"class": cld.name, "objectId": index * 100 + depth}
+        for name, group in groupby(sorted(paths), lambda p: p[0]):
+            field = cld.get_field(name)
+            if isinstance(field, Attribute):
+                data[name] = cell(field.type_name, index, depth)
+                continue
+            rest = [p[1:] for p in group if len(p) > 1]
+            if isinstance(field, Collection):
+                data[name] = [
+                    self.build(field.type_class, rest, index * 10 + i,
+                               depth + 1)
+                    for i in range(self.collection_size)]
+            else:
+                data[name] = self.build(field.type_class, rest, index,
+                                        depth + 1)
+        return data
+
+
+class MockMineRequestHandler(BaseHTTPRequestHandler):  # pragma: no cover
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        """Don't log anything, unless you say so"""
+        if not self.server.mine.silent:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def do_GET(self):
+        self.handle_request(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = zlib.decompress(body, 31)
+        self.handle_request(body)
+
+    def handle_request(self, body):
+        mine = self.server.mine
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if "form-urlencoded" in (self.headers.get("Content-Type") or ""):
+            params.update(parse_qs(body.decode("utf8")))
+        params = dict((k, v[0]) for k, v in params.items())
+        path = url.path
+        if path.startswith("/service"):
+            path = path[len("/service"):]
+        route = mine.ROUTES.get(path)
+        if route is None:
+            return self.respond(404, b"No such resource: " + path.encode("utf8"))
+        self.respond(*getattr(mine, route)(params, body))
+
+    def respond(self, status, content, key=None):
+        mine = self.server.mine
+        if not isinstance(content, bytes):
+            content = content.encode("utf8")
+        accepted = self.headers.get("Accept-Encoding") or ""
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        if mine.gzip and "gzip" in accepted:
+            content = mine.compressed(content, key)
+            self.send_header("Content-Encoding", "gzip")
+        if mine.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            size = mine.chunk_size
+            for i in range(0, len(content), size):
+                chunk = content[i:i + size]
+                self.wfile.write(("%x\r\n" % len(chunk)).encode("ascii"))
+                self.wfile.write(chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+
+class MockMineServer(ThreadingMixIn, HTTPServer):  # pragma: no cover
+
+    daemon_threads = True
+
+
+class MockMine(threading.Thread):  # pragma: no cover
+    """
+    A mine that makes up its data
+    =============================
+
+    @param rows: The most rows any query returns
+    @param classes: The number of classes in the model
+    @param attributes: The number of attributes of each class
+    @param collection_size: The number of items in each collection
+    @param chunked: Whether to stream responses in chunks
+    @param gzip: Whether to compress responses (if the client accepts it)
+    @param chunk_size: The size of each chunk when streaming
+    @param version: The webservice version to report
+    """
+
+    ROUTES = {
+        "/version/ws": "version",
+        "/version/release": "release",
+        "/model": "model_xml",
+        "/lists": "lists",
+        "/query/results": "results",
+    }
+    CACHE_SIZE = 16
+
+    def __init__(self, rows=10000, classes=10, attributes=8,
+                 collection_size=2, chunked=True, gzip=False,
+                 chunk_size=64 * 1024, version=30, silent=True):
+        super(MockMine, self).__init__()
+        self.daemon = True
+        self.rows = rows
+        self.collection_size = collection_size
+        self.chunked = chunked
+        self.gzip = gzip
+        self.chunk_size = chunk_size
+        self.ws_version = version
+        self.silent = silent
+        self.xml = synthetic_model(classes, attributes)
+        self.model = Model(self.xml)
+        self.uploaded = OrderedDict()
+        self.http = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        sock = socket()
+        sock.bind(('', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+
+    @property
+    def root(self):
+        return "http://localhost:%d/service" % self.port
+
+    def run(self):
+        self.http = MockMineServer(('', self.port), MockMineRequestHandler)
+        self.http.mine = self
+        self._ready.set()
+        self.http.serve_forever()
+
+    def start(self):
+        """Start serving, returning once the server is listening"""
+        super(MockMine, self).start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self.http is not None:
+            self.http.shutdown()
+            self.http.server_close()
+        self.join()
+
+    def cached(self, key, make):
+        """Return a response body, generating it the first time"""
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        content = make()
+        with self._lock:
+            self._cache[key] = content
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return content
+
+    def compressed(self, content, key=None):
+        if key is None:
+            return gzip_bytes(content)
+        return self.cached(("gzip",) + key, lambda: gzip_bytes(content))
+
+    # Each resource returns (status, content), and optionally a key to
+    # cache the compressed content under
+
+    def version(self, params, body):
+        return 200, str(self.ws_version)
+
+    def release(self, params, body):
+        return 200, "mock"
+
+    def model_xml(self, params, body):
+        return 200, self.xml
+
+    def results(self, params, body):
+        query = minidom.parseString(params["query"]).documentElement
+        view = query.getAttribute("view").split()
+        start = int(params.get("start") or 0)
+        size = params.get("size")
+        rows = max(0, self.rows - start)
+        if size:
+            rows = min(rows, int(size))
+        format = params.get("format", "json")
+        key = ("results", format, tuple(view), rows)
+        return 200, self.cached(key, lambda: SyntheticResults(
+            self.model, view, rows, self.collection_size).body(format)), key
+
+    def lists(self, params, body):
+        if body and "name" in params:
+            identifiers = [i.strip('"') for i in body.decode("utf8").split()]
+            self.uploaded[params["name"]] = {
+                "name": params["name"], "title": params["name"],
+                "description": params.get("description", ""),
+                "type": params.get("type"), "size": len(identifiers),
+                "dateCreated": "2011-05-07T19:52:03", "authorized": True,
+                "tags": [t for t in params.get("tags", "").split(";") if t]}
+            return 200, json.dumps({
+                "wasSuccessful": True, "listName": params["name"],
+                "unmatchedIdentifiers": [], "statusCode": 200})
+        return 200, json.dumps({
+            "lists": list(self.uploaded.values()), "wasSuccessful": True,
+            "error": None, "statusCode": 200})
+
+
+def gzip_bytes(content):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(content) + compressor.flush()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    import time
+    mine = MockMine(silent=False).start()
+    print("Serving a mock mine at " + mine.root)
+    while True:
+        time.sleep(60)
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import matplotlib
+matplotlib.use("Agg")
+
+from intermine import bar_chart
+from intermine.webservice import Service
+from tests.test_core import WebserviceTest
+
+XML = ('<query model="testmodel" '
+       'view="Employee.id Employee.name Employee.age"></query>')
+
+
+class BarChartTest(WebserviceTest):  # pragma: no cover
+
+    PATH = "/testservice/chartservice"
+
+    def get_test_root(self):
+        return "http://localhost:" + str(self.TEST_PORT) + self.PATH
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        bar_chart.set_service(Service(self.get_test_root()))
+
+    def tearDown(self):
+        bar_chart.set_service(None)
+        shutil.rmtree(self.dir)
+
+    def output(self, name="chart.png"):
+        return os.path.join(self.dir, name)
+
+    def bars(self, fig):
+        ax = fig.axes[0]
+        return ([t.get_text() for t in ax.get_xticklabels()],
+                [p.get_height() for p in ax.patches])
+
+    def testLoadColumns(self):
+        """Should load the labels and values of a query as arrays"""
+        labels, values, first = bar_chart.load_columns(XML)
+        self.assertEqual(list(labels), ["David", "Tim", "Gareth"])
+        self.assertEqual(values.tolist(), [10.0, 100.0, 1000.0])
+        self.assertEqual(first, "Employee-1")
+
+    def testLogValues(self):
+        """Should take the natural log of values, rounded to 2 places"""
+        self.assertEqual(bar_chart.log_values([1, 10, 100]).tolist(),
+                         [0.0, 2.3, 4.61])
+        self.assertEqual(bar_chart.log_values([0]).tolist(), [float("-inf")])
+
+    def testQueryToBarchart(self):
+        """Should plot the second column of a query against the third"""
+        fig = bar_chart.query_to_barchart(XML, output=self.output())
+        self.assertTrue(os.path.getsize(self.output()) > 0)
+        self.assertEqual(self.bars(fig), (["David", "Tim", "Gareth"],
+                                          [10.0, 100.0, 1000.0]))
+        self.assertEqual(fig.axes[0].get_title(), "Employee-1")
+        self.assertEqual(fig.axes[0].get_ylabel(), "Employee.age")
+
+        fig = bar_chart.query_to_barchart(XML, log=True,
+                                          output=self.output("log.png"))
+        self.assertEqual(self.bars(fig)[1], [2.3, 4.61, 6.91])
+        self.assertEqual(fig.axes[0].get_ylabel(), "log(Employee.age)")
+        self.assertTrue(os.path.exists(self.output("log.png")))
+
+    def testQueryToBarchartLog(self):
+        """Should keep the old way of asking for log values"""
+        fig = bar_chart.query_to_barchart_log(XML, 'true',
+                                              output=self.output())
+        self.assertEqual(self.bars(fig)[1], [2.3, 4.61, 6.91])
+        fig = bar_chart.query_to_barchart_log(XML, 'false',
+                                              output=self.output())
+        self.assertEqual(self.bars(fig)[1], [10.0, 100.0, 1000.0])
+
+    def testSummarise(self):
+        """Should plot the number of results for each value of a column"""
+        bar_chart.set_service(Service(
+            "http://localhost:" + str(self.TEST_PORT) +
+            "/testservice/chartsummaries"))
+        fig = bar_chart.query_to_barchart(XML, summarise=True,
+                                          output=self.output())
+        self.assertEqual(self.bars(fig), (["David", "Tim"], [3.0, 2.0]))
+        self.assertEqual(fig.axes[0].get_title(), "Employee.name")
+        self.assertEqual(fig.axes[0].get_ylabel(), "count")
+        self.assertTrue(os.path.getsize(self.output()) > 0)
+
+    def testTopGoTerms(self):
+        """Should fetch the five most enriched GO terms of a list"""
+        rows = bar_chart._top_go_terms("test-list-1")
+        self.assertEqual([r.identifier for r in rows],
+                         ["GO:000000%d" % i for i in range(1, 6)])
+        self.assertEqual(rows[0].p_value, 0.001)
+
+        fig = bar_chart.plot_go_vs_count("test-list-1", output=self.output())
+        self.assertEqual(self.bars(fig)[1], [12, 11, 10, 9, 8])
+        self.assertTrue(os.path.getsize(self.output()) > 0)
+
+    def testNoService(self):
+        """Should say when no mine has been chosen"""
+        bar_chart.set_service(None)
+        self.assertRaises(ValueError, bar_chart.get_service)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
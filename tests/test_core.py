@@ -1,13 +1,44 @@
+import gc
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
 import time
 import unittest
 import logging
 import sys
+from contextlib import closing
+
+try:
+    from urllib2 import HTTPError, URLError
+except ImportError:
+    from urllib.error import HTTPError, URLError
 
 from intermine.model import *
 from intermine.webservice import *
 from intermine.query import *
 from intermine.constraints import *
 from intermine.lists.list import List
+from intermine.federation import FederatedQuery
+from intermine.results import JSONIterator, ReadAheadIterator
+from intermine.results import ParallelJSONIterator, ResultRow
+from intermine.results import DecompressingReader, InterMineURLOpener
+from intermine.results import TypedFlatFileIterator, column_array
+from intermine.results import SpooledResults, ResumableIterator
+import intermine.results
+from intermine.retry import RetryPolicy, retry_after, service_root
+from intermine.errors import CircuitOpenError
+from intermine import throttle
+from intermine.throttle import Throttle
+from intermine.instrumentation import LoggingObserver, MetricsObserver
+from intermine.instrumentation import OpenTelemetryObserver
+from intermine.instrumentation import ResultProfile, profiling
+from tests.mockmine import MockMine
+from tests.benchmark import regressions
+import gzip
+import zlib
 
 from tests.server import TestServer
 
@@ -67,6 +98,133 @@ class TestInstantiation(WebserviceTest):  # pragma: no cover
         s = Service(self.get_test_root())
         self.assertTrue(isinstance(s, Service), "Can make a service")
 
+    def testMakeLazyService(self):
+        """Should be able to make a Service without contacting it"""
+        bad = "http://localhost:" + str(self.TEST_PORT) + "/nosuchservice"
+        s = Service(bad, lazy=True)
+        self.assertEqual(s._version, None)
+        self.assertRaises(ServiceError, s.connect)
+        self.assertRaises(ServiceError, lambda: Service(bad))
+
+        s = Service(self.get_test_root(), lazy=True)
+        self.assertTrue(s.connect() is s)
+        self.assertTrue(s.version > 0)
+
+
+class TestRegistry(WebserviceTest):  # pragma: no cover
+
+    def testConnectAll(self):
+        """Should be able to connect to many registry mines at once"""
+        bad = "http://localhost:" + str(self.TEST_PORT) + "/nosuchservice"
+        instances = [
+            {"name": "TestMine", "url": self.get_test_root()},
+            {"name": "OtherMine", "url": self.get_test_root()},
+            {"name": "BadMine", "url": bad},
+        ]
+
+        class MockClient(object):
+            registry_url = "http://registry"
+
+            def instances(self):
+                return instances
+
+        registry = Registry(client=MockClient())
+        self.assertEqual(registry["testmine"]._version, None)
+
+        services = registry.connect_all(parallel=3)
+        self.assertEqual(sorted(services), ["OtherMine", "TestMine"])
+        self.assertTrue(services["TestMine"] is registry["TestMine"])
+        self.assertEqual(services["TestMine"].release, "FOO")
+        self.assertEqual(services["OtherMine"].model.name, "testmodel")
+        self.assertEqual(list(registry.connection_errors), ["BadMine"])
+
+
+class TestFederatedQuery(WebserviceTest):  # pragma: no cover
+
+    def testFederatedRows(self):
+        """Should be able to run a query against many mines, checking paths"""
+        s = Service(self.get_test_root())
+        q = s.select("Employee.name", "Employee.age", "Employee.end")
+        federated = FederatedQuery(
+            {"A": s, "B": s, "C": s}, q,
+            translations={"B": {"Employee": "Manager"},
+                          "C": {"Employee.age": "Employee.nosuchfield"}})
+        self.assertEqual(federated.translate("B", "Employee.age"),
+                         "Manager.age")
+
+        queries = federated.queries()
+        self.assertEqual(sorted(queries), ["A", "B"])
+        self.assertEqual(queries["B"].views[0], "Manager.name")
+        self.assertTrue(isinstance(federated.errors["C"], ModelError))
+
+        rows = list(federated.rows(row="list"))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(sorted(set(mine for mine, _ in rows)), ["A", "B"])
+        self.assertTrue(("A", ["foo", "bar", "baz"]) in rows)
+
+    def testOrderedMerge(self):
+        """Should be able to merge the rows from many mines in order"""
+        data = {
+            "A": [["a", 3], ["c", 2], [None, 1]],
+            "B": [["b", 9], ["d", 8]],
+        }
+        started = []
+
+        class MockQuery(object):
+
+            def __init__(self, mine):
+                self.mine = mine
+                self.views = ["Gene.symbol", "Gene.length"]
+                self.sort_order = []
+
+            def verify(self):
+                pass
+
+            def clone(self):
+                return MockQuery(self.mine)
+
+            def clear_sort_order(self):
+                self.sort_order = []
+
+            def prefix_path(self, path):
+                return path if path.startswith("Gene") else "Gene." + path
+
+            def add_sort_order(self, path, direction):
+                self.sort_order.append((path, direction))
+
+            def results(self, row):
+                started.append(self.mine)
+                return iter(data[self.mine])
+
+        federated = FederatedQuery(
+            {"A": "A", "B": "B"}, lambda mine: MockQuery(mine))
+        merged = list(federated.rows(row="list", order_by=["symbol"]))
+        self.assertEqual([r[0] for _, r in merged],
+                         ["a", "b", "c", "d", None])
+        self.assertEqual([m for m, _ in merged], ["A", "B", "A", "B", "A"])
+
+        data["A"].reverse()
+        data["B"].reverse()
+        merged = list(federated.rows(
+            row="list", order_by=[("symbol", "desc")]))
+        self.assertEqual([r[0] for _, r in merged],
+                         [None, "d", "c", "b", "a"])
+        self.assertRaises(ValueError, lambda: federated.rows(
+            row="jsonobjects", order_by=["symbol"]))
+        self.assertRaises(QueryError, lambda: federated.rows(
+            row="list", order_by=["name"]))
+
+        # Mines that cannot be ordered are left out, before any is queried
+        del started[:]
+        federated = FederatedQuery(
+            {"A": "A", "B": "B"}, lambda mine: MockQuery(mine),
+            translations={"B": {"symbol": "name"}}, max_workers=1)
+        merged = list(federated.rows(row="list", order_by=["symbol"]))
+        self.assertEqual([m for m, _ in merged], ["A", "A", "A"])
+        self.assertEqual(started, ["A"])
+        self.assertEqual(list(federated.errors), ["B"])
+        self.assertTrue(isinstance(federated.errors["B"], QueryError))
+
 
 class TestModel(WebserviceTest):  # pragma: no cover
 
@@ -980,6 +1138,340 @@ class TestQueryResults(WebserviceTest):  # pragma: no cover
         t.add_constraint("Employee.age", ">", 25)
         self.template = t
 
+    def testLazyColumnTypes(self):
+        """Should only look up the types of the columns when they are used"""
+        q = Query(self.model, self.service)
+        q.add_constraint("Employee", "CEO")
+        q.add_view("Employee.name", "Employee.salary")
+        results = q.results(row="list")
+        self.assertIsNone(results.types)
+        self.assertEqual(results.column_types(), ["String", "int"])
+
+    def testOneAndProgress(self):
+        """Should get one result in one request, and report progress"""
+        q = Query(self.model, self.service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        self.assertRaises(QueryError, lambda: q.one(row="list"))
+
+        # Neither one nor first leave the connection open
+        t = throttle.configure(self.service.root, max_in_flight=1)
+        try:
+            self.assertRaises(QueryError, lambda: q.one(row="list"))
+            self.assertTrue(t._slots.acquire(False))
+            t.release()
+            self.assertEqual(q.first(row="list"), ["foo", "bar", "baz"])
+            self.assertTrue(t._slots.acquire(False))
+            t.release()
+        finally:
+            throttle.reset()
+
+        reports = []
+        rows = [r for r in q.results(
+            row="list", progress=lambda *a: reports.append(a))]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(reports, [(3, None)])
+
+    def testReadAhead(self):
+        """Should be able to read results ahead in a background thread"""
+        q = Query(self.model, self.service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        rows = [r for r in q.results(row="list", read_ahead=2)]
+        self.assertEqual(rows[0], ["foo", "bar", "baz"])
+        self.assertEqual(len(rows), 3)
+
+        it = ReadAheadIterator(iter(range(1000)), buffer_size=10, chunk_size=3)
+        self.assertEqual([x for x in it], list(range(1000)))
+
+        def failing():
+            yield 1
+            raise WebserviceError("Connection interrupted")
+
+        it = ReadAheadIterator(failing(), buffer_size=10)
+        self.assertEqual(next(it), 1)
+        self.assertRaises(WebserviceError, lambda: next(it))
+
+        it = ReadAheadIterator(iter(range(1000)), buffer_size=10, chunk_size=5)
+        self.assertEqual(next(it), 0)
+        it.close()
+        it._thread.join(1)
+        self.assertFalse(it._thread.is_alive())
+
+        closed = []
+
+        def endless():
+            try:
+                while True:
+                    yield 1
+            finally:
+                closed.append(True)
+
+        it = ReadAheadIterator(endless(), buffer_size=10, chunk_size=5)
+        for x in it:
+            break
+        thread = it._thread
+        del it
+        gc.collect()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(closed, [True])
+
+        results = q.results(row="list", read_ahead=2)
+        results.chunk_size = 1
+        for row in results:
+            break
+        thread = results._buffer._thread
+        results.close()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(results._buffer)
+
+    def testAbandonedStream(self):
+        """Should give back the slot of results that are not read to the end"""
+        service = Service(self.get_test_root())
+        t = throttle.configure(service.root, max_in_flight=1)
+        try:
+            q = Query(self.model, service)
+            q.add_view("Employee.name", "Employee.age", "Employee.id")
+            results = q.results(row="list")
+            for row in results:
+                break
+            self.assertFalse(t._slots.acquire(False))
+            results.close()
+            self.assertTrue(t._slots.acquire(False))
+            t.release()
+
+            results = q.results(row="list", read_ahead=2)
+            results.chunk_size = 1
+            for row in results:
+                break
+            del results, row
+            gc.collect()
+            deadline = time.time() + 2
+            while not t._slots.acquire(False) and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(time.time() < deadline)
+            t.release()
+        finally:
+            throttle.reset()
+
+    def testNestedRequests(self):
+        """Should let a thread make requests while reading results"""
+        service = Service(self.get_test_root())
+        t = throttle.configure(service.root, max_in_flight=1)
+        counts = []
+
+        def read():
+            q = Query(self.model, service)
+            q.add_view("Employee.name", "Employee.age", "Employee.id")
+            for row in q.results(row="list"):
+                counts.append(len([r for r in q.results(row="list")]))
+
+        try:
+            reader = threading.Thread(target=read)
+            reader.daemon = True
+            reader.start()
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+            self.assertEqual(counts, [3, 3, 3])
+            self.assertTrue(t._slots.acquire(False))
+            t.release()
+        finally:
+            throttle.reset()
+
+    def testResumable(self):
+        """Should be able to resume reading results after a failure"""
+        service = Service(self.get_test_root())
+        q = Query(self.model, service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        requests = []
+        real_open = service.opener.open
+
+        def flaky_open(url, data=None, *args, **kwargs):
+            requests.append(data)
+            if len(requests) == 1:
+                return io.BytesIO(b'{"results":[\n["a",1,2],\n["b",3,4],\n')
+            return real_open(url, data, *args, **kwargs)
+
+        service.opener.open = flaky_open
+        self.addCleanup(setattr, ResumableIterator, "DELAY",
+                        ResumableIterator.DELAY)
+        ResumableIterator.DELAY = 0
+        directory = tempfile.mkdtemp()
+        checkpoint = os.path.join(directory, "checkpoint")
+        try:
+            results = q.results(row="list", retries=1, checkpoint=checkpoint)
+            rows = [r for r in results]
+            self.assertEqual(rows[:2], [["a", 1, 2], ["b", 3, 4]])
+            self.assertEqual(len(rows), 5)
+            self.assertIn("start=2", requests[1])
+            self.assertFalse(os.path.exists(checkpoint))
+
+            # Stopping part way keeps the place, for the next process
+            del requests[:]
+            results = q.results(row="list", retries=1, checkpoint=checkpoint)
+            it = iter(results)
+            next(it)
+            next(it)
+            it.close()
+            self.assertTrue(os.path.exists(checkpoint))
+            rows = [r for r in q.results(row="list", checkpoint=checkpoint)]
+            self.assertIn("start=1", requests[1])
+            self.assertEqual(len(rows), 3)
+
+            # Without retries, failures are raised
+            del requests[:]
+            results = q.results(row="list", checkpoint=checkpoint)
+            self.assertRaises(WebserviceError, lambda: [r for r in results])
+        finally:
+            shutil.rmtree(directory)
+        self.assertRaises(ValueError, iter, q.results(retries=1))
+
+    def testObservers(self):
+        """Should tell observers about each request, and the rows parsed"""
+        service = Service(self.get_test_root())
+        q = Query(self.model, service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        events = []
+        metrics = MetricsObserver()
+        service.add_observer(events.append)
+        service.add_observer(metrics)
+        rows = [r for r in q.results(row="list")]
+        self.assertEqual(len(rows), 3)
+        event = events[-1]
+        self.assertEqual((event.method, event.path, event.status),
+                         ("POST", "/query/results", 200))
+        self.assertEqual(event.rows, 3)
+        self.assertTrue(event.bytes > 0 and event.payload_size > 0)
+        self.assertTrue(event.duration >= event.time_to_first_byte >= 0)
+        self.assertTrue(event.parse_time >= 0)
+        self.assertIsNone(event.error)
+
+        service.opener.read(self.get_test_root() + "/version/ws")
+        self.assertEqual(events[-1].path, "/version/ws")
+        self.assertIsNone(events[-1].rows)
+        self.assertIn('intermine_client_rows_total{root="%s",'
+                      'path="/query/results",status="200"} 3'
+                      % service.root, metrics.exposition())
+
+        service.remove_observer(events.append)
+        count = len(events)
+        service.opener.read(self.get_test_root() + "/version/ws")
+        self.assertEqual(len(events), count)
+
+    def testProfile(self):
+        """Should be able to record where the time goes reading results"""
+        q = Query(self.model, self.service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        results = q.results(row="rr", profile=True)
+        rows = [r.to_l() for r in results]
+        self.assertEqual(len(rows), 3)
+        profile = results.profile
+        self.assertEqual(profile.rows, 3)
+        times = profile.as_dict()
+        for phase in ResultProfile.PHASES:
+            self.assertTrue(times[phase] >= 0)
+        self.assertTrue(profile.construction >= 0)
+        self.assertAlmostEqual(
+            sum(times[p] for p in ResultProfile.PHASES), profile.total)
+        self.assertIn("Rows:", profile.report())
+        self.assertIsNone(q.results(row="rr").profile)
+
+        with profiling() as block:
+            rows = [r for r in q.rows()] + [r for r in q.results(row="tsv")]
+        self.assertEqual(block.rows, len(rows))
+        self.assertTrue(block.network > 0)
+
+    def testParallelDecoding(self):
+        """Should be able to decode rows in a pool of processes, in order"""
+        q = Query(self.model, self.service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        rows = [r for r in q.results(row="list", processes=2)]
+        self.assertEqual(rows, [r for r in q.results(row="list")])
+
+        body = b'{"results":[\n' + b',\n'.join(
+            ('[%d,"x%d"]' % (i, i)).encode('ascii') for i in range(25)) + \
+            b'\n],"wasSuccessful":true,"statusCode":200}\n'
+        it = ParallelJSONIterator(
+            io.BytesIO(body), lambda x: x, 2,
+            ("dict", ResultRow, ["Employee.age", "Employee.name"]),
+            chunk_size=4)
+        decoded = [r for r in it]
+        self.assertEqual(len(decoded), 25)
+        self.assertEqual(decoded[24], {"Employee.age": 24,
+                                       "Employee.name": "x24"})
+        self.assertEqual([r["Employee.age"] for r in decoded], list(range(25)))
+
+    def testSpoolJSON(self):
+        """Should be able to spool JSON results, and check their status"""
+        q = Query(self.model, self.service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        directory = tempfile.mkdtemp()
+        try:
+            spooled = q.spool(os.path.join(directory, "r.json"), "json")
+            self.assertEqual(list(spooled)[1], [123, 1.23, -1.23])
+            self.assertRaises(ValueError, q.spool, "x", "rr")
+
+            failed = os.path.join(directory, "failed.json")
+            with open(failed, "wb") as f:
+                f.write(b'{"results":[\n["a"]\n],"wasSuccessful":false,'
+                        b'"error":"Oops","statusCode":500}')
+            bad = SpooledResults(failed, "json", ["Employee.name"], ["String"])
+            self.assertRaises(WebserviceError, bad.check_status)
+            with open(failed, "wb") as f:
+                f.write(b'{"results":[\n["a"],\n')
+            self.assertRaises(WebserviceError, bad.check_status)
+        finally:
+            shutil.rmtree(directory)
+
+    def testTotalFromContainer(self):
+        """Should read the total number of results from the JSON container"""
+        con = io.BytesIO(b'{"count":42,"results":[\n[1],\n[2]\n'
+                         b'],"wasSuccessful":true,"statusCode":200}\n')
+        it = JSONIterator(con, lambda x: x)
+        self.assertEqual(it.total, 42)
+        self.assertEqual(list(it), [[1], [2]])
+
+        con = io.BytesIO(b'{"results":[\n[1]\n'
+                         b'],"wasSuccessful":true,"statusCode":200}\n')
+        it = JSONIterator(con, lambda x: x)
+        self.assertEqual(it.total, None)
+
+    def testColumnSummaries(self):
+        """Should be able to summarise several columns at once"""
+        requests = []
+
+        class SummaryService(self.MockService):
+
+            def get_results(self, path, params, rowformat, view, cld=None):
+                requests.append((params["summaryPath"], params.get("size")))
+                if params["summaryPath"] == "Employee.age":
+                    return iter([
+                        {"min": 10, "max": 50, "average": 30.5, "stdev": 2,
+                         "buckets": 4, "bucket": b, "count": c}
+                        for b, c in [(1, 3), (2, 5), (3, 0), (4, 1)]])
+                return iter([{"item": "Fred", "count": 4},
+                             {"item": "Ginger", "count": 2}])
+
+        q = Query(self.model, SummaryService())
+        q.add_view("Employee.name", "Employee.age")
+
+        summaries = q.summarise_columns(top=2)
+        self.assertEqual(sorted(requests),
+                         [("Employee.age", None), ("Employee.name", 2)])
+        age = summaries["Employee.age"]
+        self.assertEqual(age.average, 30.5)
+        self.assertEqual(age.to_dict()["max"], 50.0)
+        self.assertEqual(list(age.lowers), [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(list(age.counts), [3, 5, 0, 1])
+        names = summaries["Employee.name"]
+        self.assertEqual(list(names.items), ["Fred", "Ginger"])
+        self.assertEqual(names.to_dict(), {"Fred": 4, "Ginger": 2})
+
+        frames = q.summarise_columns("name", frame=True)
+        self.assertEqual(list(frames["Employee.name"]["count"]), [4, 2])
+        self.assertEqual(next(q.histogram("age")), (10.0, 20.0, 3))
+        self.assertRaises(QueryError, lambda: q.histogram("name"))
+
     def testURLs(self):
         """Should be able to produce the right information for opening urls"""
         q = Query(self.model, self.MockService())
@@ -1266,6 +1758,7 @@ class TestTSVResults(WebserviceTest):  # pragma: no cover
     service = None
     PATH = "/testservice/tsvservice"
     FORMAT = "tsv"
+    TYPED_FORMAT = "tsvrows"
     EXPECTED_RESULTS = ['foo\tbar\tbaz', '123\t1.23\t-1.23']
 
     def get_test_root(self):
@@ -1301,11 +1794,80 @@ class TestTSVResults(WebserviceTest):  # pragma: no cover
         self.do_unpredictable_test(logic)
 
 
+    def testTypedRows(self):
+        """Should be able to get results as tuples, and in batches"""
+        if self.TYPED_FORMAT is None:
+            return
+        q = Query(self.model, self.service)
+        q.add_view("Employee.name", "Employee.end", "Employee.department.name")
+        expected = [("foo", "bar", "baz"), ("123", "1.23", "-1.23")]
+
+        def logic():
+            self.assertEqual(q.get_results_list(self.TYPED_FORMAT), expected)
+            batches = list(q.results(row=self.TYPED_FORMAT).batches(1))
+            self.assertEqual(len(batches), 2)
+            self.assertEqual(list(batches[1]["Employee.end"]), ["1.23"])
+            frame = next(q.results(row=self.TYPED_FORMAT).batches(frame=True))
+            self.assertEqual(list(frame.columns), q.views)
+            self.assertEqual(list(frame["Employee.name"]), ["foo", "123"])
+
+        self.do_unpredictable_test(logic)
+
+
+    def testSpool(self):
+        """Should be able to save results to a file, and read them later"""
+        if self.TYPED_FORMAT is None:
+            return
+        q = Query(self.model, self.service)
+        q.add_view("Employee.name", "Employee.end", "Employee.department.name")
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, "results." + self.FORMAT)
+
+        def logic():
+            spooled = q.spool(filename, format=self.FORMAT)
+            self.assertFalse(os.path.exists(filename + ".part"))
+            expected = [("foo", "bar", "baz"), ("123", "1.23", "-1.23")]
+            self.assertEqual(list(spooled), expected)
+            self.assertEqual(list(spooled), expected)
+            with closing(spooled.mmap()) as data:
+                self.assertEqual(len(data), spooled.size)
+            frame = spooled.dataframe()
+            self.assertEqual(list(frame.columns), q.views)
+            self.assertEqual(len(frame), 2)
+
+            empty = os.path.join(directory, "empty." + self.FORMAT)
+            open(empty, "w").close()
+            frame = SpooledResults(empty, self.FORMAT, q.views,
+                                   spooled.types).dataframe()
+            self.assertEqual(list(frame.columns), q.views)
+            self.assertEqual(len(frame), 0)
+
+        class Broken(object):
+            def read(self, size):
+                raise IOError("Connection reset")
+
+            def close(self):
+                pass
+
+        results = q.results(row=self.FORMAT)
+        results.opener = InterMineURLOpener()
+        results.opener.open = lambda *args, **kwargs: Broken()
+
+        try:
+            self.do_unpredictable_test(logic)
+            self.assertRaises(IOError, results.spool, filename + "2")
+            self.assertFalse(os.path.exists(filename + "2.part"))
+            self.assertFalse(os.path.exists(filename + "2"))
+        finally:
+            shutil.rmtree(directory)
+
+
 class TestCSVResults(TestTSVResults):  # pragma: no cover
 
     PATH = "/testservice/csvservice"
     FORMAT = "csv"
     EXPECTED_RESULTS = ['"foo","bar","baz"', '"123","1.23","-1.23"']
+    TYPED_FORMAT = "csvrows"
 
 
 class TestResultObjects(WebserviceTest):  # pragma: no cover
@@ -1368,6 +1930,7 @@ class TestCountResults(TestTSVResults):  # pragma: no cover
 
     PATH = "/testservice/countservice"
     FORMAT = "count"
+    TYPED_FORMAT = None
     EXPECTED_RESULTS = ['25']
     EXPECTED_COUNT = 25
 
@@ -1380,6 +1943,481 @@ class TestCountResults(TestTSVResults):  # pragma: no cover
 
         self.do_unpredictable_test(logic)
 
+    def testCountCache(self):
+        """Should cache counts, and use them for the length of results"""
+        service = Service(self.get_test_root())
+        q = Query(self.model, service)
+        q.add_view("Employee.name", "Employee.age", "Employee.id")
+        opened = []
+        real_open = service.opener.open
+
+        def counting_open(*args, **kwargs):
+            opened.append(args[0])
+            return real_open(*args, **kwargs)
+
+        service.opener.open = counting_open
+        self.assertEqual(len(q), self.EXPECTED_COUNT)
+        self.assertEqual(q.count(), self.EXPECTED_COUNT)
+        self.assertEqual(len(q.results(row="list")), 25)
+        self.assertEqual(len(q.results(row="list", start=20, size=10)), 5)
+        self.assertEqual(len(q.results(row="list", size=10)), 10)
+        self.assertEqual(len(opened), 1)
+
+        q.add_constraint("Employee", "IN", "my-list")
+        q.count()
+        q.count()
+        self.assertEqual(len(opened), 3)
+        service.flush()
+        q.constraint_dict.clear()
+        q.count()
+        # The version is fetched again too, after a flush
+        self.assertEqual(len(opened), 5)
+
+
+class TestTypedParsing(unittest.TestCase):  # pragma: no cover
+
+    def testTypedParsing(self):
+        """Should convert cells according to their types in the model"""
+        types = ["String", "int", "double", "boolean", "Integer"]
+        data = (b"eve\t1540\t0.5\ttrue\t\n"
+                b"zen\t\t1e3\tfalse\t7\n"
+                b"\tx\n")
+        reader = TypedFlatFileIterator(io.BytesIO(data), types)
+        reader.BLOCK_SIZE = 5
+        self.assertEqual(next(reader), ("eve", 1540, 0.5, True, None))
+        self.assertEqual(next(reader), ("zen", None, 1000.0, False, 7))
+        self.assertRaises(WebserviceError, next, reader)
+
+        quoted = io.BytesIO(b'"a, b","2"\r\n"c ""d""",""\r\n')
+        self.assertEqual(list(TypedFlatFileIterator(quoted, ["String", "int"], True)),
+                         [("a, b", 2), ('c "d"', None)])
+
+        # Quoted cells may run over several lines
+        multiline = TypedFlatFileIterator(
+            io.BytesIO(b'"one\ntwo",1\n"three\r\n\nfour",2\n'),
+            ["String", "int"], True)
+        multiline.BLOCK_SIZE = 4
+        self.assertEqual(list(multiline),
+                         [("one\ntwo", 1), ("three\r\n\nfour", 2)])
+
+        ints = column_array([1, 2], "int")
+        self.assertEqual(ints.dtype.kind, "i")
+        floats = column_array([1, None], "int")
+        self.assertEqual(floats.dtype.kind, "f")
+        self.assertTrue(floats[1] != floats[1])
+        self.assertEqual(column_array([True, None], "boolean").dtype.kind, "O")
+        self.assertEqual(column_array([True, False], "boolean").dtype.kind, "b")
+
+
+class TestCompression(unittest.TestCase):  # pragma: no cover
+
+    BODY = (b'{"results":[\n' + b',\n'.join(
+        ('[%d,"x%d"]' % (i, i)).encode('ascii') for i in range(500)) +
+        b'\n],"wasSuccessful":true,"statusCode":200}\n')
+
+    class Response(io.BytesIO):
+        headers = {}
+
+        def info(self):
+            return self.headers
+
+    def gzipped(self, data):
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+            f.write(data)
+        return buf.getvalue()
+
+    def reader(self, data, encoding):
+        reader = DecompressingReader(io.BytesIO(data), encoding)
+        reader.BLOCK_SIZE = 64
+        return reader
+
+    def testStreamedGzip(self):
+        """Should decompress gzipped results line by line"""
+        reader = self.reader(self.gzipped(self.BODY), "gzip")
+        rows = list(JSONIterator(reader, lambda x: x))
+        self.assertEqual(len(rows), 500)
+        self.assertEqual(rows[499], [499, "x499"])
+
+    def testDeflateAndMembers(self):
+        """Should handle zlib and raw deflate, and many gzip members"""
+        raw = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        for data, encoding in [
+                (zlib.compress(self.BODY), "deflate"),
+                (raw.compress(self.BODY) + raw.flush(), "deflate"),
+                (self.gzipped(self.BODY[:100]) + self.gzipped(self.BODY[100:]),
+                 "gzip")]:
+            reader = self.reader(data, encoding)
+            self.assertEqual(reader.readline(), b'{"results":[\n')
+            self.assertEqual(reader.read(7), b'[0,"x0"')
+            self.assertEqual(reader.read(), self.BODY[len(b'{"results":[\n') + 7:])
+            self.assertEqual(reader.read(), b"")
+
+    def testNegotiation(self):
+        """Should ask for compressed responses, and compress large bodies"""
+        requests = []
+        response = TestCompression.Response(self.gzipped(b"hello\nworld\n"))
+        response.headers = {"Content-Encoding": "gzip"}
+
+        def urlopen(req, *args):
+            requests.append(req)
+            return response
+
+        opener = InterMineURLOpener()
+        opener.compress_requests = True
+        real_open_url = intermine.results.open_url
+        intermine.results.open_url = urlopen
+        try:
+            lines = list(opener.open("http://localhost/small", "x=1"))
+            opener.open("http://localhost/big", "x" * 2000)
+        finally:
+            intermine.results.open_url = real_open_url
+        self.assertEqual(lines, [b"hello\n", b"world\n"])
+        small, big = requests
+        self.assertEqual(small.get_header("Accept-encoding"), "gzip, deflate")
+        self.assertIsNone(small.get_header("Content-encoding"))
+        self.assertEqual(big.get_header("Content-encoding"), "gzip")
+        self.assertEqual(zlib.decompress(bytes(big.data), 16 + zlib.MAX_WBITS),
+                         b"x" * 2000)
+        self.assertTrue(opener.clone().compress_requests)
+
+
+class MockURLTest(unittest.TestCase):  # pragma: no cover
+
+    def setUp(self):
+        self.calls = []
+        self.slept = []
+        self.responses = []
+        self.real_open_url = intermine.results.open_url
+
+        def open_url(req, *timeouts):
+            self.calls.append((req, timeouts))
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        intermine.results.open_url = open_url
+        self.opener = InterMineURLOpener()
+        self.opener.policy = RetryPolicy(retries=2, failure_threshold=3,
+                                         read_timeout=5)
+        self.opener.policy.sleep = self.slept.append
+
+    def tearDown(self):
+        intermine.results.open_url = self.real_open_url
+
+    def error(self, url, code, headers=None):
+        return HTTPError(url, code, "Error", headers or {},
+                         io.BytesIO(b'{"error":"Try later"}'))
+
+    def ok(self):
+        return TestCompression.Response(b"ok")
+
+
+class TestRetries(MockURLTest):  # pragma: no cover
+
+    def testRetryAfter(self):
+        """Should retry idempotent requests, waiting as asked"""
+        url = "http://retry-after.example/service/version"
+        self.responses = [self.error(url, 503, {"Retry-After": "2"}),
+                          self.error(url, 502), self.ok()]
+        self.assertEqual(self.opener.open(url).read(), b"ok")
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(self.slept[0], 2)
+        self.assertTrue(0 <= self.slept[1] <= 1)
+        self.assertEqual(self.calls[0][1], (30.0, 5))
+
+        # Errors for requests that cannot be repeated are raised at once
+        self.responses = [self.error(url, 503), self.ok()]
+        self.assertRaises(WebserviceError, self.opener.open, url, "x=1")
+        self.responses = [self.error(url, 503), self.ok()]
+        self.assertEqual(
+            self.opener.open(url, "x=1", idempotent=True).read(), b"ok")
+
+        # As are client errors
+        self.responses = [self.error(url, 404)]
+        self.assertRaises(WebserviceError, self.opener.open, url)
+
+    def testCircuitBreaker(self):
+        """Should stop sending requests to a service that keeps failing"""
+        url = "http://breaker.example/mine/service/query/results"
+        down = URLError("Connection refused")
+        self.responses = [down, down, down]
+        self.assertRaises(URLError, self.opener.open, url)
+        breaker = self.opener.policy.breaker(url)
+        self.assertTrue(breaker.is_open)
+        self.assertRaises(CircuitOpenError, self.opener.open, url + "?x")
+        self.assertEqual(len(self.calls), 3)
+
+        # After the reset timeout, one request may try the service again
+        breaker.opened_at -= breaker.reset_timeout
+        self.responses = [self.ok()]
+        self.assertEqual(self.opener.open(url).read(), b"ok")
+        self.assertFalse(breaker.is_open)
+
+        # Policies with other settings have breakers of their own
+        other = RetryPolicy(failure_threshold=50, reset_timeout=1)
+        self.assertIsNot(other.breaker(url), breaker)
+        self.assertEqual((other.breaker(url).failure_threshold,
+                          other.breaker(url).reset_timeout), (50, 1))
+        self.assertIs(RetryPolicy(failure_threshold=3).breaker(url), breaker)
+
+    def testAbandonedTrial(self):
+        """Should let another request try the service if a trial stops"""
+        url = "http://trial.example/mine/service/query/results"
+        breaker = self.opener.policy.breaker(url)
+        for _ in range(3):
+            breaker.failure()
+        breaker.opened_at -= breaker.reset_timeout
+        self.responses = [ValueError("unknown url type"), self.ok()]
+        self.assertRaises(ValueError, self.opener.open, url)
+        self.assertEqual(self.opener.open(url).read(), b"ok")
+        self.assertFalse(breaker.is_open)
+
+    def testHelpers(self):
+        """Should find service roots, and read Retry-After dates"""
+        self.assertEqual(service_root("https://a.org/b/service/lists?x=1"),
+                         "https://a.org/b/service")
+        self.assertEqual(service_root("http://a.org/mines.json"),
+                         "http://a.org")
+        self.assertEqual(retry_after({"Retry-After": "3"}), 3.0)
+        self.assertEqual(retry_after(
+            {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"},
+            now=1445412470), 10.0)
+        self.assertIsNone(retry_after({}))
+
+
+class TestTimeouts(unittest.TestCase):  # pragma: no cover
+
+    def slow_server(self, delay):
+        """Start a server that waits before sending the response headers"""
+        listener = socket.socket()
+        listener.bind(("localhost", 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+
+        def serve():
+            con, _ = listener.accept()
+            try:
+                con.recv(4096)
+                time.sleep(delay)
+                con.sendall(b"HTTP/1.0 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            finally:
+                con.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return "http://localhost:%d/service/query/results" % (
+            listener.getsockname()[1])
+
+    def testSlowHeaders(self):
+        """Should only limit connecting with the connect timeout"""
+        opener = InterMineURLOpener()
+        opener.policy = RetryPolicy(retries=0, connect_timeout=0.2,
+                                    circuit_breaker=False)
+        with closing(opener.open(self.slow_server(0.5))) as response:
+            self.assertEqual(response.read(), b"ok")
+
+        opener.policy = RetryPolicy(retries=0, connect_timeout=0.2,
+                                    read_timeout=0.2, circuit_breaker=False)
+        self.assertRaises(IOError, opener.open, self.slow_server(0.5))
+
+
+class TestObserverAdapters(MockURLTest):  # pragma: no cover
+
+    def testAdapters(self):
+        """Should log, count and trace failed requests too"""
+        url = "http://observed.example/mine/service/lists"
+        messages = []
+
+        class Logger(object):
+            def warning(self, *args):
+                messages.append(args[0] % args[1:])
+
+        spans = []
+
+        class Span(object):
+            def __init__(self, name, attributes, start_time):
+                self.name = name
+                self.attributes = attributes
+                self.errors = []
+                spans.append(self)
+
+            def record_exception(self, error):
+                self.errors.append(error)
+
+            def end(self, end_time):
+                self.end_time = end_time
+
+        class Tracer(object):
+            def start_span(self, name, attributes, start_time):
+                return Span(name, attributes, start_time)
+
+        metrics = MetricsObserver()
+        self.opener.add_observer(LoggingObserver(Logger()))
+        self.opener.add_observer(metrics)
+        self.opener.add_observer(OpenTelemetryObserver(Tracer()))
+        self.responses = [self.error(url, 404)]
+        self.assertRaises(WebserviceError, self.opener.open, url)
+
+        self.assertIn("GET /lists 404", messages[0])
+        samples = metrics.samples()["intermine_client_errors_total"]
+        self.assertEqual(list(samples.values()), [1])
+        self.assertEqual(spans[0].name, "GET /lists")
+        self.assertEqual(spans[0].attributes["http.status_code"], 404)
+        self.assertEqual(len(spans[0].errors), 1)
+
+
+class TestThrottle(MockURLTest):  # pragma: no cover
+
+    def tearDown(self):
+        MockURLTest.tearDown(self)
+        throttle.reset()
+
+    def testRateLimit(self):
+        """Should space out requests beyond the burst at the given rate"""
+        t = Throttle(rate=10, burst=2)
+        slept = []
+        t.sleep = slept.append
+        for _ in range(4):
+            t.acquire()
+        self.assertEqual(len(slept), 2)
+        self.assertAlmostEqual(slept[0], 0.1, places=2)
+        self.assertAlmostEqual(slept[1], 0.2, places=2)
+
+        t.pause(5)
+        t.acquire()
+        self.assertTrue(slept[-1] > 4)
+
+    def testInFlight(self):
+        """Should hold a slot until the response has been read"""
+        url = "http://throttle.example/mine/service/query/results"
+        t = throttle.configure(url, max_in_flight=1)
+        t.sleep = self.slept.append
+        self.assertIs(throttle.get_throttle(
+            "http://throttle.example/mine/service/lists"), t)
+        self.assertIsNone(throttle.get_throttle("http://other.example/x"))
+
+        self.responses = [self.ok()]
+        response = self.opener.open(url)
+        self.assertFalse(t._slots.acquire(False))
+        self.assertEqual(response.read(), b"ok")
+        self.assertEqual(response.read(), b"")
+        self.assertTrue(t._slots.acquire(False))
+        t.release()
+
+        # Failed requests give back their slot, and slow requests down
+        self.responses = [self.error(url, 429, {"Retry-After": "30"}),
+                          self.ok()]
+        with closing(self.opener.open(url)):
+            self.assertTrue(t.paused_until > time.time() + 20)
+            self.assertTrue(self.slept[-1] > 20)
+        self.assertTrue(t._slots.acquire(False))
+        t.release()
+
+        # As do requests that fail in any other way
+        self.responses = [ValueError("unknown url type")]
+        self.assertRaises(ValueError, self.opener.open, url)
+        self.assertTrue(t._slots.acquire(False))
+        t.release()
+
+    def testServiceLimits(self):
+        """Should set the limits for a service's root when connecting"""
+        service = Service("http://limited.example/mine", lazy=True,
+                          rate_limit=5, max_in_flight=2)
+        t = throttle.get_throttle(service.root + "/query/results")
+        self.assertEqual(t.bucket.rate, 5)
+        self.assertEqual(t.max_in_flight, 2)
+
+    @unittest.skipIf(not P3K, "asyncio is not available")
+    def testAsyncio(self):
+        """Should wait for a slot without blocking an asyncio event loop"""
+        import asyncio
+        t = Throttle(max_in_flight=1)
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(t.acquire_async(loop))
+            waiting = t.acquire_async(loop)
+            loop.call_later(0.05, t.release)
+            loop.run_until_complete(waiting)
+            t.release()
+            self.assertTrue(t._slots.acquire(False))
+        finally:
+            loop.close()
+
+    @unittest.skipIf(not P3K, "asyncio is not available")
+    def testAsyncHandOver(self):
+        """Should hand a slot waited for in an event loop to the request"""
+        import asyncio
+        url = "http://throttle.example/mine/service/query/results"
+        t = throttle.configure(url, max_in_flight=1)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        def request():
+            with closing(self.opener.open(url)) as response:
+                return response.read()
+
+        try:
+            self.responses = [self.ok(), self.ok()]
+            for _ in range(2):
+                loop.run_until_complete(t.__aenter__())
+                read = loop.run_in_executor(None, request)
+                self.assertEqual(loop.run_until_complete(
+                    asyncio.wait_for(read, 5)), b"ok")
+                loop.run_until_complete(t.__aexit__(None, None, None))
+                self.assertTrue(t._slots.acquire(False))
+                t.release()
+
+            # A slot that no request takes is given back
+            loop.run_until_complete(t.acquire_async(loop))
+            t.release()
+            self.assertTrue(t._slots.acquire(False))
+            t.release()
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class TestMockMine(unittest.TestCase):  # pragma: no cover
+    """The mock mine the benchmarks run against"""
+
+    def setUp(self):
+        self.mine = MockMine(rows=25, gzip=True).start()
+        self.service = Service(self.mine.root)
+
+    def tearDown(self):
+        self.mine.stop()
+
+    def testResults(self):
+        """Should make up rows and objects from the view of a query"""
+        q = self.service.select("Class0.attr0", "Class0.attr1",
+                                "Class0.items.ref.attr2")
+        rows = [r for r in q.results(row="list")]
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[2], ["value-2-0", 2 * 31 + 1, 2 / 7.0 + 2])
+        self.assertEqual([r for r in q.results(row="tsvrows", size=3)],
+                         [tuple(r) for r in rows[:3]])
+        objects = [o for o in q.results(row="jsonobjects", start=20)]
+        self.assertEqual(len(objects), 5)
+        self.assertEqual(len(objects[0].items), 2)
+        self.assertTrue(objects[0].items[1].ref.attr2 >= 0)
+        self.assertEqual(q.dataframe().shape, (25, 3))
+
+    def testListUpload(self):
+        """Should keep the lists uploaded to it"""
+        made = self.service.create_list(["a", "b", "c"], "Class0")
+        self.assertEqual(made.size, 3)
+        self.assertIn(made.name, self.mine.uploaded)
+
+    def testRegressions(self):
+        """Should find the benchmarks that got slower than the baseline"""
+        baseline = {"a": {"best": 1.0}, "b": {"best": 1.0}}
+        timings = {"a": {"best": 1.2}, "b": {"best": 1.3}, "c": {"best": 9}}
+        self.assertEqual(regressions(timings, baseline, 0.25),
+                         [("b", 1.0, 1.3)])
+
 
 if __name__ == '__main__':  # pragma: no cover
     server = TestServer()
@@ -1,7 +1,11 @@
+import io
 import unittest
 
 from intermine.webservice import *
 from intermine.lists.list import List
+from intermine.lists.expression import ListExpression
+from intermine.lists import listmanager
+from intermine.lists.listmanager import ListServiceError
 
 from tests.test_core import WebserviceTest
 
@@ -46,6 +50,210 @@ class TestLists(WebserviceTest):  # pragma: no cover
         self.assertRaises(AttributeError, alter_size)
         self.assertRaises(AttributeError, alter_type)
 
+    def testIndexingAndSlicing(self):
+        """Should fetch list members a page at a time, and cache them"""
+        list_a = self.service.get_list("test-list-1")
+        list_a.PAGE_SIZE = 10
+        requests = []
+
+        class MockQuery(object):
+
+            def results(self, row, start, size):
+                requests.append((start, size))
+                return iter(range(start, min(start + size, 42)))
+
+            def __iter__(self):
+                requests.append("all")
+                return iter(range(42))
+
+        list_a.to_query = MockQuery
+        self.assertEqual(list_a[15], 15)
+        self.assertEqual(list_a[11], 11)
+        self.assertEqual(list_a[12:25], list(range(12, 25)))
+        self.assertEqual(list_a[-1], 41)
+        self.assertEqual(list_a[40:30:-3], [40, 37, 34, 31])
+        self.assertEqual(requests, [(10, 10), (20, 10), (40, 10), (30, 10)])
+        self.assertRaises(IndexError, lambda: list_a[42])
+
+        list_a.clear_cache()
+        del requests[:]
+        self.assertEqual(list(list_a), list(range(42)))
+        self.assertEqual(list(list_a), list(range(42)))
+        self.assertEqual(list_a[25], 25)
+        self.assertEqual(requests, ["all"])
+
+    def testUploadBatches(self):
+        """Should split identifiers into batches without reading them all"""
+        manager = self.service._list_manager
+
+        def batches(content, size):
+            return list(manager._identifier_batches(content, size))
+
+        idents = (x for x in ["a", "b", "c", "d", "e"])
+        self.assertEqual(batches(idents, 2),
+                         [('"a"\n"b"', 2), ('"c"\n"d"', 2), ('"e"', 1)])
+        self.assertEqual(batches("a b\n\nc\n", 1),
+                         [("a b", 1), ("c", 1)])
+        file_batches = batches("tests/data/test-identifiers.list", 4)
+        self.assertEqual([n for _, n in file_batches], [4, 2])
+        self.assertTrue(file_batches[0][0].startswith('Karim\n"Not a good id"'))
+        self.assertRaises(ValueError, lambda: batches([], 0))
+
+        # Queries and lists are created by create_list, with every option
+        created = []
+        manager.create_list = lambda *args, **kwargs: created.append(
+            (args, kwargs))
+        manager.upload_list(self.service.get_list("test-list-1"),
+                            name="copy", tags=["t"], add=["DUPLICATE"])
+        del manager.create_list
+        self.assertEqual(created[0][0][2:5], ("copy", None, ["t"]))
+        self.assertEqual(created[0][1], {"add": ["DUPLICATE"]})
+
+    def testBackgroundCleanup(self):
+        """Should not keep the threads that deleted temporary lists"""
+        manager = self.service._list_manager
+        manager._delete_names = lambda names: dict
+        for i in range(5):
+            manager._temp_lists = set(["temp-%d" % i])
+            manager.delete_temporary_lists(wait=False).join()
+        del manager._delete_names
+        self.assertEqual(manager._temp_lists, set())
+        self.assertTrue(len(listmanager._CLEANUP_THREADS) <= 1)
+
+    def testListExpressions(self):
+        """Should simplify list expressions as they are built"""
+        a, b, c = [self.service.get_list(name) for name in
+                   ["test-list-1", "test-list-2", "test-list-3"]]
+        d = "test-list-4"
+
+        intersection = a.lazy() & b & c
+        self.assertEqual(intersection.operator, ListExpression.INTERSECTION)
+        self.assertEqual(len(intersection.operands), 3)
+        self.assertEqual(intersection.intermediate_count, 0)
+
+        subtraction = (a.lazy() | b) - c - d
+        self.assertEqual(subtraction.operator, ListExpression.SUBTRACTION)
+        self.assertEqual([str(x) for x in subtraction.operands],
+                         ["test-list-1", "test-list-2"])
+        self.assertEqual([str(x) for x in subtraction.rights],
+                         ["test-list-3", "test-list-4"])
+
+        combined = (a.lazy() & b) | (c - a.lazy()) | (a ^ b.lazy())
+        self.assertTrue(isinstance(c - a.lazy(), ListExpression))
+        self.assertEqual(combined.operator, ListExpression.UNION)
+        self.assertEqual(combined.intermediate_count, 3)
+
+    def testBulkOperations(self):
+        """Should report on each list in bulk deletions and tagging"""
+        real_opener = self.service.opener
+        requests = []
+
+        class MockOpener(object):
+
+            def read(self, url):
+                return real_opener.read(url)
+
+            def delete(self, uri):
+                requests.append(uri)
+                if "test-list-2" in uri:
+                    return b'{"wasSuccessful":false,"error":"Not yours"}'
+                return b'{"wasSuccessful":true}'
+
+            def open(self, uri, data=None):
+                requests.append(uri)
+                return io.BytesIO(b'{"wasSuccessful":true,"tags":["a","b"]}')
+
+        self.service.opener = MockOpener()
+        outcomes = self.service.bulk_delete_lists(
+            ["test-list-1", "test-list-2", "no-such-list"])
+        self.assertTrue(outcomes["test-list-1"].succeeded)
+        self.assertTrue(outcomes["test-list-1"].result)
+        self.assertFalse(outcomes["test-list-2"].succeeded)
+        self.assertEqual(outcomes["test-list-2"].error.args, ("Not yours",))
+        self.assertFalse(outcomes["no-such-list"].result)
+        self.assertEqual(len(requests), 2)
+        self.assertRaises(
+            ListServiceError,
+            lambda: self.service.delete_lists(["test-list-2"]))
+
+        list_c = self.service.get_list("test-list-3")
+        outcomes = self.service.bulk_add_tags([list_c, "test-list-1"], ["b"])
+        self.assertEqual(outcomes["test-list-1"].result, frozenset(["a", "b"]))
+        self.assertEqual(list_c.tags, frozenset(["a", "b"]))
+
+    def testEnrichmentFormats(self):
+        """Should be able to get enrichment results in several formats"""
+        body = (b'{"results":[\n'
+                b'{"identifier":"GO:1","description":"one","p-value":0.001,'
+                b'"matches":3,"populationAnnotationCount":30},\n'
+                b'{"identifier":"GO:2","description":"two","p-value":"0.02",'
+                b'"matches":1,"populationAnnotationCount":10,"extra":"x"}\n'
+                b'],"wasSuccessful":true,"error":null,"statusCode":200}\n')
+
+        class MockOpener(object):
+
+            def open(self, uri, data=None):
+                return io.BytesIO(body)
+
+        list_a = self.service.get_list("test-list-1")
+        self.service.opener = MockOpener()
+
+        lines = list(list_a.calculate_enrichment("go"))
+        self.assertEqual(lines[0].p_value, 0.001)
+        self.assertEqual(lines[1]["extra"], "x")
+
+        rows = list(list_a.calculate_enrichment("go", row="row"))
+        self.assertEqual(rows[1].p_value, 0.02)
+        self.assertEqual(rows[0]["p-value"], 0.001)
+        self.assertEqual(rows[0].populationAnnotationCount, 30)
+        self.assertEqual(rows[1]["extra"], "x")
+        self.assertRaises(AttributeError, lambda: setattr(rows[0], "foo", 1))
+
+        columns = list_a.calculate_enrichment("go", row="columns")
+        self.assertEqual(columns["identifier"], ["GO:1", "GO:2"])
+        self.assertEqual(columns["p-value"], [0.001, 0.02])
+        self.assertEqual(columns["extra"], [None, "x"])
+
+        df = list_a.calculate_enrichment("go", row="dataframe")
+        self.assertEqual(list(df["matches"]), [3, 1])
+        self.assertRaises(
+            ValueError, lambda: list_a.calculate_enrichment("go", row="foo"))
+
+    def testEnrichmentRunner(self):
+        """Should be able to run many enrichment calculations at once"""
+        body = (b'{"results":[\n'
+                b'{"identifier":"GO:1","description":"one","p-value":0.001,'
+                b'"matches":3,"populationAnnotationCount":30}\n'
+                b'],"wasSuccessful":true,"error":null,"statusCode":200}\n')
+        requested = []
+
+        class MockOpener(object):
+
+            def open(self, uri, data=None):
+                requested.append(uri)
+                return io.BytesIO(body)
+
+        list_a = self.service.get_list("test-list-1")
+        self.service._widgets = {"go": {}, "pathways": {}}
+        self.service.opener = MockOpener()
+
+        outcomes = list(self.service.calculate_enrichments(
+            [(list_a, "go"), ("test-list-1", "pathways", "bg"),
+             (list_a, "nope"), ("no-such-list", "go")]))
+        self.assertEqual(len(outcomes), 4)
+        self.assertEqual(len(requested), 1)
+        by_key = dict(((o.name, o.widget), o) for o in outcomes)
+
+        go = by_key[("test-list-1", "go")]
+        self.assertTrue(go.succeeded)
+        self.assertEqual(go.result[0].p_value, 0.001)
+        pathways = by_key[("test-list-1", "pathways")]
+        self.assertEqual(pathways.background, "bg")
+        self.assertFalse(pathways.succeeded)
+        self.assertTrue(
+            isinstance(by_key[("test-list-1", "nope")].error, ListServiceError))
+        self.assertFalse(by_key[("no-such-list", "go")].succeeded)
+
     def testBadListConstruction(self):
         args = {}
         self.assertRaises(ValueError, lambda: List(**args))
@@ -1,6 +1,8 @@
+import json
 import unittest
 
 from intermine import query_manager as qm
+from intermine.query_manager import QueryManager
 qm.save_mine_and_token('mock', 'x')
 
 
@@ -31,5 +33,89 @@ class QueryManagerTest(unittest.TestCase):
                          "Incorrect format")
 
 
+class MockResponse(object):
+
+    def __init__(self, text=""):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+class MockSession(object):
+
+    def __init__(self, queries):
+        self.headers = {}
+        self.queries = queries
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(("GET", params))
+        if params is None:
+            return MockResponse(json.dumps({"queries": self.queries}))
+        return MockResponse(self.queries[params["filter"]])
+
+    def put(self, url, params=None):
+        self.requests.append(("PUT", params))
+        xml = params["query"]
+        self.queries[qm._query_name(xml)] = xml
+        return MockResponse()
+
+    def delete(self, url):
+        self.requests.append(("DELETE", url))
+        del self.queries[url.split("/")[-1]]
+        return MockResponse()
+
+
+class MockOpener(object):
+
+    def headers(self):
+        return {"Authorization": "Token x"}
+
+
+class MockService(object):
+    root = "http://mock/service"
+    opener = MockOpener()
+    version = 27
+
+
+class QueryManagerObjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = MockSession({
+            "query1": '<query name="query1"></query>',
+            "query2": '<query name="query2"></query>'})
+        self.manager = QueryManager(MockService(), session=self.session)
+
+    def test_catalogue_is_cached(self):
+        self.assertEqual(sorted(self.manager.get_all_query_names()),
+                         ["query1", "query2"])
+        self.assertEqual(self.manager.get_query("query3"), None)
+        self.assertEqual(self.session.requests, [("GET", None)])
+        self.assertEqual(self.session.headers["Authorization"], "Token x")
+        self.manager.invalidate()
+        self.manager.get_all_query_names()
+        self.assertEqual(len(self.session.requests), 2)
+
+    def test_bulk_operations(self):
+        fetched = self.manager.get_queries(["query1", "query2", "query3"])
+        self.assertEqual(fetched["query1"], '<query name="query1"></query>')
+        self.assertEqual(fetched["query3"], None)
+
+        posted = self.manager.post_queries(
+            ['<query name="query3"></query>', '<query name="query4"></query>'])
+        self.assertEqual(posted, {"query3": True, "query4": True})
+        self.assertRaises(ValueError, lambda: self.manager.post_query(
+            '<query name="query3"></query>'))
+        self.assertTrue(self.manager.post_query(
+            '<query name="query3"></query>', replace=True))
+
+        deleted = self.manager.delete_queries(["query1", "query4", "query5"])
+        self.assertEqual(deleted,
+                         {"query1": True, "query4": True, "query5": False})
+        self.assertEqual(sorted(self.manager.get_all_query_names()),
+                         ["query2", "query3"])
+
+
 if __name__ == '__main__':
     unittest.main()
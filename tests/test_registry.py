@@ -1,11 +1,24 @@
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 from intermine import registry
+from intermine.registry import RegistryClient
 
 
 class RegistryTest(unittest.TestCase):
 
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        registry.set_client(RegistryClient(cache_dir=self.cache_dir))
+
+    def tearDown(self):
+        registry.set_client(None)
+        shutil.rmtree(self.cache_dir)
+
     def test_getInfo(self):
         # function returns none is everything runs fine
         self.assertEqual(registry.getInfo('flymine'), None)
@@ -29,5 +42,96 @@ class RegistryTest(unittest.TestCase):
             melanogaste'), "No such mine available")
 
 
+class MockResponse(object):
+
+    def __init__(self, status_code, body=None, etag=None):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.headers = {"ETag": etag} if etag else {}
+
+    def raise_for_status(self):
+        pass
+
+
+class MockSession(object):
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+        self.client = None
+        self.locked = []
+
+    def get(self, url, headers={}, timeout=None):
+        self.requests.append(headers.get("If-None-Match"))
+        if self.client is not None:
+            self.locked.append(self.client._lock.locked())
+        if headers.get("If-None-Match") == self.etag:
+            return MockResponse(304)
+        return MockResponse(200, self.body, self.etag)
+
+
+class RegistryClientTest(unittest.TestCase):
+
+    INSTANCES = {"instances": [
+        {"name": "FlyMine", "namespace": "flymine", "url": "http://fly"},
+        {"name": "HumanMine", "namespace": "humanmine", "url": "http://hs"},
+    ]}
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.session = MockSession(self.INSTANCES, '"v1"')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def client(self, ttl=3600):
+        return RegistryClient(cache_dir=self.cache_dir, ttl=ttl,
+                              session=self.session)
+
+    def test_lookups_share_one_request(self):
+        client = self.client()
+        self.assertEqual(client.instance("flymine")["url"], "http://fly")
+        self.assertEqual(client.instance("HUMANMINE")["url"], "http://hs")
+        self.assertEqual(client.instance("nomine"), None)
+        self.assertEqual(len(client.instances()), 2)
+        self.assertEqual(self.session.requests, [None])
+
+    def test_disk_cache_and_revalidation(self):
+        self.client().instances()
+        # A new client reads the stored response from disk
+        self.assertEqual(self.client().instance("flymine")["name"], "FlyMine")
+        self.assertEqual(self.session.requests, [None])
+        # Expired responses are revalidated with their ETag
+        self.assertEqual(len(self.client(ttl=0).instances()), 2)
+        self.assertEqual(self.session.requests, [None, '"v1"'])
+
+    def test_cache_can_be_cleared(self):
+        client = self.client()
+        client.instances()
+        client.clear_cache()
+        client.instances()
+        self.assertEqual(self.session.requests, [None, None])
+
+    def test_memory_cache_by_default(self):
+        # Only a directory given in the environment is written to
+        self.assertEqual(registry.DEFAULT_CACHE_DIR,
+                         os.environ.get("INTERMINE_CACHE_DIR"))
+        client = RegistryClient(cache_dir=None, session=self.session)
+        self.assertEqual(client.instance("flymine")["url"], "http://fly")
+        self.assertEqual(len(client.instances()), 2)
+        self.assertEqual(self.session.requests, [None])
+        # Nothing was written to disk, so a new client asks again
+        RegistryClient(cache_dir=None, session=self.session).instances()
+        self.assertEqual(self.session.requests, [None, None])
+
+    def test_fetches_without_the_lock(self):
+        client = self.client(ttl=0)
+        self.session.client = client
+        client.instances()
+        client.instances()
+        self.assertEqual(self.session.locked, [False, False])
+
+
 if __name__ == '__main__':
     unittest.main()